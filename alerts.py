@@ -0,0 +1,195 @@
+"""
+Alert rules evaluated on every polled fix.
+
+Rules are compiled once from short specs into a condition function:
+
+    speed>120:30    faster than 120 km/h for 30 seconds
+    battery<20      battery below 20 %
+    stale>900       device fix (lastCoordTs) older than 900 seconds
+    armed           moving while the engine is armed
+
+An optional ":SECONDS" suffix sets how long a condition must hold before
+the alert is triggered. For each rule the engine only keeps when its
+condition started holding and whether it is firing, so every fix costs
+O(1) per rule. A rule fires "triggered" once and "cleared" when the
+condition stops holding; both events go to every sink.
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+
+import requests
+
+_SPEC = re.compile(r"^(speed|battery|stale)\s*([<>])\s*([0-9.]+)\s*(?::\s*([0-9.]+))?$|^(armed)\s*(?::\s*([0-9.]+))?$")
+
+
+class Rule:
+    """A compiled rule and its debounce state."""
+
+    __slots__ = ('name', 'condition', 'value', 'duration', 'needs_armed', 'since', 'active')
+
+    def __init__(self, name, condition, value, duration=0, needs_armed=False):
+        """
+        Args:
+            name: Spec the rule was compiled from
+            condition: Callable (fix, now) -> bool
+            value: Callable (fix, now) -> value reported with the alert
+            duration: Seconds the condition must hold before triggering
+            needs_armed: Only holds while the engine is armed
+        """
+        self.name = name
+        self.condition = condition
+        self.value = value
+        self.duration = duration
+        self.needs_armed = needs_armed
+        self.since = None
+        self.active = False
+
+
+def _fix_age(fix, now):
+    return now - fix.last_coord_ts / 1000 if fix.last_coord_ts is not None else None
+
+
+def compile_rule(spec):
+    """Compile a rule spec (see module docstring); raise ValueError if invalid."""
+    match = _SPEC.match(spec.strip())
+    if not match:
+        raise ValueError(f"Invalid alert rule: {spec!r} (use e.g. speed>120:30, battery<20, stale>900, armed)")
+    field, op, threshold, duration, armed, armed_duration = match.groups()
+    name = spec.strip()
+    if armed:
+        return Rule(name, lambda fix, now: fix.status == 'MOVING', lambda fix, now: fix.speed,
+                    float(armed_duration or 0), needs_armed=True)
+
+    threshold = float(threshold)
+    if field == 'speed':
+        value = lambda fix, now: fix.speed
+    elif field == 'battery':
+        value = lambda fix, now: fix.battery
+    else:
+        value = _fix_age
+    if op == '>':
+        condition = lambda fix, now: (v := value(fix, now)) is not None and v > threshold
+    else:
+        condition = lambda fix, now: (v := value(fix, now)) is not None and v < threshold
+    return Rule(name, condition, value, float(duration or 0))
+
+
+class AlertEngine:
+    """Evaluate rules on each fix and send triggered/cleared alerts to sinks."""
+
+    def __init__(self, rules, sinks=(), armed=False, logger=None):
+        """
+        Args:
+            rules: Rule objects or specs
+            sinks: Callables receiving each alert dict
+            armed: Whether 'armed' rules are enabled
+            logger: Logger for failing sinks (default: root logger)
+        """
+        self.rules = tuple(compile_rule(r) if isinstance(r, str) else r for r in rules)
+        self.sinks = tuple(sinks)
+        self.armed = armed
+        self.logger = logger or logging.getLogger()
+        self.evaluated = 0
+        self.fired = 0
+
+    def evaluate(self, fix, now):
+        """Evaluate every rule on a fix (Position) at epoch time now; return the alerts sent."""
+        alerts = []
+        for rule in self.rules:
+            if (self.armed or not rule.needs_armed) and rule.condition(fix, now):
+                if rule.since is None:
+                    rule.since = now
+                if not rule.active and now - rule.since >= rule.duration:
+                    rule.active = True
+                    alerts.append(self._alert(rule, 'triggered', fix, now))
+            else:
+                rule.since = None
+                if rule.active:
+                    rule.active = False
+                    alerts.append(self._alert(rule, 'cleared', fix, now))
+        self.evaluated += len(self.rules)
+        for alert in alerts:
+            self.fired += 1
+            for sink in self.sinks:
+                try:
+                    sink(alert)
+                except Exception as e:
+                    self.logger.error("Alert sink %s failed: %s", sink, e)
+        return alerts
+
+    @staticmethod
+    def _alert(rule, event, fix, now):
+        return {
+            "rule": rule.name,
+            "event": event,
+            "time": now,
+            "value": rule.value(fix, now),
+            "lng": fix.lng,
+            "lat": fix.lat,
+            "status": fix.status,
+        }
+
+    def stats(self):
+        return {
+            "rules": len(self.rules),
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+            "active": [rule.name for rule in self.rules if rule.active],
+        }
+
+
+class LogSink:
+    """Log alerts."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def __call__(self, alert):
+        self.logger.warning("Alert %s: %s (value %s) at %s, %s", alert["event"], alert["rule"],
+                            alert["value"], alert["lng"], alert["lat"])
+
+
+class WebhookSink:
+    """POST alerts as JSON to a (local) webhook, e.g. a Home Assistant webhook trigger.
+
+    Requests are sent by a background thread, so a slow endpoint never
+    delays ingest; alerts are dropped with a warning when queue_size are
+    already waiting.
+    """
+
+    def __init__(self, url, timeout=5, queue_size=100, logger=None):
+        self.url = url
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger()
+        self._queue_size = queue_size
+        self._pid = None
+
+    def _start(self):
+        # Started lazily so a forked pipeline stage gets its own thread
+        self._pid = os.getpid()
+        self._queue = queue.Queue(self._queue_size)
+        threading.Thread(target=self._run, name="alert-webhook", daemon=True).start()
+
+    def __call__(self, alert):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.logger.warning("Alert webhook queue full, dropping %s %s", alert["rule"], alert["event"])
+
+    def _run(self):
+        session = requests.Session()
+        while True:
+            alert = self._queue.get()
+            try:
+                session.post(self.url, json=alert, timeout=self.timeout).raise_for_status()
+            except requests.RequestException as e:
+                self.logger.error("Alert webhook %s failed: %s", self.url, e)
+
+    def __repr__(self):
+        return f"WebhookSink({self.url})"
@@ -0,0 +1,198 @@
+"""
+Vectorized analytics over stored location history.
+
+History is loaded once into NumPy column arrays (see Track) and every
+statistic is computed with array operations instead of per-row loops.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+
+KMH_TO_MS = 1 / 3.6
+
+
+@dataclass
+class Track:
+    """Chronological fixes as column arrays."""
+
+    time: np.ndarray     # epoch seconds, float64
+    lng: np.ndarray      # degrees, float64
+    lat: np.ndarray      # degrees, float64
+    speed: np.ndarray    # km/h as reported, float64 (NaN when missing)
+    moving: np.ndarray   # status == 'MOVING', bool
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a track from chronological (creation_ts, lng, lat, speed, status) rows."""
+        n = len(rows)
+        time = np.empty(n)
+        lng = np.empty(n)
+        lat = np.empty(n)
+        speed = np.empty(n)
+        moving = np.empty(n, dtype=bool)
+        for i, (ts, row_lng, row_lat, row_speed, status) in enumerate(rows):
+            time[i] = ts.timestamp() if hasattr(ts, 'timestamp') else ts
+            lng[i] = row_lng
+            lat[i] = row_lat
+            speed[i] = np.nan if row_speed is None else row_speed
+            moving[i] = status == 'MOVING'
+        return cls(time, lng, lat, speed, moving)
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """Element-wise great-circle distance in metres."""
+    lng1, lat1, lng2, lat2 = (np.radians(a) for a in (lng1, lat1, lng2, lat2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def segment_distances(track):
+    """Distance in metres between each fix and the next (length n - 1)."""
+    return haversine(track.lng[:-1], track.lat[:-1], track.lng[1:], track.lat[1:])
+
+
+def total_distance(track):
+    """Distance travelled in metres."""
+    if len(track) < 2:
+        return 0.0
+    return float(segment_distances(track).sum())
+
+
+def _runs(mask):
+    """Return (start, end) index pairs of consecutive True runs, end exclusive."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
+def detect_stops(track, max_speed_ms=0.5, min_duration_s=300):
+    """Find stops: runs of fixes that did not move faster than max_speed_ms.
+
+    A fix is stationary when it is reported AT_REST or when the derived
+    speed to the next fix is below max_speed_ms. Runs spanning at least
+    min_duration_s become stops.
+
+    Returns a list of dicts with start, end, duration, lng, lat and points.
+    """
+    n = len(track)
+    if n < 2:
+        return []
+    dt = np.diff(track.time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived = segment_distances(track) / dt
+    slow = np.append(derived < max_speed_ms, False)
+    stationary = slow | ~track.moving
+
+    starts, ends = _runs(stationary)
+    last = ends - 1
+    durations = track.time[last] - track.time[starts]
+    keep = durations >= min_duration_s
+
+    # Centroid of each stop via cumulative sums, no per-stop loop over fixes
+    csum_lng = np.concatenate(([0.0], np.cumsum(track.lng)))
+    csum_lat = np.concatenate(([0.0], np.cumsum(track.lat)))
+    counts = ends - starts
+    lng = (csum_lng[ends] - csum_lng[starts]) / counts
+    lat = (csum_lat[ends] - csum_lat[starts]) / counts
+
+    return [{
+        "start": float(track.time[s]),
+        "end": float(track.time[e]),
+        "duration": float(d),
+        "lng": float(x),
+        "lat": float(y),
+        "points": int(c)
+    } for s, e, d, x, y, c in zip(starts[keep], last[keep], durations[keep],
+                                  lng[keep], lat[keep], counts[keep])]
+
+
+def speed_percentiles(track, percentiles=(50, 75, 90, 95, 99), moving_only=True):
+    """Percentiles of the reported speed in km/h."""
+    speeds = track.speed[track.moving] if moving_only else track.speed
+    speeds = speeds[~np.isnan(speeds)]
+    if not len(speeds):
+        return {}
+    values = np.percentile(speeds, percentiles)
+    return {f"p{p}": round(float(v), 2) for p, v in zip(percentiles, values)}
+
+
+def speed_histogram(track, bin_kmh=10, moving_only=True):
+    """Count of fixes per speed bin, as {bin_start_kmh: count}."""
+    speeds = track.speed[track.moving] if moving_only else track.speed
+    speeds = speeds[~np.isnan(speeds)]
+    if not len(speeds):
+        return {}
+    counts = np.bincount((speeds // bin_kmh).astype(np.int64))
+    return {int(i * bin_kmh): int(c) for i, c in enumerate(counts) if c}
+
+
+def _outlier_mask(track, threshold_ms2):
+    """Return (accel, mask) where mask flags |accel| above threshold_ms2."""
+    dt = np.diff(track.time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accel = np.diff(track.speed * KMH_TO_MS) / dt
+    finite = np.nan_to_num(accel, nan=0.0, posinf=0.0, neginf=0.0)
+    return accel, np.abs(finite) > threshold_ms2
+
+
+def acceleration_outliers(track, threshold_ms2=4.0):
+    """Fixes whose speed changed faster than threshold_ms2 from the previous one.
+
+    Returns a list of dicts with time, lng, lat and acceleration in m/s².
+    """
+    if len(track) < 2:
+        return []
+    accel, mask = _outlier_mask(track, threshold_ms2)
+    idx = np.flatnonzero(mask)
+    return [{
+        "time": float(track.time[i + 1]),
+        "lng": float(track.lng[i + 1]),
+        "lat": float(track.lat[i + 1]),
+        "acceleration": round(float(accel[i]), 2)
+    } for i in idx]
+
+
+def summarize(track, min_stop_s=300, accel_threshold_ms2=4.0):
+    """Headline statistics of a track as a JSON-serializable dict."""
+    if not len(track):
+        return {"points": 0}
+    if len(track) > 1:
+        moving_time = float(np.diff(track.time)[track.moving[:-1]].sum())
+        outliers = int(np.count_nonzero(_outlier_mask(track, accel_threshold_ms2)[1]))
+    else:
+        moving_time, outliers = 0.0, 0
+    speeds = track.speed[~np.isnan(track.speed)]
+    return {
+        "points": len(track),
+        "start": float(track.time[0]),
+        "end": float(track.time[-1]),
+        "distance_km": round(total_distance(track) / 1000, 3),
+        "moving_time_s": round(moving_time, 1),
+        "max_speed": float(speeds.max()) if len(speeds) else None,
+        "speed_percentiles": speed_percentiles(track),
+        "stops": len(detect_stops(track, min_duration_s=min_stop_s)),
+        "acceleration_outliers": outliers
+    }
+
+
+REPORTS = ('summary', 'stops', 'speeds', 'outliers')
+
+
+def report(track, name='summary'):
+    """Compute one of REPORTS for a track."""
+    if name == 'stops':
+        return detect_stops(track)
+    if name == 'speeds':
+        return {"percentiles": speed_percentiles(track), "histogram": speed_histogram(track)}
+    if name == 'outliers':
+        return acceleration_outliers(track)
+    if name == 'summary':
+        return summarize(track)
+    raise ValueError(f"Unknown report: {name}")
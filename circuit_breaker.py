@@ -0,0 +1,157 @@
+"""
+Circuit breaker for upstream calls and latency stats of polling loops.
+
+A CircuitBreaker counts consecutive failures of one upstream host:
+
+    closed     requests pass; failure_threshold failures in a row open it
+    open       requests are refused without touching the network until
+               reset_timeout has passed
+    half_open  one trial request passes; success closes the breaker,
+               failure opens it again for twice as long (up to max_timeout)
+
+So an outage costs one cheap refusal per poll instead of a request that
+hangs until its timeout, and the process keeps running and recovers by
+itself when the host answers again.
+"""
+
+import collections
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker of one upstream."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, max_timeout=600, logger=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            name: Upstream name for logs
+            failure_threshold: Consecutive failures that open the breaker
+            reset_timeout: Seconds the breaker first stays open
+            max_timeout: Upper bound of the doubling open time
+            logger: Logger for state changes (None: no logging)
+            clock: Monotonic time source
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.logger = logger
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self._timeout = reset_timeout
+        self._opened_at = None
+        self._trial = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a request may be sent now; moves open to half_open once the timeout passed."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self._clock() - self._opened_at >= self._timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a trial request through (0 when not open)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._timeout - self._clock())
+
+    def cancel(self):
+        """A request allowed by allow() was not sent; the next one may be the trial."""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self.state != CLOSED:
+                self._timeout = self.reset_timeout
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_timeout)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self._trial = False
+        self._opened_at = self._clock()
+        self.opened += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if self.logger is not None:
+            log = self.logger.warning if state == OPEN else self.logger.info
+            log("Circuit breaker %s: %s -> %s%s", self.name, self.state, state,
+                f" for {self._timeout:.0f}s after {self.failures} failures" if state == OPEN else "")
+        self.state = state
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class CycleStats:
+    """Latency and outcome of the last cycles of a polling loop."""
+
+    def __init__(self, window=1000):
+        """
+        Args:
+            window: Cycles kept for the latency percentiles
+        """
+        self._latencies = collections.deque(maxlen=window)
+        self.cycles = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error = None
+
+    def record(self, seconds, error=None):
+        """Record one cycle and the exception it ended with, if any."""
+        self._latencies.append(seconds)
+        self.cycles += 1
+        if error is None:
+            self.consecutive_errors = 0
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = str(error)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        n = len(latencies)
+
+        def percentile(p):
+            return round(latencies[min(n - 1, int(p * n))] * 1000, 1) if n else None
+
+        return {
+            "cycles": self.cycles,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "last_error": self.last_error,
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        }
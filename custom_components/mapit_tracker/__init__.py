@@ -2,14 +2,19 @@
 from __future__ import annotations
 
 import logging
+import time
 from datetime import timedelta
+from functools import partial
+from typing import Any
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import device_registry as dr, entity_registry as er
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
-from .mapit_api import MapitAPI
+from .alerts import CONF_ARMED, EVENT_ALERT, AlertEngine, rules_from_options
+from .mapit_api import MapitAPI, VehicleState
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -19,26 +24,84 @@ PLATFORMS: list[Platform] = [Platform.DEVICE_TRACKER, Platform.SENSOR]
 # Polling interval - every 30 seconds
 SCAN_INTERVAL = timedelta(seconds=30)
 
+# A cached summary younger than this is shown at startup while a fresh one loads
+SUMMARY_MAX_STALENESS = timedelta(hours=1)
 
-async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Set up Mapit Motorcycle Tracker from a config entry."""
-    _LOGGER.debug("Setting up Mapit Tracker integration")
+# Unique ID suffixes used before entities were created per vehicle
+LEGACY_UNIQUE_ID_SUFFIXES = (
+    "tracker", "speed", "status", "battery", "hdop", "odometer", "last_coord_ts"
+)
+
+# Key in hass.data[DOMAIN] holding the per-account API clients
+DATA_CLIENTS = "clients"
+
+
+async def async_get_client(hass: HomeAssistant, data: dict[str, Any]) -> MapitAPI:
+    """Return the shared API client for an account, creating it if needed.
+
+    Config entries and config flows for the same account share one client,
+    so they share its tokens and its token cache file.
+    """
+    clients: dict[str, MapitAPI] = hass.data.setdefault(DOMAIN, {}).setdefault(
+        DATA_CLIENTS, {}
+    )
+    key = data["username"].strip().lower()
+    api = clients.get(key)
+
+    if api is not None and api.password == data["password"]:
+        return api
 
-    # Create API instance
     api = MapitAPI(
-        username=entry.data["username"],
-        password=entry.data["password"],
-        identity_pool_id=entry.data["identity_pool_id"],
-        user_pool_id=entry.data["user_pool_id"],
-        user_pool_client_id=entry.data["user_pool_client_id"],
+        username=data["username"],
+        password=data["password"],
+        identity_pool_id=data["identity_pool_id"],
+        user_pool_id=data["user_pool_id"],
+        user_pool_client_id=data["user_pool_client_id"],
         hass=hass,
     )
+    await hass.async_add_executor_job(api.load_cached_tokens)
+    clients[key] = api
+    return api
+
+
+def async_release_client(hass: HomeAssistant, username: str) -> None:
+    """Drop the shared client for an account once no entry uses it."""
+    key = username.strip().lower()
+    in_use = any(
+        entry.data["username"].strip().lower() == key
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.entry_id in hass.data.get(DOMAIN, {})
+    )
+    if not in_use:
+        hass.data.get(DOMAIN, {}).get(DATA_CLIENTS, {}).pop(key, None)
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Set up Mapit Motorcycle Tracker from a config entry."""
+    _LOGGER.debug("Setting up Mapit Tracker integration")
+
+    # Reuse the account's API client (possibly authenticated by the config flow)
+    api = await async_get_client(hass, entry.data)
 
     # Create coordinator for data updates
-    coordinator = MapitDataUpdateCoordinator(hass, api)
+    coordinator = MapitDataUpdateCoordinator(hass, api, dict(entry.options))
+
+    # Serve the last summary from disk right away and revalidate in the
+    # background; without a usable cache, fetch initial data as before
+    cached = await hass.async_add_executor_job(
+        api.load_cached_summary, SUMMARY_MAX_STALENESS.total_seconds()
+    )
+    if cached:
+        coordinator.async_set_updated_data(cached)
+        entry.async_create_background_task(
+            hass, coordinator.async_refresh(), f"{DOMAIN} revalidate summary"
+        )
+    else:
+        await coordinator.async_config_entry_first_refresh()
 
-    # Fetch initial data
-    await coordinator.async_config_entry_first_refresh()
+    # Entities created before multi-vehicle support belong to the first vehicle
+    if coordinator.data:
+        await _async_migrate_single_vehicle(hass, entry, next(iter(coordinator.data)))
 
     # Store coordinator
     hass.data.setdefault(DOMAIN, {})
@@ -47,9 +110,17 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Forward setup to platforms
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    # Alert rules are compiled at setup, so reload when the options change
+    entry.async_on_unload(entry.add_update_listener(_async_options_updated))
+
     return True
 
 
+async def _async_options_updated(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the entry to apply new alert options."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     _LOGGER.debug("Unloading Mapit Tracker integration")
@@ -58,28 +129,90 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        coordinator = hass.data[DOMAIN].pop(entry.entry_id)
+        # Persist the last revalidation so a restart can serve it right away
+        await hass.async_add_executor_job(coordinator.api.summary_cache.flush)
+        async_release_client(hass, entry.data["username"])
 
     return unload_ok
 
 
+async def _async_migrate_single_vehicle(
+    hass: HomeAssistant, entry: ConfigEntry, vehicle_id: str
+) -> None:
+    """Move the single-vehicle device and entity IDs to per-vehicle IDs."""
+    legacy_prefix = f"{entry.entry_id}_"
+
+    @callback
+    def _migrate_unique_id(entity_entry: er.RegistryEntry) -> dict[str, Any] | None:
+        suffix = entity_entry.unique_id.removeprefix(legacy_prefix)
+        if suffix not in LEGACY_UNIQUE_ID_SUFFIXES:
+            return None
+        return {"new_unique_id": f"{legacy_prefix}{vehicle_id}_{suffix}"}
+
+    await er.async_migrate_entries(hass, entry.entry_id, _migrate_unique_id)
+
+    device_registry = dr.async_get(hass)
+    device = device_registry.async_get_device(identifiers={(DOMAIN, entry.entry_id)})
+    if device is not None:
+        device_registry.async_update_device(
+            device.id, new_identifiers={(DOMAIN, f"{legacy_prefix}{vehicle_id}")}
+        )
+
+
 class MapitDataUpdateCoordinator(DataUpdateCoordinator):
     """Class to manage fetching Mapit data."""
 
-    def __init__(self, hass: HomeAssistant, api: MapitAPI) -> None:
+    def __init__(
+        self, hass: HomeAssistant, api: MapitAPI, options: dict[str, Any] | None = None
+    ) -> None:
         """Initialize."""
         self.api = api
+        options = options or {}
+        self.alert_rules = rules_from_options(options)
+        self.alerts_armed = bool(options.get(CONF_ARMED))
+        # One engine per vehicle, created on its first update
+        self._alerts: dict[str, AlertEngine] = {}
 
         super().__init__(
             hass,
             _LOGGER,
             name=DOMAIN,
             update_interval=SCAN_INTERVAL,
+            # Only notify entities when the parsed snapshot actually changed
+            always_update=False,
         )
 
     async def _async_update_data(self):
-        """Fetch data from API."""
+        """Fetch data from API.
+
+        Returns only the parsed fields so that consecutive snapshots compare
+        equal when nothing changed and listener callbacks are skipped.
+        """
         try:
-            return await self.hass.async_add_executor_job(self.api.get_current_status)
+            data = await self.hass.async_add_executor_job(self.api.get_current_status)
         except Exception as err:
             raise UpdateFailed(f"Error communicating with API: {err}") from err
+        if self.alert_rules:
+            self._evaluate_alerts(data)
+        return data
+
+    @callback
+    def _evaluate_alerts(self, data: dict[str, VehicleState]) -> None:
+        """Run the alert rules on a fresh snapshot of every vehicle."""
+        now = time.time()
+        for vehicle_id, state in data.items():
+            engine = self._alerts.get(vehicle_id)
+            if engine is None:
+                engine = self._alerts[vehicle_id] = AlertEngine(
+                    self.alert_rules,
+                    partial(self._fire_alert, vehicle_id, state.name),
+                    armed=self.alerts_armed,
+                )
+            engine.evaluate(state, now)
+
+    @callback
+    def _fire_alert(self, vehicle_id: str, name: str | None, alert: dict[str, Any]) -> None:
+        """Fire an alert transition on the event bus."""
+        _LOGGER.info("Alert %s for %s: %s", alert["event"], name or vehicle_id, alert["rule"])
+        self.hass.bus.async_fire(EVENT_ALERT, {"vehicle_id": vehicle_id, "name": name, **alert})
@@ -0,0 +1,142 @@
+"""Alert rules evaluated on every coordinator update.
+
+Same rule specs as the standalone checker (``speed>120:30``, ``battery<20``,
+``stale>900``, ``armed``): each rule is compiled once into a condition and
+only keeps when that condition started holding and whether it is firing,
+so every update costs O(1) per rule and vehicle.
+"""
+from __future__ import annotations
+
+import re
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from .mapit_api import VehicleState
+
+EVENT_ALERT = "mapit_tracker_alert"
+
+CONF_SPEED_LIMIT = "alert_speed_limit"
+CONF_SPEED_DURATION = "alert_speed_duration"
+CONF_BATTERY_BELOW = "alert_battery_below"
+CONF_STALE_MINUTES = "alert_stale_minutes"
+CONF_ARMED = "alert_armed"
+
+_SPEC = re.compile(
+    r"^(speed|battery|stale)\s*([<>])\s*([0-9.]+)\s*(?::\s*([0-9.]+))?$"
+    r"|^(armed)\s*(?::\s*([0-9.]+))?$"
+)
+
+
+class Rule:
+    """A compiled rule and its debounce state."""
+
+    __slots__ = ("name", "condition", "value", "duration", "needs_armed", "since", "active")
+
+    def __init__(
+        self,
+        name: str,
+        condition: Callable[[VehicleState, float], bool],
+        value: Callable[[VehicleState, float], Any],
+        duration: float = 0,
+        needs_armed: bool = False,
+    ) -> None:
+        """Initialize."""
+        self.name = name
+        self.condition = condition
+        self.value = value
+        self.duration = duration
+        self.needs_armed = needs_armed
+        self.since: float | None = None
+        self.active = False
+
+
+def _fix_age(state: VehicleState, now: float) -> float | None:
+    if state.last_coord_ts is None:
+        return None
+    return now - state.last_coord_ts / 1000
+
+
+def compile_rule(spec: str) -> Rule:
+    """Compile a rule spec; raise ValueError if it is invalid."""
+    match = _SPEC.match(spec.strip())
+    if not match:
+        raise ValueError(f"Invalid alert rule: {spec!r}")
+    field, op, threshold, duration, armed, armed_duration = match.groups()
+    name = spec.strip()
+    if armed:
+        return Rule(
+            name,
+            lambda state, now: state.status == "MOVING",
+            lambda state, now: state.speed,
+            float(armed_duration or 0),
+            needs_armed=True,
+        )
+
+    limit = float(threshold)
+    value: Callable[[VehicleState, float], Any]
+    if field == "speed":
+        value = lambda state, now: state.speed  # noqa: E731
+    elif field == "battery":
+        value = lambda state, now: state.battery  # noqa: E731
+    else:
+        value = _fix_age
+    if op == ">":
+        condition = lambda state, now: (v := value(state, now)) is not None and v > limit  # noqa: E731
+    else:
+        condition = lambda state, now: (v := value(state, now)) is not None and v < limit  # noqa: E731
+    return Rule(name, condition, value, float(duration or 0))
+
+
+def rules_from_options(options: dict[str, Any]) -> list[str]:
+    """Build the rule specs configured in the options flow (0 disables a rule)."""
+    specs = []
+    if speed := options.get(CONF_SPEED_LIMIT):
+        specs.append(f"speed>{speed}:{options.get(CONF_SPEED_DURATION, 0)}")
+    if battery := options.get(CONF_BATTERY_BELOW):
+        specs.append(f"battery<{battery}")
+    if stale := options.get(CONF_STALE_MINUTES):
+        specs.append(f"stale>{stale * 60}")
+    if options.get(CONF_ARMED):
+        specs.append("armed")
+    return specs
+
+
+class AlertEngine:
+    """Evaluate rules on each update of one vehicle and report transitions."""
+
+    def __init__(
+        self,
+        rules: Iterable[str | Rule],
+        sink: Callable[[dict[str, Any]], None],
+        armed: bool = False,
+    ) -> None:
+        """Initialize."""
+        self.rules = tuple(compile_rule(r) if isinstance(r, str) else r for r in rules)
+        self.sink = sink
+        self.armed = armed
+
+    def evaluate(self, state: VehicleState, now: float) -> None:
+        """Evaluate every rule and send triggered/cleared alerts to the sink."""
+        for rule in self.rules:
+            if (self.armed or not rule.needs_armed) and rule.condition(state, now):
+                if rule.since is None:
+                    rule.since = now
+                if not rule.active and now - rule.since >= rule.duration:
+                    rule.active = True
+                    self.sink(self._alert(rule, "triggered", state, now))
+            else:
+                rule.since = None
+                if rule.active:
+                    rule.active = False
+                    self.sink(self._alert(rule, "cleared", state, now))
+
+    @staticmethod
+    def _alert(rule: Rule, event: str, state: VehicleState, now: float) -> dict[str, Any]:
+        return {
+            "rule": rule.name,
+            "event": event,
+            "value": rule.value(state, now),
+            "latitude": state.latitude,
+            "longitude": state.longitude,
+            "status": state.status,
+        }
@@ -7,11 +7,18 @@ from typing import Any
 import voluptuous as vol
 
 from homeassistant import config_entries
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 
-from .mapit_api import MapitAPI
+from . import async_get_client, async_release_client
+from .alerts import (
+    CONF_ARMED,
+    CONF_BATTERY_BELOW,
+    CONF_SPEED_DURATION,
+    CONF_SPEED_LIMIT,
+    CONF_STALE_MINUTES,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -33,21 +40,15 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
 
     Data has the keys from STEP_USER_DATA_SCHEMA with values provided by the user.
     """
-    # Create API instance to test connection
-    api = MapitAPI(
-        username=data["username"],
-        password=data["password"],
-        identity_pool_id=data["identity_pool_id"],
-        user_pool_id=data["user_pool_id"],
-        user_pool_client_id=data["user_pool_client_id"],
-        hass=hass,
-    )
+    # Use the shared client so the entry set up afterwards reuses its tokens
+    api = await async_get_client(hass, data)
 
     # Try to authenticate
     try:
         await hass.async_add_executor_job(api.authenticate)
     except Exception as exc:
         _LOGGER.error("Failed to authenticate: %s", exc)
+        async_release_client(hass, data["username"])
         raise InvalidAuth from exc
 
     # Return info to be stored in the config entry
@@ -86,6 +87,49 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             step_id="user", data_schema=STEP_USER_DATA_SCHEMA, errors=errors
         )
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> OptionsFlowHandler:
+        """Get the options flow for this handler."""
+        return OptionsFlowHandler(config_entry)
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle the alert options; a limit of 0 disables its rule."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        """Initialize options flow."""
+        self._entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the alert rules."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self._entry.options
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_SPEED_LIMIT, default=options.get(CONF_SPEED_LIMIT, 0)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                vol.Optional(
+                    CONF_SPEED_DURATION, default=options.get(CONF_SPEED_DURATION, 30)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                vol.Optional(
+                    CONF_BATTERY_BELOW, default=options.get(CONF_BATTERY_BELOW, 0)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+                vol.Optional(
+                    CONF_STALE_MINUTES, default=options.get(CONF_STALE_MINUTES, 0)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                vol.Optional(CONF_ARMED, default=options.get(CONF_ARMED, False)): bool,
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema)
+
 
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
@@ -1,18 +1,27 @@
 """Support for Mapit Motorcycle device tracker."""
 from __future__ import annotations
 
+from datetime import timedelta
 import logging
 
 from homeassistant.components.device_tracker import SourceType, TrackerEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 
 from . import DOMAIN, MapitDataUpdateCoordinator
+from .entity import MapitEntity, async_setup_vehicle_entities
 
 _LOGGER = logging.getLogger(__name__)
 
+# Fields whose change always triggers a state write
+GATED_FIELDS = ("latitude", "longitude", "speed", "status", "odometer")
+
+# Attributes that change on nearly every fix are refreshed at most this often
+# unless one of the gated fields changed as well
+THROTTLED_ATTRIBUTE_INTERVAL = timedelta(minutes=10)
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -22,16 +31,17 @@ async def async_setup_entry(
     """Set up the Mapit device tracker from config entry."""
     coordinator: MapitDataUpdateCoordinator = hass.data[DOMAIN][config_entry.entry_id]
 
-    async_add_entities(
-        [MapitDeviceTracker(coordinator, config_entry)],
-        True,
+    async_setup_vehicle_entities(
+        coordinator,
+        config_entry,
+        async_add_entities,
+        lambda vehicle_id: [MapitDeviceTracker(coordinator, config_entry, vehicle_id)],
     )
 
 
-class MapitDeviceTracker(CoordinatorEntity, TrackerEntity):
+class MapitDeviceTracker(MapitEntity, TrackerEntity):
     """Representation of a Mapit motorcycle tracker."""
 
-    _attr_has_entity_name = True
     _attr_name = None
     _attr_icon = "mdi:motorcycle"
 
@@ -39,32 +49,56 @@ class MapitDeviceTracker(CoordinatorEntity, TrackerEntity):
         self,
         coordinator: MapitDataUpdateCoordinator,
         config_entry: ConfigEntry,
+        vehicle_id: str,
     ) -> None:
         """Initialize the tracker."""
-        super().__init__(coordinator)
-        self._config_entry = config_entry
-        self._attr_unique_id = f"{config_entry.entry_id}_tracker"
-
-        # Device info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, config_entry.entry_id)},
-            "name": "Motorcycle",
-            "manufacturer": "Mapit",
-            "model": "Vehicle Tracker",
-        }
+        super().__init__(coordinator, config_entry, vehicle_id)
+        self._attr_unique_id = f"{config_entry.entry_id}_{vehicle_id}_tracker"
+
+        self._snapshot = None
+        self._last_written = None
+        self._last_available = None
+
+    def _gated_snapshot(self) -> tuple | None:
+        """Return the fields that always warrant a state write."""
+        data = self.vehicle_data
+        if not data:
+            return None
+        return tuple(getattr(data, key) for key in GATED_FIELDS)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Skip state writes when only throttled attributes changed."""
+        snapshot = self._gated_snapshot()
+        if (
+            self._last_written is not None
+            and self.available == self._last_available
+            and snapshot == self._snapshot
+            and dt_util.utcnow() - self._last_written < THROTTLED_ATTRIBUTE_INTERVAL
+        ):
+            return
+        self.async_write_ha_state()
+
+    @callback
+    def async_write_ha_state(self) -> None:
+        """Write the state and remember what was written."""
+        self._snapshot = self._gated_snapshot()
+        self._last_written = dt_util.utcnow()
+        self._last_available = self.available
+        super().async_write_ha_state()
 
     @property
     def latitude(self) -> float | None:
         """Return latitude value of the device."""
-        if self.coordinator.data:
-            return self.coordinator.data.get("latitude")
+        if self.vehicle_data:
+            return self.vehicle_data.latitude
         return None
 
     @property
     def longitude(self) -> float | None:
         """Return longitude value of the device."""
-        if self.coordinator.data:
-            return self.coordinator.data.get("longitude")
+        if self.vehicle_data:
+            return self.vehicle_data.longitude
         return None
 
     @property
@@ -75,20 +109,21 @@ class MapitDeviceTracker(CoordinatorEntity, TrackerEntity):
     @property
     def extra_state_attributes(self):
         """Return entity specific state attributes."""
-        if not self.coordinator.data:
+        data = self.vehicle_data
+        if not data:
             return {}
 
         attrs = {
-            "speed": self.coordinator.data.get("speed"),
-            "status": self.coordinator.data.get("status"),
+            "speed": data.speed,
+            "status": data.status,
         }
         
         # Add optional fields if available
-        if self.coordinator.data.get("hdop") is not None:
-            attrs["hdop"] = self.coordinator.data.get("hdop")
-        if self.coordinator.data.get("odometer") is not None:
-            attrs["odometer"] = self.coordinator.data.get("odometer")
-        if self.coordinator.data.get("last_coord_ts") is not None:
-            attrs["last_coord_ts"] = self.coordinator.data.get("last_coord_ts")
+        if data.hdop is not None:
+            attrs["hdop"] = data.hdop
+        if data.odometer is not None:
+            attrs["odometer"] = data.odometer
+        if data.last_coord_ts is not None:
+            attrs["last_coord_ts"] = data.last_coord_ts
         
         return attrs
@@ -0,0 +1,78 @@
+"""Base entity for Mapit Motorcycle Tracker."""
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from . import DOMAIN, MapitDataUpdateCoordinator
+from .mapit_api import VehicleState
+
+
+class MapitEntity(CoordinatorEntity):
+    """Entity bound to one vehicle of the coordinator data."""
+
+    _attr_has_entity_name = True
+
+    def __init__(
+        self,
+        coordinator: MapitDataUpdateCoordinator,
+        config_entry: ConfigEntry,
+        vehicle_id: str,
+    ) -> None:
+        """Initialize the entity."""
+        super().__init__(coordinator)
+        self._config_entry = config_entry
+        self._vehicle_id = vehicle_id
+
+        # Device info
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, vehicle_device_id(config_entry, vehicle_id))},
+            "name": getattr(self.vehicle_data, "name", None) or "Motorcycle",
+            "manufacturer": "Mapit",
+            "model": "Vehicle Tracker",
+        }
+
+    @property
+    def vehicle_data(self) -> VehicleState | None:
+        """Return the parsed state of this entity's vehicle."""
+        if self.coordinator.data:
+            return self.coordinator.data.get(self._vehicle_id)
+        return None
+
+    @property
+    def available(self) -> bool:
+        """Return True while the vehicle is present in the summary."""
+        return super().available and self.vehicle_data is not None
+
+
+def vehicle_device_id(config_entry: ConfigEntry, vehicle_id: str) -> str:
+    """Return the device identifier of a vehicle."""
+    return f"{config_entry.entry_id}_{vehicle_id}"
+
+
+def async_setup_vehicle_entities(
+    coordinator: MapitDataUpdateCoordinator,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+    entity_factory: Callable[[str], Iterable[Entity]],
+) -> None:
+    """Add entities for every vehicle, including vehicles that appear later."""
+    known: set[str] = set()
+
+    @callback
+    def _async_add_new_vehicles() -> None:
+        new_ids = [vid for vid in coordinator.data or {} if vid not in known]
+        if not new_ids:
+            return
+        known.update(new_ids)
+        async_add_entities(
+            entity for vid in new_ids for entity in entity_factory(vid)
+        )
+
+    _async_add_new_vehicles()
+    config_entry.async_on_unload(coordinator.async_add_listener(_async_add_new_vehicles))
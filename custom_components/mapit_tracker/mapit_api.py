@@ -8,9 +8,23 @@ import json
 import logging
 import os
 from pathlib import Path
+import tempfile
+import threading
+import time
+from typing import Any
 
 import requests
 
+try:
+    from .rate_limit import RequestScheduler, SingleFlight
+except ImportError:  # Imported as a top-level module, outside the package
+    from rate_limit import RequestScheduler, SingleFlight
+
+try:
+    import orjson  # Shipped with Home Assistant
+except ImportError:
+    orjson = None
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -51,17 +65,34 @@ class MapitAPI:
         self.identity_id = None
         self.account_id = None
 
-        # Token cache file path
+        # Serializes authentication and cache writes between executor jobs
+        self._lock = threading.RLock()
+
+        # Requests of this account are spaced per host and retried when
+        # throttled; concurrent summary requests share one upstream call
+        self.scheduler = RequestScheduler()
+        self._summary_flight = SingleFlight()
+
+        # Token and summary cache file paths, one file each per account
         if hass:
-            self.token_cache_file = Path(hass.config.config_dir) / ".mapit_tokens.json"
+            config_dir = Path(hass.config.config_dir)
+            self.token_cache_file = config_dir / account_cache_name("tokens", username)
+            summary_cache_file = config_dir / account_cache_name("summary", username)
         else:
             self.token_cache_file = Path("tokens.json")
+            summary_cache_file = Path("summary_cache.json")
+        self.summary_cache = SummaryCache(summary_cache_file)
 
-        # Try to load cached tokens
-        self._load_cached_tokens()
+    @property
+    def is_authenticated(self) -> bool:
+        """Return True if the client holds credentials for its account."""
+        return self.account_id is not None and self.session_token is not None
 
-    def _load_cached_tokens(self):
-        """Load tokens from cache file."""
+    def load_cached_tokens(self):
+        """Load tokens from cache file.
+
+        Does blocking I/O, so Home Assistant must run it in the executor.
+        """
         try:
             if self.token_cache_file.exists():
                 with open(self.token_cache_file, "r") as f:
@@ -78,7 +109,11 @@ class MapitAPI:
             _LOGGER.debug("Could not load cached tokens: %s", e)
 
     def _save_tokens_to_cache(self):
-        """Save tokens to cache file."""
+        """Save tokens to cache file.
+
+        The file is written to a temporary sibling and atomically renamed so
+        a reader never sees a half-written cache.
+        """
         try:
             tokens = {
                 "access_key": self.access_key,
@@ -89,29 +124,78 @@ class MapitAPI:
                 "access_token": self.access_token,
                 "id": self.account_id,
             }
-            with open(self.token_cache_file, "w") as f:
-                json.dump(tokens, f)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.token_cache_file.parent, prefix=self.token_cache_file.name
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(tokens, f)
+                os.replace(tmp_path, self.token_cache_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
             _LOGGER.debug("Saved tokens to cache")
         except Exception as e:
             _LOGGER.error("Could not save tokens to cache: %s", e)
 
-    def _send_request(self, url, headers, payload=None, method="POST", url_prefix="https://"):
-        """Send HTTP request to API."""
+    def load_cached_summary(self, max_staleness: float) -> dict[str, VehicleState] | None:
+        """Return the parsed cached summary if it is recent enough.
+
+        Does blocking I/O, so Home Assistant must run it in the executor.
+        """
+        # Keep the fetched_at on disk well within max_staleness while the
+        # summary only gets revalidated
+        self.summary_cache.refresh_interval = max_staleness / 4
+        if self.summary_cache.response is None:
+            self.summary_cache.load()
+        if self.summary_cache.is_usable(max_staleness):
+            return parse_summary(self.summary_cache.response)
+        return None
+
+    def _send_request(self, url, headers, payload=None, method="POST", url_prefix="https://", raw=False):
+        """Send HTTP request to API.
+
+        With ``raw`` the response object is returned instead of its JSON body,
+        and 304 Not Modified is accepted.
+        """
         headers["content-type"] = "application/x-amz-json-1.1"
-        response = requests.request(method, url_prefix + url, headers=headers, json=payload, timeout=30)
+        host = url.split("/", 1)[0].split("?", 1)[0]
+        response = self.scheduler.send(
+            host,
+            lambda: requests.request(method, url_prefix + url, headers=headers, json=payload, timeout=30),
+        )
 
         if response.status_code == 403:
             _LOGGER.warning("Token expired, need to re-authenticate")
             raise TokenExpiredError("Token expired")
 
+        if raw and response.status_code == 304:
+            return response
+
+        if response.status_code == 429:
+            raise RateLimitedError(f"Rate limited by {host}")
+
         if response.status_code != 200:
             _LOGGER.error("Request failed: %s - %s", response.status_code, response.text)
             raise RequestFailedError(f"Request failed with status {response.status_code}")
 
-        return response.json()
+        if raw:
+            return response
+        return json_loads(response.content)
 
     def authenticate(self):
         """Authenticate with Mapit API and get all required tokens."""
+        with self._lock:
+            self._authenticate()
+
+    def ensure_authenticated(self):
+        """Authenticate only if no usable credentials are loaded."""
+        with self._lock:
+            if not self.is_authenticated:
+                self._authenticate()
+
+    def _authenticate(self):
+        """Run the full Cognito login flow; callers must hold the lock."""
         _LOGGER.debug("Starting authentication")
 
         # Step 1: Get ID and Access tokens
@@ -207,7 +291,9 @@ class MapitAPI:
 
         return auth_value, amz_date
 
-    def _authorized_request(self, spacename, canonical_querystring="", method="GET"):
+    def _authorized_request(
+        self, spacename, canonical_querystring="", method="GET", extra_headers=None, raw=False
+    ):
         """Make an authorized request to the Mapit API."""
         auth_value, amz_date = self._create_auth_header(method, spacename, canonical_querystring)
 
@@ -220,48 +306,224 @@ class MapitAPI:
             "x-amz-date": amz_date,
             "Authorization": auth_value,
         }
+        if extra_headers:
+            headers.update(extra_headers)
 
-        return self._send_request(url, headers, method=method)
+        return self._send_request(url, headers, method=method, raw=raw)
 
     def get_current_status(self):
-        """Get current vehicle status."""
-        if not self.account_id:
-            _LOGGER.debug("No account ID, authenticating first")
-            self.authenticate()
+        """Get current status of every vehicle on the account.
+
+        Returns a dict mapping vehicle ID to the parsed vehicle state.
+        Callers arriving while a request is in flight share its result.
+        """
+        return self._summary_flight.do("summary", self._get_current_status)
+
+    def _get_current_status(self):
+        self.ensure_authenticated()
 
         spacename = f"/v1/accounts/{self.account_id}/summary"
+        session_token = self.session_token
 
         try:
-            response = self._authorized_request(spacename)
+            response = self._request_summary(spacename)
         except TokenExpiredError:
-            _LOGGER.info("Token expired, re-authenticating")
-            self.authenticate()
-            response = self._authorized_request(spacename)
+            with self._lock:
+                # Another caller may already have refreshed the credentials
+                if self.session_token == session_token:
+                    _LOGGER.info("Token expired, re-authenticating")
+                    self._authenticate()
+            response = self._request_summary(spacename)
+
+        return parse_summary(response)
+
+    def _request_summary(self, spacename):
+        """Fetch the summary, revalidating the cached one by ETag when possible."""
+        cache = self.summary_cache
+        extra_headers = {}
+        if cache.etag and cache.response is not None:
+            extra_headers["If-None-Match"] = cache.etag
+
+        response = self._authorized_request(spacename, extra_headers=extra_headers, raw=True)
+        if response.status_code == 304:
+            _LOGGER.debug("Summary not modified")
+            body, etag = cache.response, cache.etag
+        else:
+            body, etag = json_loads(response.content), response.headers.get("ETag")
+        cache.update(body, etag)
+        return body
+
 
-        # Extract vehicle data
-        vehicle = response["vehicles"][0]
+class SummaryCache:
+    """On-disk cache of one account's summary response and its ETag."""
+
+    def __init__(
+        self, path: Path, min_write_interval: float = 60, refresh_interval: float | None = None
+    ) -> None:
+        """Initialize the cache.
+
+        An unchanged entry is rewritten once the fetched_at on disk is
+        refresh_interval old, so a revalidated summary stays usable after
+        a restart.
+        """
+        self.path = path
+        self.min_write_interval = min_write_interval
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+        self._dirty = False
+        self._stored_fetched_at: float | None = None
+        self.fetched_at: float | None = None
+        self.etag: str | None = None
+        self.response: dict[str, Any] | None = None
+
+    def load(self) -> bool:
+        """Load the cache file; return True if an entry was found.
+
+        Does blocking I/O, so Home Assistant must run it in the executor.
+        """
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f)
+            self.fetched_at = entry["fetched_at"]
+            self.etag = entry.get("etag")
+            self.response = entry["response"]
+            self._stored_fetched_at = self.fetched_at
+        except (OSError, ValueError, KeyError) as e:
+            _LOGGER.debug("Could not load cached summary: %s", e)
+            return False
+        return True
+
+    def is_usable(self, max_staleness: float) -> bool:
+        """Return True if the cached response is no older than max_staleness."""
+        return (
+            self.response is not None
+            and self.fetched_at is not None
+            and time.time() - self.fetched_at <= max_staleness
+        )
+
+    def update(self, response: dict[str, Any], etag: str | None) -> None:
+        """Record a fetched or revalidated response.
+
+        Once min_write_interval has passed since the last write, the file is
+        written if it misses a change or its fetched_at is refresh_interval old.
+        """
+        now = time.time()
+        with self._lock:
+            if response != self.response or etag != self.etag:
+                self._dirty = True
+            self.response = response
+            self.etag = etag
+            self.fetched_at = now
+            if now - self._written_at < self.min_write_interval:
+                return
+            if self._dirty or (
+                self.refresh_interval is not None
+                and (
+                    self._stored_fetched_at is None
+                    or now - self._stored_fetched_at >= self.refresh_interval
+                )
+            ):
+                self._write()
+                self._written_at = now
+
+    def flush(self) -> None:
+        """Write the entry if the file is behind it.
+
+        Does blocking I/O, so Home Assistant must run it in the executor.
+        """
+        with self._lock:
+            if self.response is not None and (
+                self._dirty or self.fetched_at != self._stored_fetched_at
+            ):
+                self._write()
+                self._written_at = time.time()
+
+    def _write(self) -> None:
+        """Atomically replace the cache file."""
+        entry = {"fetched_at": self.fetched_at, "etag": self.etag, "response": self.response}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            _LOGGER.error("Could not save cached summary: %s", e)
+            return
+        self._dirty = False
+        self._stored_fetched_at = self.fetched_at
+
+
+def json_loads(data: bytes | str) -> Any:
+    """Decode JSON with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class VehicleState:
+    """Parsed state of one vehicle, as read by the entities."""
+
+    __slots__ = (
+        "name",
+        "latitude",
+        "longitude",
+        "speed",
+        "status",
+        "battery",
+        "hdop",
+        "odometer",
+        "last_coord_ts",
+    )
+
+    def __init__(self, vehicle: dict) -> None:
+        """Parse a vehicle of a summary response."""
         state = vehicle["device"]["state"]
-        
-        # Get speed and status
-        speed = state["speed"]
-        status = state["status"]
-        
+        self.name: str | None = vehicle.get("name")
+        self.latitude: float = state["lat"]
+        self.longitude: float = state["lng"]
+        self.status: str | None = state["status"]
         # Normalize speed: set to 0 when vehicle is at rest
         # API sometimes reports residual speed values when stopped
-        if status == "AT_REST":
-            speed = 0
-
-        return {
-            "latitude": state["lat"],
-            "longitude": state["lng"],
-            "speed": speed,
-            "status": status,
-            "battery": state.get("battery", 0),
-            "hdop": state.get("hdop"),
-            "odometer": state.get("odometer"),
-            "last_coord_ts": state.get("lastCoordTs"),
-            "raw_data": response,
-        }
+        self.speed: float | None = 0 if self.status == "AT_REST" else state["speed"]
+        self.battery: int | None = state.get("battery", 0)
+        self.hdop: float | None = state.get("hdop")
+        self.odometer: float | None = state.get("odometer")
+        self.last_coord_ts: int | None = state.get("lastCoordTs")
+
+    def __eq__(self, other: object) -> bool:
+        """Compare field by field, so unchanged polls are recognized."""
+        if not isinstance(other, VehicleState):
+            return NotImplemented
+        return all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        """Return the fields for logs and diagnostics."""
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"VehicleState({fields})"
+
+
+def parse_summary(response: dict) -> dict[str, VehicleState]:
+    """Parse every vehicle of a summary response, indexed by vehicle ID.
+
+    Vehicles without an ``id`` are keyed by their position in the list.
+    """
+    return {
+        str(vehicle.get("id", index)): VehicleState(vehicle)
+        for index, vehicle in enumerate(response.get("vehicles") or [])
+    }
+
+
+def account_cache_name(kind: str, username: str) -> str:
+    """Return the name of an account's cache file of the given kind."""
+    digest = hashlib.sha256(username.strip().lower().encode("utf-8")).hexdigest()
+    return f".mapit_{kind}_{digest[:16]}.json"
 
 
 class TokenExpiredError(Exception):
@@ -270,3 +532,7 @@ class TokenExpiredError(Exception):
 
 class RequestFailedError(Exception):
     """Exception raised when API request fails."""
+
+
+class RateLimitedError(RequestFailedError):
+    """Exception raised when the API keeps throttling a request."""
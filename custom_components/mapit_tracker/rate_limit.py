@@ -0,0 +1,169 @@
+"""Client-side rate limiting of Mapit and Cognito requests.
+
+Same scheduling as the standalone client: a token bucket per host spaces
+requests of one account, throttled responses (429, 502/503/504) pause the
+host for Retry-After or a jittered exponential backoff before the request
+is retried, and concurrent summary requests share one upstream call.
+"""
+from __future__ import annotations
+
+from collections.abc import Callable
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any
+
+import requests
+
+_LOGGER = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def retry_after(response: requests.Response, now: float | None = None) -> float | None:
+    """Return the seconds the Retry-After header asks to wait, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (now or time.time()))
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Return a full-jitter exponential backoff delay."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """Initialize."""
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            return max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Wait for a token and for any pause; return the seconds waited."""
+        waited = self.reserve()
+        if waited > 0:
+            time.sleep(waited)
+        while (remaining := self._paused_until - time.monotonic()) > 0:
+            time.sleep(remaining)
+            waited += remaining
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for seconds; the bucket refills only after the pause."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._updated = max(self._updated, until)
+                self._tokens = min(self._tokens, 0.0)
+
+
+class RequestScheduler:
+    """Per-host token buckets with Retry-After and jittered backoff retries."""
+
+    def __init__(
+        self,
+        rate: float = 2.0,
+        burst: int = 4,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ) -> None:
+        """Initialize."""
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        """Return the bucket of a host."""
+        with self._lock:
+            if (bucket := self._buckets.get(host)) is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def send(self, host: str, request: Callable[[], requests.Response]) -> requests.Response:
+        """Send a request to host within its rate, retrying throttled responses."""
+        bucket = self.bucket(host)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            response = request()
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            _LOGGER.warning("%s answered %s, retrying in %.1fs", host, response.status_code, delay)
+            bucket.pause(delay)
+        return response
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self._lock = threading.Lock()
+        self._calls: dict[Any, _Call] = {}
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Any:
+        """Run fn() unless a call for key is in flight; then share its outcome."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
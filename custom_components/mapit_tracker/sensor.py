@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from collections.abc import Callable
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
 from homeassistant.components.sensor import (
@@ -14,12 +14,14 @@ from homeassistant.components.sensor import (
 )
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import UnitOfSpeed
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import StateType
-from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 
 from . import DOMAIN, MapitDataUpdateCoordinator
+from .entity import MapitEntity, async_setup_vehicle_entities
+from .mapit_api import VehicleState
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -45,9 +47,15 @@ def _convert_timestamp(ts):
 
 @dataclass(frozen=True)
 class MapitSensorEntityDescription(SensorEntityDescription):
-    """Describes Mapit sensor entity."""
+    """Describes Mapit sensor entity.
 
-    value_fn: Callable[[dict], StateType] = lambda data: None
+    Numeric sensors can set ``tolerance`` so that changes smaller than it
+    are only written once ``throttle`` has elapsed since the last write.
+    """
+
+    value_fn: Callable[[VehicleState], StateType] = lambda data: None
+    tolerance: float | None = None
+    throttle: timedelta | None = None
 
 
 SENSORS: tuple[MapitSensorEntityDescription, ...] = (
@@ -58,13 +66,13 @@ SENSORS: tuple[MapitSensorEntityDescription, ...] = (
         device_class=SensorDeviceClass.SPEED,
         state_class=SensorStateClass.MEASUREMENT,
         icon="mdi:speedometer",
-        value_fn=lambda data: data.get("speed"),
+        value_fn=lambda data: data.speed,
     ),
     MapitSensorEntityDescription(
         key="status",
         name="Status",
         icon="mdi:motorbike",
-        value_fn=lambda data: data.get("status"),
+        value_fn=lambda data: data.status,
     ),
     MapitSensorEntityDescription(
         key="battery",
@@ -72,14 +80,16 @@ SENSORS: tuple[MapitSensorEntityDescription, ...] = (
         native_unit_of_measurement="%",
         device_class=SensorDeviceClass.BATTERY,
         state_class=SensorStateClass.MEASUREMENT,
-        value_fn=lambda data: data.get("battery"),
+        value_fn=lambda data: data.battery,
     ),
     MapitSensorEntityDescription(
         key="hdop",
         name="HDOP",
         icon="mdi:map-marker-radius",
         state_class=SensorStateClass.MEASUREMENT,
-        value_fn=lambda data: data.get("hdop"),
+        value_fn=lambda data: data.hdop,
+        tolerance=0.5,
+        throttle=timedelta(minutes=10),
     ),
     MapitSensorEntityDescription(
         key="odometer",
@@ -88,14 +98,14 @@ SENSORS: tuple[MapitSensorEntityDescription, ...] = (
         device_class=SensorDeviceClass.DISTANCE,
         state_class=SensorStateClass.TOTAL_INCREASING,
         icon="mdi:counter",
-        value_fn=lambda data: data.get("odometer"),
+        value_fn=lambda data: data.odometer,
     ),
     MapitSensorEntityDescription(
         key="last_coord_ts",
         name="Last Coordinate Update",
         device_class=SensorDeviceClass.TIMESTAMP,
         icon="mdi:clock-outline",
-        value_fn=lambda data: _convert_timestamp(data.get("last_coord_ts")),
+        value_fn=lambda data: _convert_timestamp(data.last_coord_ts),
     ),
 )
 
@@ -108,41 +118,77 @@ async def async_setup_entry(
     """Set up the Mapit sensors from config entry."""
     coordinator: MapitDataUpdateCoordinator = hass.data[DOMAIN][config_entry.entry_id]
 
-    async_add_entities(
-        MapitSensor(coordinator, config_entry, description)
-        for description in SENSORS
+    async_setup_vehicle_entities(
+        coordinator,
+        config_entry,
+        async_add_entities,
+        lambda vehicle_id: [
+            MapitSensor(coordinator, config_entry, vehicle_id, description)
+            for description in SENSORS
+        ],
     )
 
 
-class MapitSensor(CoordinatorEntity, SensorEntity):
+class MapitSensor(MapitEntity, SensorEntity):
     """Representation of a Mapit sensor."""
 
     entity_description: MapitSensorEntityDescription
-    _attr_has_entity_name = True
 
     def __init__(
         self,
         coordinator: MapitDataUpdateCoordinator,
         config_entry: ConfigEntry,
+        vehicle_id: str,
         description: MapitSensorEntityDescription,
     ) -> None:
         """Initialize the sensor."""
-        super().__init__(coordinator)
+        super().__init__(coordinator, config_entry, vehicle_id)
         self.entity_description = description
-        self._config_entry = config_entry
-        self._attr_unique_id = f"{config_entry.entry_id}_{description.key}"
-
-        # Device info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, config_entry.entry_id)},
-            "name": "Motorcycle",
-            "manufacturer": "Mapit",
-            "model": "Vehicle Tracker",
-        }
-
-    @property
-    def native_value(self) -> StateType:
-        """Return the state of the sensor."""
-        if self.coordinator.data:
-            return self.entity_description.value_fn(self.coordinator.data)
+        self._attr_unique_id = f"{config_entry.entry_id}_{vehicle_id}_{description.key}"
+
+        self._attr_native_value = self._current_value()
+        self._last_written = None
+        self._last_available = None
+
+    def _current_value(self) -> StateType:
+        """Compute the sensor value from the vehicle's snapshot."""
+        if self.vehicle_data:
+            return self.entity_description.value_fn(self.vehicle_data)
         return None
+
+    def _should_write(self, value: StateType) -> bool:
+        """Return True if the new value is worth a state write."""
+        if self._last_written is None or self.available != self._last_available:
+            return True
+        if value == self._attr_native_value:
+            return False
+
+        description = self.entity_description
+        if (
+            description.tolerance is None
+            or not isinstance(value, (int, float))
+            or not isinstance(self._attr_native_value, (int, float))
+        ):
+            return True
+        if abs(value - self._attr_native_value) >= description.tolerance:
+            return True
+        return (
+            description.throttle is not None
+            and dt_util.utcnow() - self._last_written >= description.throttle
+        )
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write state only when the value changed beyond its throttle."""
+        value = self._current_value()
+        if not self._should_write(value):
+            return
+        self._attr_native_value = value
+        self.async_write_ha_state()
+
+    @callback
+    def async_write_ha_state(self) -> None:
+        """Write the state and remember when it was written."""
+        self._last_written = dt_util.utcnow()
+        self._last_available = self.available
+        super().async_write_ha_state()
@@ -0,0 +1,86 @@
+"""
+Geodesy helpers shared by the ingest, storage and export code.
+"""
+
+import math
+
+# Mean Earth radius in metres (IUGG)
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """Great-circle distance in metres between two WGS84 points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lng, lat, precision=9):
+    """Encode a point as a geohash string of the given length."""
+    lng_lo, lng_hi = -180.0, 180.0
+    lat_lo, lat_hi = -90.0, 90.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = value * 2 + 1
+                lng_lo = mid
+            else:
+                value = value * 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value = value * 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Return (width, height) in degrees of a geohash cell."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 360.0 / 2 ** lng_bits, 180.0 / 2 ** lat_bits
+
+
+def geohash_cover(bbox, max_cells=24, max_precision=9):
+    """Return geohash prefixes whose cells together cover a bounding box.
+
+    Picks the longest prefix length for which at most max_cells cells are
+    needed. Returns an empty list when even one-character cells are too
+    many, meaning the box is better served without a geohash filter.
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    for precision in range(max_precision, 0, -1):
+        width, height = geohash_cell_size(precision)
+        cols = int((max_lng - min_lng) / width) + 2
+        rows = int((max_lat - min_lat) / height) + 2
+        if cols * rows > max_cells:
+            continue
+        cells = set()
+        for i in range(cols):
+            lng = min(min_lng + i * width, max_lng)
+            for j in range(rows):
+                lat = min(min_lat + j * height, max_lat)
+                cells.add(geohash_encode(lng, lat, precision))
+        return sorted(cells)
+    return []
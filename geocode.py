@@ -0,0 +1,272 @@
+"""
+Offline reverse geocoding from local place and road datasets.
+
+Places (points) and roads (polyline segments) are loaded into uniform
+lng/lat grids; a lookup searches the query's cell and the rings around it
+for the nearest place and the nearest road segment. Results are memoized
+per geohash cell in an LRU, so the fixes of a vehicle that stays in or
+keeps returning to the same area cost a dict lookup, and no request ever
+leaves the machine.
+
+Datasets, by extension:
+
+- .txt/.tsv: GeoNames dump (e.g. cities500.txt from
+  https://download.geonames.org/export/dump/)
+- .csv: header with name, lat and lng (or lon/longitude/latitude)
+- .geojson/.json: Point features are places, LineString and
+  MultiLineString features are roads (name, else ref property), e.g. an
+  OpenStreetMap extract converted with ogr2ogr
+"""
+
+import collections
+import csv
+import functools
+import math
+import os
+from array import array
+
+import json_backend
+from geo import geohash_cell_size
+
+_M_PER_DEG = 6371008.8 * math.pi / 180
+
+# GeoNames dump columns
+_GEONAMES_NAME, _GEONAMES_LAT, _GEONAMES_LNG, _GEONAMES_COUNTRY = 1, 4, 5, 8
+
+
+class _Grid:
+    """Items bucketed by the grid cells their bounding box touches."""
+
+    def __init__(self, cell_deg):
+        self.cell_deg = cell_deg
+        self.cells = collections.defaultdict(list)
+
+    def cell(self, lng, lat):
+        return math.floor(lng / self.cell_deg), math.floor(lat / self.cell_deg)
+
+    def add_point(self, item, lng, lat):
+        self.cells[math.floor(lng / self.cell_deg), math.floor(lat / self.cell_deg)].append(item)
+
+    def add_box(self, item, min_lng, min_lat, max_lng, max_lat):
+        d = self.cell_deg
+        min_cx, min_cy = math.floor(min_lng / d), math.floor(min_lat / d)
+        max_cx, max_cy = math.floor(max_lng / d), math.floor(max_lat / d)
+        if min_cx == max_cx and min_cy == max_cy:
+            self.cells[min_cx, min_cy].append(item)
+            return
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                self.cells[cx, cy].append(item)
+
+    def ring(self, cx, cy, k):
+        """Items of the cells at Chebyshev distance k from (cx, cy)."""
+        cells = self.cells
+        if k == 0:
+            return cells.get((cx, cy), ())
+        items = []
+        for x in range(cx - k, cx + k + 1):
+            for y in (cy - k, cy + k):
+                items.extend(cells.get((x, y), ()))
+        for y in range(cy - k + 1, cy + k):
+            for x in (cx - k, cx + k):
+                items.extend(cells.get((x, y), ()))
+        return items
+
+
+class ReverseGeocoder:
+    """Nearest place and road names for a position, from offline datasets."""
+
+    def __init__(self, precision=8, cache_size=65536, max_place_m=20000, max_road_m=50,
+                 place_cell_deg=0.1, road_cell_deg=0.001):
+        """
+        Args:
+            precision: Geohash precision of the memoized cells; 8 is about
+                38 x 19 m, so a cached answer is at most one cell off
+            cache_size: Cells kept in the LRU
+            max_place_m: No place is reported further away than this
+            max_road_m: No road is reported further away than this
+            place_cell_deg, road_cell_deg: Grid cell sizes of the indexes
+        """
+        self.max_place_m = max_place_m
+        self.max_road_m = max_road_m
+        self._cell_w, self._cell_h = geohash_cell_size(precision)
+        self._places = _Grid(place_cell_deg)
+        self._roads = _Grid(road_cell_deg)
+        self._place_lng = array('d')
+        self._place_lat = array('d')
+        self._place_names = []
+        # Road segments as (lng1, lat1, lng2, lat2) and the index of their name
+        self._segments = array('d')
+        self._segment_names = array('l')
+        self._road_names = []
+        self._road_name_ids = {}
+        self._lookup_cell = functools.lru_cache(cache_size)(self._resolve_cell)
+
+    @property
+    def places(self):
+        return len(self._place_names)
+
+    @property
+    def roads(self):
+        return len(self._segment_names)
+
+    def add_place(self, name, lng, lat):
+        item = len(self._place_names)
+        self._place_names.append(name)
+        self._place_lng.append(lng)
+        self._place_lat.append(lat)
+        self._places.add_point(item, lng, lat)
+
+    def add_road(self, name, coordinates):
+        """Add a road polyline given as [(lng, lat), ...]."""
+        name_id = self._road_name_ids.get(name)
+        if name_id is None:
+            name_id = self._road_name_ids[name] = len(self._road_names)
+            self._road_names.append(name)
+        for (lng1, lat1), (lng2, lat2) in zip(coordinates, coordinates[1:]):
+            item = len(self._segment_names)
+            self._segments.extend((lng1, lat1, lng2, lat2))
+            self._segment_names.append(name_id)
+            self._roads.add_box(item, min(lng1, lng2), min(lat1, lat2), max(lng1, lng2), max(lat1, lat2))
+
+    def load(self, path):
+        """Load a dataset file (see module docstring)."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ('.txt', '.tsv'):
+            self._load_geonames(path)
+        elif ext == '.csv':
+            self._load_csv(path)
+        elif ext in ('.geojson', '.json'):
+            self._load_geojson(path)
+        else:
+            raise ValueError(f"Unsupported places dataset: {path} (use .txt/.tsv GeoNames, .csv or .geojson)")
+        self._lookup_cell.cache_clear()
+
+    def _load_geonames(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) > _GEONAMES_COUNTRY:
+                    self.add_place(fields[_GEONAMES_NAME], float(fields[_GEONAMES_LNG]),
+                                   float(fields[_GEONAMES_LAT]))
+
+    def _load_csv(self, path):
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                row = {k.strip().lower(): v for k, v in row.items() if k}
+                lng = row.get('lng', row.get('lon', row.get('longitude')))
+                lat = row.get('lat', row.get('latitude'))
+                if row.get('name') and lng and lat:
+                    self.add_place(row['name'], float(lng), float(lat))
+
+    def _load_geojson(self, path):
+        with open(path, 'rb') as f:
+            collection = json_backend.loads(f.read())
+        for feature in collection.get('features', ()):
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            name = properties.get('name') or properties.get('ref')
+            if not name:
+                continue
+            kind = geometry.get('type')
+            if kind == 'Point':
+                lng, lat = geometry['coordinates'][:2]
+                self.add_place(name, lng, lat)
+            elif kind == 'LineString':
+                self.add_road(name, [tuple(c[:2]) for c in geometry['coordinates']])
+            elif kind == 'MultiLineString':
+                for line in geometry['coordinates']:
+                    self.add_road(name, [tuple(c[:2]) for c in line])
+
+    def lookup(self, lng, lat):
+        """Return {"place", "place_m", "road", "road_m", "label"} for a position.
+
+        Names are None when nothing is within max_place_m / max_road_m.
+        The answer is the one of the centre of the position's geohash cell
+        and comes from the LRU after the first lookup in that cell.
+        """
+        return self._lookup_cell(math.floor((lng + 180.0) / self._cell_w),
+                                 math.floor((lat + 90.0) / self._cell_h))
+
+    def label(self, lng, lat):
+        """Short display name: "road, place", either one, or None."""
+        return self.lookup(lng, lat)["label"]
+
+    def stats(self):
+        info = self._lookup_cell.cache_info()
+        return {"places": self.places, "road_segments": self.roads, "cached_cells": info.currsize,
+                "hits": info.hits, "misses": info.misses}
+
+    def _resolve_cell(self, col, row):
+        lng = (col + 0.5) * self._cell_w - 180.0
+        lat = (row + 0.5) * self._cell_h - 90.0
+        place, place_m = self._nearest_place(lng, lat)
+        road, road_m = self._nearest_road(lng, lat)
+        return {
+            "place": place,
+            "place_m": round(place_m) if place is not None else None,
+            "road": road,
+            "road_m": round(road_m) if road is not None else None,
+            "label": ", ".join(name for name in (road, place) if name) or None,
+        }
+
+    def _nearest_place(self, lng, lat):
+        grid = self._places
+        kx = _M_PER_DEG * math.cos(math.radians(lat))
+        # Items k rings out are at least (k - 1) cells away
+        ring_m = grid.cell_deg * min(kx, _M_PER_DEG)
+        max_rings = int(self.max_place_m / ring_m) + 2 if ring_m else 0
+        cx, cy = grid.cell(lng, lat)
+        best, best_d2 = None, self.max_place_m ** 2
+        place_lng, place_lat = self._place_lng, self._place_lat
+        for k in range(max_rings + 1):
+            if best is not None and best_d2 <= (max(k - 1, 0) * ring_m) ** 2:
+                break
+            for item in grid.ring(cx, cy, k):
+                dx = (place_lng[item] - lng) * kx
+                dy = (place_lat[item] - lat) * _M_PER_DEG
+                d2 = dx * dx + dy * dy
+                if d2 < best_d2:
+                    best, best_d2 = item, d2
+        if best is None:
+            return None, None
+        return self._place_names[best], math.sqrt(best_d2)
+
+    def _nearest_road(self, lng, lat):
+        grid = self._roads
+        kx = _M_PER_DEG * math.cos(math.radians(lat))
+        ring_m = grid.cell_deg * min(kx, _M_PER_DEG)
+        rings = int(self.max_road_m / ring_m) + 1 if ring_m else 0
+        cx, cy = grid.cell(lng, lat)
+        best, best_d2 = None, self.max_road_m ** 2
+        segments = self._segments
+        seen = set()
+        for k in range(rings + 1):
+            for item in grid.ring(cx, cy, k):
+                if item in seen:
+                    continue
+                seen.add(item)
+                i = 4 * item
+                # Distance to the segment in a local plane around the query
+                ax = (segments[i] - lng) * kx
+                ay = (segments[i + 1] - lat) * _M_PER_DEG
+                bx = (segments[i + 2] - lng) * kx
+                by = (segments[i + 3] - lat) * _M_PER_DEG
+                dx, dy = bx - ax, by - ay
+                length2 = dx * dx + dy * dy
+                t = 0.0 if length2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+                px, py = ax + t * dx, ay + t * dy
+                d2 = px * px + py * py
+                if d2 < best_d2:
+                    best, best_d2 = item, d2
+        if best is None:
+            return None, None
+        return self._road_names[self._segment_names[best]], math.sqrt(best_d2)
+
+
+def load_geocoder(paths, **kwargs):
+    """Build a ReverseGeocoder from dataset files."""
+    geocoder = ReverseGeocoder(**kwargs)
+    for path in paths:
+        geocoder.load(path)
+    return geocoder
@@ -0,0 +1,183 @@
+"""
+Incremental exports that only write fixes stored since the previous run.
+
+Every target file has a watermark next to it (<file>.watermark.json)
+holding the id and creation time of the last exported fix. A run pages
+through the fixes above that id in primary key order, so a nightly export
+costs as much as the new data, not the whole history:
+
+- GeoJSONSeq (.geojsonl, or .geojsons with RFC 8142 record separators)
+  and CSV files are appended to.
+- GeoJSON and KML documents cannot be appended to, so they are rotated
+  into one file per UTC day (track.geojson -> track-2025-01-31.geojson)
+  and only the days that received new fixes are rewritten.
+
+The watermark is saved after each appended chunk and records the size of
+the file it covers. A run interrupted in between truncates the file back
+to that size before appending, so no fix is ever written twice.
+"""
+
+import csv
+import datetime
+import io
+import os
+
+import json_backend
+
+APPEND_FORMATS = {'.geojsonl': 'geojsonseq', '.geojsons': 'geojsonseq', '.csv': 'csv'}
+SEGMENT_FORMATS = {'.geojson': 'geojson', '.kml': 'kml'}
+
+CSV_COLUMNS = ("id", "timestamp", "lng", "lat", "speed", "status", "battery", "hdop", "odometer",
+               "last_coord_ts")
+
+# RFC 8142 record separator, written before each .geojsons record
+_RS = '\x1e'
+
+
+def watermark_path(filepath):
+    return f"{filepath}.watermark.json"
+
+
+def load_watermark(filepath):
+    """Return the watermark of a target file, or a fresh one before the first run."""
+    try:
+        with open(watermark_path(filepath), 'rb') as f:
+            return json_backend.loads(f.read())
+    except FileNotFoundError:
+        return {"last_id": 0, "last_ts": None, "rows": 0, "size": 0}
+
+
+def save_watermark(filepath, watermark):
+    """Replace the watermark atomically."""
+    path = watermark_path(filepath)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(json_backend.dumps(watermark))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def segment_path(filepath, day):
+    """Daily segment of a GeoJSON or KML target, e.g. track-2025-01-31.geojson."""
+    root, ext = os.path.splitext(filepath)
+    return f"{root}-{day:%Y-%m-%d}{ext}"
+
+
+def _isoformat(timestamp):
+    return timestamp.isoformat() if timestamp else None
+
+
+def format_geojsonseq(batch, separator=''):
+    """Encode a PositionBatch as GeoJSON text sequence lines."""
+    dumps = json_backend.dumps
+    return ''.join(
+        separator + dumps({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lng, lat]},
+            "properties": {"id": row_id, "speed": speed, "status": status, "timestamp": _isoformat(timestamp)}
+        }).decode('utf-8') + '\n'
+        for lng, lat, speed, status, timestamp, row_id
+        in zip(batch.lng, batch.lat, batch.speed, batch.status, batch.timestamp, batch.id)
+    )
+
+
+def format_csv(batch, header=False):
+    """Encode a PositionBatch as CSV rows in CSV_COLUMNS order."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    writer.writerows(zip(batch.id, map(_isoformat, batch.timestamp), batch.lng, batch.lat, batch.speed,
+                         batch.status, batch.battery, batch.hdop, batch.odometer, batch.last_coord_ts))
+    return buffer.getvalue()
+
+
+def _append(filepath, fmt, batch, watermark):
+    """Append a chunk to an append-only target and advance its watermark."""
+    with open(filepath, 'a', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            f.write(format_csv(batch, header=watermark["size"] == 0))
+        else:
+            f.write(format_geojsonseq(batch, _RS if filepath.endswith('.geojsons') else ''))
+        f.flush()
+        os.fsync(f.fileno())
+        watermark["size"] = f.tell()
+    watermark["last_id"] = batch.id[-1]
+    watermark["last_ts"] = _isoformat(batch.timestamp[-1])
+    watermark["rows"] += len(batch)
+    save_watermark(filepath, watermark)
+
+
+def _write_segments(mapit, filepath, fmt, days, logger):
+    """Rewrite the daily segments of the given UTC days from Oracle."""
+    for day in sorted(days):
+        since = datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+        until = since + datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+        history = mapit.query_positions(since=since, until=until, limit=10000000)
+        path = segment_path(filepath, day)
+        if not history:
+            logger.warning("No points left for segment %s, skipping", path)
+            continue
+        tmp_path = f"{path}.tmp{os.path.splitext(path)[1]}"
+        if fmt == 'kml':
+            written = mapit.export_kml(tmp_path, history=history)
+        else:
+            written = mapit.export_geojson(tmp_path, history=history)
+        if not written:
+            raise RuntimeError(f"Could not write segment {path}")
+        os.replace(tmp_path, path)
+        logger.info("Rewrote segment %s with %d points", path, len(history))
+
+
+def export_incremental(mapit, filepath, logger, batch_size=10000):
+    """Export the fixes stored since the last run of this target.
+
+    Args:
+        mapit: Mapit instance providing the Oracle queries
+        filepath: Target file; the format follows its extension
+        batch_size: Fixes fetched and appended per chunk
+
+    Returns a dict with the number of new points, chunks and rewritten
+    segments (paths) of this run.
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    fmt = APPEND_FORMATS.get(ext) or SEGMENT_FORMATS.get(ext)
+    if fmt is None:
+        raise ValueError(f"Unsupported incremental export format: {ext or filepath} "
+                         f"(use {', '.join(sorted({**APPEND_FORMATS, **SEGMENT_FORMATS}))})")
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+
+    watermark = load_watermark(filepath)
+    if ext in APPEND_FORMATS:
+        size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        if size < watermark["size"]:
+            raise ValueError(f"{filepath} is shorter than its watermark; delete "
+                             f"{watermark_path(filepath)} to export everything again")
+        if size > watermark["size"]:
+            logger.warning("Dropping %d bytes written to %s by an interrupted run",
+                           size - watermark["size"], filepath)
+            os.truncate(filepath, watermark["size"])
+    stats = {"points": 0, "chunks": 0, "segments": []}
+    days = set()
+    for batch in mapit.iter_positions_after(watermark["last_id"], batch_size):
+        if ext in APPEND_FORMATS:
+            _append(filepath, fmt, batch, watermark)
+        else:
+            days.update(ts.astimezone(datetime.timezone.utc).date() for ts in batch.timestamp if ts)
+            watermark["last_id"] = batch.id[-1]
+            watermark["last_ts"] = _isoformat(batch.timestamp[-1])
+            watermark["rows"] += len(batch)
+        stats["points"] += len(batch)
+        stats["chunks"] += 1
+
+    if days:
+        _write_segments(mapit, filepath, fmt, days, logger)
+        stats["segments"] = [segment_path(filepath, day) for day in sorted(days)]
+    if ext in SEGMENT_FORMATS and stats["points"]:
+        # Only once every affected segment is written
+        save_watermark(filepath, watermark)
+
+    logger.info("Incremental export to %s: %d new points in %d chunks, %d total, up to id %s",
+                filepath, stats["points"], stats["chunks"], watermark["rows"], watermark["last_id"])
+    return stats
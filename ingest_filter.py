@@ -0,0 +1,155 @@
+"""
+Change-detection filter applied to fixes before they are stored.
+
+A fix is kept when it is the first one seen, when the vehicle status
+changes, when it moved more than the deadband away from the last kept
+fix, or when a keyframe is due. Fixes re-reported with the same
+lastCoordTs and fixes with a poor HDOP are always dropped.
+
+TripTracker turns the kept fixes into trip start and end events,
+optionally named with a geocode.ReverseGeocoder.
+"""
+
+from geo import haversine
+
+DROP_DUPLICATE = 'duplicate'
+DROP_HDOP = 'hdop'
+DROP_DEADBAND = 'deadband'
+
+
+class IngestFilter:
+    """Decide which fixes are worth a database write."""
+
+    def __init__(self, deadband_m=10.0, max_hdop=None, keyframe_seconds=900):
+        """
+        Args:
+            deadband_m: Minimum distance in metres from the last kept fix
+            max_hdop: Drop fixes with a higher HDOP (None disables the gate)
+            keyframe_seconds: Force a write after this long without one
+                (None or 0 disables keyframes)
+        """
+        self.deadband_m = deadband_m
+        self.max_hdop = max_hdop
+        self.keyframe_seconds = keyframe_seconds
+        self.reset()
+
+    def reset(self):
+        """Forget the last kept fix and zero the counters."""
+        self._last_lng = None
+        self._last_lat = None
+        self._last_status = None
+        self._last_coord_ts = None
+        self._last_kept_at = None
+        self.seen = 0
+        self.kept = 0
+        self.dropped = {DROP_DUPLICATE: 0, DROP_HDOP: 0, DROP_DEADBAND: 0}
+
+    def accept(self, lng, lat, status, now, hdop=None, last_coord_ts=None):
+        """Return True if the fix should be stored.
+
+        Args:
+            lng, lat: Position of the fix
+            status: Vehicle status (MOVING/AT_REST)
+            now: Time of the fix in epoch seconds
+            hdop: Horizontal dilution of precision, if reported
+            last_coord_ts: lastCoordTs of the fix in epoch milliseconds
+        """
+        self.seen += 1
+
+        if last_coord_ts is not None and last_coord_ts == self._last_coord_ts:
+            return self._drop(DROP_DUPLICATE)
+
+        if self.max_hdop is not None and hdop is not None and float(hdop) > self.max_hdop:
+            return self._drop(DROP_HDOP)
+
+        if self._last_kept_at is None or status != self._last_status:
+            return self._keep(lng, lat, status, now, last_coord_ts)
+
+        if self.keyframe_seconds and now - self._last_kept_at >= self.keyframe_seconds:
+            return self._keep(lng, lat, status, now, last_coord_ts)
+
+        if haversine(self._last_lng, self._last_lat, lng, lat) >= self.deadband_m:
+            return self._keep(lng, lat, status, now, last_coord_ts)
+
+        # Still remember the timestamp so a re-report of this fix is a duplicate
+        self._last_coord_ts = last_coord_ts
+        return self._drop(DROP_DEADBAND)
+
+    def _keep(self, lng, lat, status, now, last_coord_ts):
+        self._last_lng = lng
+        self._last_lat = lat
+        self._last_status = status
+        self._last_coord_ts = last_coord_ts
+        self._last_kept_at = now
+        self.kept += 1
+        return True
+
+    def _drop(self, reason):
+        self.dropped[reason] += 1
+        return False
+
+    @property
+    def drop_ratio(self):
+        """Fraction of seen fixes that were not stored."""
+        if not self.seen:
+            return 0.0
+        return 1.0 - self.kept / self.seen
+
+    def stats(self):
+        """Return the counters as a dict suitable for logging."""
+        return {
+            "seen": self.seen,
+            "kept": self.kept,
+            "dropped": dict(self.dropped),
+            "drop_ratio": round(self.drop_ratio, 4),
+        }
+
+
+class TripTracker:
+    """Detect trips from the status of kept fixes.
+
+    A trip starts with the first MOVING fix after a stop and ends with the
+    next AT_REST fix.
+    """
+
+    def __init__(self, geocoder=None):
+        """
+        Args:
+            geocoder: Optional ReverseGeocoder naming the start and end
+                points of trips
+        """
+        self.geocoder = geocoder
+        self._start = None
+        self._start_place = None
+        self._last = None
+        self.distance_m = 0.0
+
+    def update(self, lng, lat, status, now):
+        """Feed a kept fix; return a trip event dict or None.
+
+        Events are {"event": "start", "time", "lng", "lat"} and
+        {"event": "end", "start", "end", "duration", "distance_m"}. With a
+        geocoder, start events also carry "place" and end events
+        "start_place" and "end_place" (None where nothing is nearby).
+        """
+        event = None
+        if status == 'MOVING':
+            if self._start is None:
+                self._start = now
+                self.distance_m = 0.0
+                event = {"event": "start", "time": now, "lng": lng, "lat": lat}
+                if self.geocoder is not None:
+                    self._start_place = event["place"] = self.geocoder.label(lng, lat)
+            elif self._last is not None:
+                self.distance_m += haversine(self._last[0], self._last[1], lng, lat)
+        elif self._start is not None:
+            if self._last is not None:
+                self.distance_m += haversine(self._last[0], self._last[1], lng, lat)
+            event = {"event": "end", "start": self._start, "end": now,
+                     "duration": now - self._start, "distance_m": round(self.distance_m, 1)}
+            if self.geocoder is not None:
+                event["start_place"] = self._start_place
+                event["end_place"] = self.geocoder.label(lng, lat)
+            self._start = None
+        self._last = (lng, lat)
+        return event
@@ -0,0 +1,134 @@
+"""
+JSON encoding and decoding through the fastest available library.
+
+orjson is used when installed, then msgspec, then the standard library;
+all three produce the same JSON. Where summaries are only turned into
+fixes (replaying captures), they can be decoded into a typed schema
+holding only the fields the tracker reads, which with msgspec skips the
+rest of the payload without building it in Python. Fetched summaries
+are decoded in full, as returned by getSummary, recorded and cached.
+"""
+
+import datetime
+import decimal
+import json
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+else:
+    BACKEND = 'json'
+
+# Fields of vehicles[].device.state read by the tracker and the exports
+SUMMARY_STATE_FIELDS = ('lng', 'lat', 'speed', 'status', 'battery', 'hdop', 'odometer', 'lastCoordTs')
+
+
+def _default(obj):
+    """Encode the non-JSON types found in Oracle rows."""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """Encode obj as compact (or two-space indented) JSON bytes."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+    if msgspec is not None:
+        body = msgspec.json.encode(obj, enc_hook=_default)
+        return msgspec.json.format(body, indent=2) if indent else body
+    if indent:
+        return json.dumps(obj, indent=2, default=_default).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+if msgspec is not None:
+    class _State(msgspec.Struct):
+        lng: Any = None
+        lat: Any = None
+        speed: Any = None
+        status: Optional[str] = None
+        battery: Any = None
+        hdop: Any = None
+        odometer: Any = None
+        lastCoordTs: Any = None
+
+    class _Device(msgspec.Struct):
+        state: _State
+
+    class _Vehicle(msgspec.Struct, omit_defaults=True):
+        device: _Device
+        id: Any = None
+        name: Optional[str] = None
+
+    class _Summary(msgspec.Struct):
+        vehicles: List[_Vehicle] = []
+
+    class _CaptureEntry(msgspec.Struct):
+        t: float
+        response: _Summary
+
+    _summary_decoder = msgspec.json.Decoder(_Summary)
+    _capture_decoder = msgspec.json.Decoder(_CaptureEntry)
+
+
+def decode_summary(data):
+    """Decode a summary body, keeping only the fields the tracker uses.
+
+    The result has the shape of the API response,
+    {"vehicles": [{"id", "name", "device": {"state": {...}}}]}, where state
+    holds every SUMMARY_STATE_FIELDS key (None when missing), so it can be
+    parsed into fixes like the full one. Only for building fixes: anything
+    outside those fields is dropped.
+    """
+    if msgspec is not None:
+        return msgspec.to_builtins(_summary_decoder.decode(data))
+    return prune_summary(loads(data))
+
+
+def decode_capture_entry(data):
+    """Decode one capture line {"t", "response"} into (t, response) with a pruned response."""
+    if msgspec is not None:
+        entry = _capture_decoder.decode(data)
+        return entry.t, msgspec.to_builtins(entry.response)
+    entry = loads(data)
+    return entry['t'], prune_summary(entry['response'])
+
+
+def prune_summary(response):
+    """Reduce a decoded summary to the fields listed in decode_summary."""
+    vehicles = []
+    for vehicle in response.get('vehicles') or []:
+        state = vehicle['device']['state']
+        pruned = {'device': {'state': {k: state.get(k) for k in SUMMARY_STATE_FIELDS}}}
+        for key in ('id', 'name'):
+            if vehicle.get(key) is not None:
+                pruned[key] = vehicle[key]
+        vehicles.append(pruned)
+    return {'vehicles': vehicles}
@@ -1,9 +1,46 @@
 """
 Flask web server for live motorcycle location visualization.
 Uses Leaflet.js for interactive map display.
+
+The vehicle status is fetched by a single StatusPoller and shared by every
+request thread (and, under gunicorn, by every worker process through a
+shared memory snapshot), so upstream load does not grow with viewers.
 """
 
-from flask import Flask, jsonify, render_template_string, request
+import datetime
+import gzip
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+from circuit_breaker import CycleStats
+import json_backend
+
+from tiles import TileCache, build_tile, is_valid_tile, sample_stride, tile_bounds
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SERVERS = ('dev', 'waitress', 'gunicorn')
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 512
+
+# Immutable assets live under a content-hashed URL and can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# History tiles are queried with this fraction of the tile size as margin so
+# track segments continue slightly past the tile edge
+TILE_BUFFER = 1 / 16
 
 # HTML template with Leaflet.js map
 MAP_TEMPLATE = '''
@@ -95,144 +132,556 @@ MAP_TEMPLATE = '''
             <span class="info-label">Speed:</span>
             <span class="info-value" id="speed">-</span>
         </div>
+        <div class="info-row">
+            <span class="info-label">Place:</span>
+            <span class="info-value" id="place">-</span>
+        </div>
         <div class="last-update">Last update: <span id="lastUpdate">-</span></div>
     </div>
 
-    <script>
-        // Initialize map centered on Europe (will auto-center on first data)
-        var map = L.map('map').setView([40.0, -8.0], 13);
-        
-        L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-            attribution: '© OpenStreetMap contributors'
-        }).addTo(map);
-        
-        // Custom motorcycle icon
-        var bikeIcon = L.divIcon({
-            html: '<div style="font-size: 24px;">🏍️</div>',
-            iconSize: [30, 30],
-            iconAnchor: [15, 15],
-            className: 'bike-marker'
-        });
-        
-        var marker = null;
-        var pathLine = null;
-        var pathCoords = [];
-        var firstLoad = true;
-        
-        function updatePosition() {
-            fetch('/api/current')
-                .then(response => response.json())
-                .then(data => {
-                    if (data.error) {
-                        console.error('Error:', data.error);
-                        return;
-                    }
-                    
-                    var lat = parseFloat(data.lat);
-                    var lng = parseFloat(data.lng);
-                    
-                    // Update info panel
-                    document.getElementById('lat').textContent = lat.toFixed(6);
-                    document.getElementById('lng').textContent = lng.toFixed(6);
-                    document.getElementById('speed').textContent = data.speed + ' km/h';
-                    document.getElementById('lastUpdate').textContent = new Date().toLocaleTimeString();
-                    
-                    // Update status
-                    var statusDot = document.getElementById('statusDot');
-                    var statusText = document.getElementById('statusText');
-                    if (data.status === 'MOVING') {
-                        statusDot.className = 'status-dot status-moving';
-                        statusText.textContent = 'Moving';
-                    } else {
-                        statusDot.className = 'status-dot status-rest';
-                        statusText.textContent = 'At Rest';
-                    }
-                    
-                    // Update or create marker
-                    if (marker === null) {
-                        marker = L.marker([lat, lng], {icon: bikeIcon}).addTo(map);
-                    } else {
-                        marker.setLatLng([lat, lng]);
-                    }
-                    
-                    // Add to path
-                    pathCoords.push([lat, lng]);
-                    if (pathCoords.length > 100) {
-                        pathCoords.shift(); // Keep last 100 points
-                    }
-                    
-                    // Update path line
-                    if (pathLine) {
-                        map.removeLayer(pathLine);
-                    }
-                    if (pathCoords.length > 1) {
-                        pathLine = L.polyline(pathCoords, {
-                            color: '#3498db',
-                            weight: 3,
-                            opacity: 0.7
-                        }).addTo(map);
-                    }
-                    
-                    // Center map on first load
-                    if (firstLoad) {
-                        map.setView([lat, lng], 15);
-                        firstLoad = false;
-                    }
-                })
-                .catch(error => console.error('Fetch error:', error));
-        }
-        
-        // Initial load
-        updatePosition();
-        
-        // Auto-refresh
-        setInterval(updatePosition, {{ refresh_rate }} * 1000);
-    </script>
+    <script src="{{ script_url }}"></script>
 </body>
 </html>
 '''
 
+# Map page script, served separately under a content-hashed URL
+MAP_SCRIPT_TEMPLATE = '''
+// Initialize map centered on Europe (will auto-center on first data)
+var map = L.map('map').setView([40.0, -8.0], 13);
+
+L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    attribution: '© OpenStreetMap contributors'
+}).addTo(map);
+
+// Custom motorcycle icon
+var bikeIcon = L.divIcon({
+    html: '<div style="font-size: 24px;">🏍️</div>',
+    iconSize: [30, 30],
+    iconAnchor: [15, 15],
+    className: 'bike-marker'
+});
+
+// Stored history, loaded per tile for the visible area only
+var historyStyle = {color: '#8e44ad', weight: 2, opacity: 0.6};
+var historyTiles = {};
+var HistoryGrid = L.GridLayer.extend({
+    createTile: function(coords, done) {
+        var tile = document.createElement('div');
+        var key = coords.z + '/' + coords.x + '/' + coords.y;
+        historyTiles[key] = null;
+        fetch('/tiles/' + key)
+            .then(response => response.json())
+            .then(data => {
+                // The tile may have been unloaded while it was loading
+                if (key in historyTiles && data.features && data.features.length) {
+                    historyTiles[key] = L.geoJSON(data, {
+                        style: historyStyle,
+                        pointToLayer: (feature, latlng) => L.circleMarker(latlng, {radius: 2})
+                    }).addTo(historyLayer);
+                }
+                done(null, tile);
+            })
+            .catch(error => done(error, tile));
+        return tile;
+    }
+});
+var historyLayer = L.layerGroup();
+var historyGrid = new HistoryGrid({maxZoom: 19});
+historyGrid.on('tileunload', function(e) {
+    var key = e.coords.z + '/' + e.coords.x + '/' + e.coords.y;
+    if (historyTiles[key]) {
+        historyLayer.removeLayer(historyTiles[key]);
+    }
+    delete historyTiles[key];
+});
+var historyGroup = L.layerGroup([historyGrid, historyLayer]).addTo(map);
+L.control.layers(null, {'History': historyGroup}).addTo(map);
+
+var marker = null;
+var pathLine = null;
+var pathCoords = [];
+var firstLoad = true;
+
+function updatePosition() {
+    fetch('/api/current')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                console.error('Error:', data.error);
+                return;
+            }
+            
+            var lat = parseFloat(data.lat);
+            var lng = parseFloat(data.lng);
+            
+            // Update info panel
+            document.getElementById('lat').textContent = lat.toFixed(6);
+            document.getElementById('lng').textContent = lng.toFixed(6);
+            document.getElementById('speed').textContent = data.speed + ' km/h';
+            document.getElementById('place').textContent = data.place || '-';
+            document.getElementById('lastUpdate').textContent = new Date().toLocaleTimeString();
+            
+            // Update status
+            var statusDot = document.getElementById('statusDot');
+            var statusText = document.getElementById('statusText');
+            if (data.status === 'MOVING') {
+                statusDot.className = 'status-dot status-moving';
+                statusText.textContent = 'Moving';
+            } else {
+                statusDot.className = 'status-dot status-rest';
+                statusText.textContent = 'At Rest';
+            }
+            
+            // Update or create marker
+            if (marker === null) {
+                marker = L.marker([lat, lng], {icon: bikeIcon}).addTo(map);
+            } else {
+                marker.setLatLng([lat, lng]);
+            }
+            
+            // Add to path
+            pathCoords.push([lat, lng]);
+            if (pathCoords.length > 100) {
+                pathCoords.shift(); // Keep last 100 points
+            }
+            
+            // Update path line
+            if (pathLine) {
+                map.removeLayer(pathLine);
+            }
+            if (pathCoords.length > 1) {
+                pathLine = L.polyline(pathCoords, {
+                    color: '#3498db',
+                    weight: 3,
+                    opacity: 0.7
+                }).addTo(map);
+            }
+            
+            // Center map on first load
+            if (firstLoad) {
+                map.setView([lat, lng], 15);
+                firstLoad = false;
+            }
+        })
+        .catch(error => console.error('Fetch error:', error));
+}
+
+// Initial load
+updatePosition();
+
+// Auto-refresh
+setInterval(updatePosition, {{ refresh_rate }} * 1000);
+'''
+
+
+def compress(body, encoding):
+    """Compress a body with 'br' or 'gzip'."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def supported_encodings():
+    """Content encodings this server can produce, in order of preference."""
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+
+def negotiate_encoding(req):
+    """Pick the best encoding accepted by the request, or None."""
+    return req.accept_encodings.best_match(supported_encodings())
+
+
+def parse_bbox(value):
+    """Parse 'min_lng,min_lat,max_lng,max_lat' into a tuple of floats."""
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    return tuple(parts)
+
+
+def parse_time(value):
+    """Parse epoch seconds or an ISO-8601 timestamp into an aware datetime.
+
+    Raises ValueError for anything else, including epochs out of range.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed
+    try:
+        return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError) as e:
+        raise ValueError(f"Timestamp out of range: {value}") from e
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with json_backend (orjson/msgspec when installed)."""
+
+    def dumps(self, obj, **kwargs):
+        return json_backend.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return json_backend.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_backend.dumps(obj), mimetype=self.mimetype)
+
+
+class StaticAsset:
+    """A response body rendered and compressed once, served with a strong ETag."""
+
+    def __init__(self, body, content_type, cache_control):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {None: body}
+        for encoding in supported_encodings():
+            self.bodies[encoding] = compress(body, encoding)
+
+    def response(self, req):
+        """Build the response for a request, honouring If-None-Match."""
+        if self.etag in req.if_none_match:
+            resp = Response(status=304)
+        else:
+            encoding = negotiate_encoding(req)
+            resp = Response(self.bodies[encoding], content_type=self.content_type)
+            if encoding:
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(self.etag)
+        resp.headers['Cache-Control'] = self.cache_control
+        resp.vary.add('Accept-Encoding')
+        return resp
+
+
+class LocalSnapshot:
+    """Latest status shared between threads of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = None
 
-def create_app(mapit_instance, refresh_rate=5):
-    """Create Flask app with mapit instance for API calls."""
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def get(self):
+        with self._lock:
+            return self._value
+
+
+class SharedSnapshot:
+    """Latest status shared between forked processes.
+
+    Backed by an anonymous shared mmap, so it must be created before the
+    worker processes are forked.
+    """
+
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, size=65536):
+        self._map = mmap.mmap(-1, size)
+        self._lock = multiprocessing.Lock()
+        self._size = size
+
+    def set(self, value):
+        payload = json_backend.dumps(value)
+        if len(payload) + self.HEADER.size > self._size:
+            raise ValueError("Snapshot too large for shared memory")
+        with self._lock:
+            self._map.seek(0)
+            self._map.write(self.HEADER.pack(len(payload)) + payload)
+
+    def get(self):
+        with self._lock:
+            self._map.seek(0)
+            (length,) = self.HEADER.unpack(self._map.read(self.HEADER.size))
+            payload = self._map.read(length)
+        return json_backend.loads(payload) if length else None
+
+
+class StatusPoller:
+    """Poll the vehicle status in one background thread for all clients."""
+
+    def __init__(self, mapit_instance, interval=5, snapshot=None, logger=None, geocoder=None, timeout=15,
+                 report_every=100):
+        self.mapit = mapit_instance
+        self.interval = interval
+        self.timeout = timeout
+        self.report_every = report_every
+        self.cycles = CycleStats()
+        self.geocoder = geocoder
+        self.snapshot = snapshot or LocalSnapshot()
+        self.logger = logger or logging.getLogger(__name__)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start polling in a daemon thread."""
+        self._thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling and wait for the thread to exit."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.interval + 1)
+
+    def current(self):
+        """Return the last polled status dict, or None before the first poll."""
+        return self.snapshot.get()
+
+    def poll(self):
+        """Fetch the status once, within timeout seconds, and publish it."""
+        with self.mapit.request_deadline(self.timeout):
+            lng, lat, speed, status, _ = self.mapit.checkStatus(allow_stale=True)
+        current = {
+            'lng': lng,
+            'lat': lat,
+            'speed': speed,
+            'status': status,
+            'updated_at': time.time()
+        }
+        if self.geocoder is not None:
+            current['place'] = self.geocoder.label(lng, lat)
+        self.snapshot.set(current)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+                self.cycles.record(time.monotonic() - started)
+            except Exception as e:
+                self.cycles.record(time.monotonic() - started, e)
+                self.logger.warning("Status poll failed: %s", e)
+            if self.cycles.cycles % self.report_every == 0:
+                self.logger.info("Status polls: %s", self.cycles.stats())
+                self.logger.info("Requests: %s", self.mapit.request_stats())
+            self._stop.wait(self.interval)
+
+
+def create_app(mapit_instance, refresh_rate=5, poller=None, tile_cache=None, geocoder=None):
+    """Create Flask app with mapit instance for API calls.
+
+    With a poller, /api/current answers from the poller's last status
+    instead of calling the Mapit API on every request. History tiles are
+    cached in tile_cache (memory only by default). With geocoder (a
+    geocode.ReverseGeocoder) /api/current includes the place name.
+    """
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     app.config['mapit'] = mapit_instance
     app.config['refresh_rate'] = refresh_rate
+    app.config['poller'] = poller
+    app.config['geocoder'] = geocoder
+    app.config['tile_cache'] = tile_cache or TileCache()
+
+    # Render the page and its script once; both only depend on refresh_rate
+    script = StaticAsset(
+        app.jinja_env.from_string(MAP_SCRIPT_TEMPLATE).render(refresh_rate=refresh_rate),
+        'application/javascript; charset=utf-8',
+        IMMUTABLE_CACHE_CONTROL
+    )
+    script_url = f'/static/map.{script.etag}.js'
+    page = StaticAsset(
+        app.jinja_env.from_string(MAP_TEMPLATE).render(
+            refresh_rate=refresh_rate, script_url=script_url
+        ),
+        'text/html; charset=utf-8',
+        'no-cache'
+    )
+
+    @app.after_request
+    def compress_json(response):
+        """Compress JSON API responses with the negotiated encoding."""
+        if (response.mimetype != 'application/json'
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request)
+        body = response.get_data()
+        if encoding and len(body) >= COMPRESS_MIN_SIZE:
+            response.set_data(compress(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
     
     @app.route('/')
     def index():
         """Serve the map page."""
-        return render_template_string(MAP_TEMPLATE, refresh_rate=app.config['refresh_rate'])
+        return page.response(request)
+    
+    @app.route(script_url)
+    def map_script():
+        """Serve the map page script."""
+        return script.response(request)
     
     @app.route('/api/current')
     def get_current():
         """Get current vehicle position."""
         try:
+            poller = app.config['poller']
+            if poller is not None:
+                current = poller.current()
+                if current is None:
+                    return jsonify({'error': 'No position received yet'}), 503
+                return jsonify(current)
             mapit = app.config['mapit']
-            lng, lat, speed, status, _ = mapit.checkStatus()
-            return jsonify({
+            lng, lat, speed, status, _ = mapit.checkStatus(allow_stale=True)
+            current = {
                 'lng': lng,
                 'lat': lat,
                 'speed': speed,
                 'status': status
-            })
+            }
+            if app.config['geocoder'] is not None:
+                current['place'] = app.config['geocoder'].label(lng, lat)
+            return jsonify(current)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     @app.route('/api/history')
     def get_history():
-        """Get location history from Oracle database."""
+        """Get location history from Oracle database.
+
+        Optional filters: bbox=min_lng,min_lat,max_lng,max_lat and
+        since/until as epoch seconds or ISO-8601 timestamps.
+        """
         try:
-            mapit = app.config['mapit']
             limit = int(request.args.get('limit', 100))
-            history = mapit.get_history_from_oracle(limit)
-            return jsonify(history)
+            bbox = request.args.get('bbox')
+            since = request.args.get('since')
+            until = request.args.get('until')
+            bbox = parse_bbox(bbox) if bbox else None
+            since = parse_time(since) if since else None
+            until = parse_time(until) if until else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            mapit = app.config['mapit']
+            if bbox is None and since is None and until is None:
+                history = mapit.get_history_from_oracle(limit)
+            else:
+                history = mapit.query_positions(bbox, since, until, limit)
+            return jsonify(history.as_dicts())
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/stats')
+    def get_stats():
+        """Get statistics of the history: distance, speeds, stops and outliers.
+
+        Optional filters: since/until as epoch seconds or ISO-8601
+        timestamps. report=summary|stops|speeds|outliers (default summary).
+        """
+        import analytics
+
+        try:
+            report = request.args.get('report', 'summary')
+            if report not in analytics.REPORTS:
+                raise ValueError(f"Unknown report: {report}")
+            limit = int(request.args.get('limit', 1000000))
+            since = request.args.get('since')
+            until = request.args.get('until')
+            since = parse_time(since) if since else None
+            until = parse_time(until) if until else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            track = app.config['mapit'].load_track(since, until, limit)
+            return jsonify(analytics.report(track, report))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/tiles/<int:z>/<int:x>/<int:y>')
+    def get_tile(z, x, y):
+        """Get simplified history inside a map tile as GeoJSON."""
+        if not is_valid_tile(z, x, y):
+            return jsonify({'error': 'Invalid tile'}), 404
+        try:
+            cache = app.config['tile_cache']
+            body = cache.get((z, x, y))
+            if body is None:
+                min_lng, min_lat, max_lng, max_lat = tile_bounds(z, x, y)
+                pad_lng = (max_lng - min_lng) * TILE_BUFFER
+                pad_lat = (max_lat - min_lat) * TILE_BUFFER
+                stride = sample_stride(z)
+                rows = app.config['mapit'].get_track_in_bbox(
+                    (min_lng - pad_lng, min_lat - pad_lat, max_lng + pad_lng, max_lat + pad_lat),
+                    stride=stride
+                )
+                body = cache.put((z, x, y), build_tile(rows, z, stride))
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+        
+        if 'gzip' in request.accept_encodings:
+            resp = Response(body, content_type='application/geo+json')
+            resp.headers['Content-Encoding'] = 'gzip'
+        else:
+            resp = Response(gzip.decompress(body), content_type='application/geo+json')
+        resp.headers['Cache-Control'] = f'public, max-age={cache.max_age}'
+        resp.vary.add('Accept-Encoding')
+        return resp
     
     return app
 
 
+def serve(app, server='dev', port=5000, workers=2, threads=8, logger=None):
+    """Run the app on the given server until interrupted.
+
+    Args:
+        app: Flask app from create_app
+        server: 'dev' (Flask development server), 'waitress' (one process,
+            `threads` request threads) or 'gunicorn' (`workers` processes
+            with `threads` threads each)
+    """
+    logger = logger or logging.getLogger(__name__)
+    if server == 'dev':
+        app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    elif server == 'waitress':
+        try:
+            from waitress import serve as waitress_serve
+        except ImportError:
+            raise ValueError("--server waitress needs waitress. Run: pip install waitress") from None
+        logger.info("Serving with waitress (%d threads)", threads)
+        waitress_serve(app, host='0.0.0.0', port=port, threads=threads)
+    elif server == 'gunicorn':
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise ValueError("--server gunicorn needs gunicorn (Linux/macOS only). "
+                             "Run: pip install gunicorn") from None
+
+        class MapServerApplication(BaseApplication):
+            def __init__(self, application, options):
+                self.application = application
+                self.options = options
+                super().__init__()
+
+            def load_config(self):
+                for key, value in self.options.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return self.application
+
+        logger.info("Serving with gunicorn (%d workers x %d threads)", workers, threads)
+        MapServerApplication(app, {
+            'bind': f'0.0.0.0:{port}',
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+        }).run()
+    else:
+        raise ValueError(f"Unknown server: {server}")
+
+
 if __name__ == '__main__':
     print("This module should be imported by mapit.py")
     print("Usage: python mapit.py --serve-map --map-port 5000 --refresh-rate 5")
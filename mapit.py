@@ -7,6 +7,29 @@ import time
 import logging
 import argparse
 import os
+import threading
+from contextlib import contextmanager
+
+from geo import geohash_cover, geohash_encode
+import json_backend
+from position import Position, PositionBatch
+from retention import HISTORY_TABLE
+from circuit_breaker import CircuitBreaker
+from rate_limit import DeadlineExceeded, RequestScheduler, SingleFlight
+from token_store import ID_TOKEN_LIFETIME, TokenStore
+
+# Columns returned for history records, in position.FIELDS order
+HISTORY_COLUMNS = ("lng, lat, speed, status, battery, hdop, odometer, last_coord_ts, smooth_lng, smooth_lat, "
+                   "smooth_speed, creation_ts, id")
+
+# Seconds between checks whether retention created the downsampled history table
+HISTORY_TABLE_RECHECK = 600
+
+# Indexes backing history, time-range and bounding-box queries
+TRACKING_INDEXES = (
+  "CREATE INDEX MAPIT_VT_CREATION_IX ON MAPIT_VEHICLE_TRACKING (creation_ts)",
+  "CREATE INDEX MAPIT_VT_GEOHASH_IX ON MAPIT_VEHICLE_TRACKING (geohash, creation_ts)",
+)
 
 class RequestFailedException(Exception):
     pass
@@ -14,9 +37,18 @@ class RequestFailedException(Exception):
 class TokenExpiredException(Exception):
     pass
 
+class RateLimitedException(RequestFailedException):
+    pass
+
+class DeadlineExceededException(RequestFailedException):
+    pass
+
+class CircuitOpenException(RequestFailedException):
+    pass
+
 class Mapit:
   
-  def __init__(self, username, password, mappit_identityPoolId, mappit_userPoolId, mappit_userPoolWebClientId, oracle_user, oracle_password, oracle_dns, logger, mongo_url="mongodb://localhost:27017/", debug=False, skip_db_init=False):
+  def __init__(self, username, password, mappit_identityPoolId, mappit_userPoolId, mappit_userPoolWebClientId, oracle_user, oracle_password, oracle_dns, logger, mongo_url="mongodb://localhost:27017/", debug=False, skip_db_init=False, summary_max_staleness=300, token_file=None, max_rps=2.0, request_timeout=10):
     self.logger = logger
     self.debug = debug
     self.try_count = 0
@@ -39,34 +71,121 @@ class Mapit:
     
     # Initialize database connections (can be deferred)
     self._oracle_conn = None
+    self._oracle_pool = None
+    self._oracle_pool_pid = None
+    self._oracle_pool_size = None
+    
+    # Bounding-box queries use the geohash index once every row has a geohash,
+    # otherwise an in-process grid index built from the table
+    self._geohash_ready = None
+    # Reads continue into the downsampled history of purged partitions once
+    # retention has created it (re-checked every HISTORY_TABLE_RECHECK seconds)
+    self._history_ready = False
+    self._history_checked_at = None
+    self._grid_index = None
+    self._grid_index_lock = threading.Lock()
     self._mongo_client = None
     self._mongo_db = None
     self._mongo_collection = None
     
+    # Optional replay.SummaryRecorder receiving every polled summary
+    self.recorder = None
+    
+    # Serve and export the Kalman-smoothed positions where they are stored
+    self.use_smoothed = False
+    
     if not skip_db_init:
       self._init_oracle_connection()
       # Oracle connection is lazy - only connect when needed
     
+    # Requests of this account leave at max_rps per host, retried when throttled,
+    # and concurrent summary fetches share one request
+    self.scheduler = RequestScheduler(rate=max_rps, logger=logger)
+    self._summary_flight = SingleFlight()
+    
+    # Every request is bounded by request_timeout and by the deadline of the
+    # polling cycle it belongs to (request_deadline), and goes through the
+    # circuit breaker of its host
+    self.request_timeout = request_timeout
+    self._deadline = threading.local()
+    self._breakers = {}
+    self._breakers_lock = threading.Lock()
+    
+    # Credentials shared by every process of this machine (see token_store.py)
+    mypath = os.path.dirname(os.path.realpath(__file__))
+    self.token_store = TokenStore(token_file or f"{mypath}/tokens.json")
     self.getAllTokens(username, password)
+    
+    # Last summary survives restarts so the first request can be served from disk
+    self.summary_max_staleness = summary_max_staleness
+    self._summary_revalidated = False
+    self._summary_refresh_lock = threading.Lock()
+    self._init_summary_cache()
+
+  def _init_summary_cache(self):
+    """Load the persistent summary cache of this account."""
+    from summary_cache import SummaryCache
+    mypath = os.path.dirname(os.path.realpath(__file__))
+    # An unchanged summary is rewritten at half the staleness it may be served at
+    self.summary_cache = SummaryCache(f"{mypath}/summary_cache_{self.id}.json",
+                                      refresh_interval=self.summary_max_staleness / 2 or None)
+    if self.summary_cache.load():
+      self.logger.debug("Loaded cached summary (%.0fs old)", self.summary_cache.age())
+
+  def _oracle_connect_params(self):
+    """Connection parameters shared by single connections and pools."""
+    mypath = os.path.dirname(os.path.realpath(__file__))
+    return dict(
+      config_dir=f"{mypath}/wallet",
+      user=self.oracle_user,
+      password=self.oracle_password,
+      dsn=self.oracle_dns,
+      wallet_location=f"{mypath}/wallet",
+      wallet_password=self.oracle_password,
+      tcp_connect_timeout=10  # 10 second timeout
+    )
 
   def _init_oracle_connection(self):
-    """Initialize Oracle database connection with timeout."""
+    """Initialize Oracle database connection (or pool) with timeout."""
     try:
-      mypath = os.path.dirname(os.path.realpath(__file__))
-      self._oracle_conn = oracledb.connect(
-        config_dir=f"{mypath}/wallet",
-        user=self.oracle_user,
-        password=self.oracle_password,
-        dsn=self.oracle_dns,
-        wallet_location=f"{mypath}/wallet",
-        wallet_password=self.oracle_password,
-        tcp_connect_timeout=10  # 10 second timeout
-      )
-      self.logger.info("Successfully connected to Oracle Database")
-      self._ensure_oracle_table()
+      if self._oracle_pool_size:
+        min_size, max_size = self._oracle_pool_size
+        self._oracle_pool = oracledb.create_pool(
+          min=min_size, max=max_size, increment=1, **self._oracle_connect_params()
+        )
+        self._oracle_pool_pid = os.getpid()
+        self.logger.info("Created Oracle connection pool (%d-%d connections)", min_size, max_size)
+      else:
+        self._oracle_conn = oracledb.connect(**self._oracle_connect_params())
+        self.logger.info("Successfully connected to Oracle Database")
+      with self._oracle_connection() as conn:
+        self._ensure_oracle_table(conn)
     except Exception as e:
       self.logger.error("Failed to connect to Oracle Database: %s", e)
       self._oracle_conn = None
+      self._oracle_pool = None
+
+  def enable_oracle_pool(self, min_size=1, max_size=4):
+    """Use a connection pool instead of a single connection.
+
+    The pool is created lazily by the process that first uses it, so this
+    can be called before forking server workers; each process then gets
+    its own pool and never shares sockets with its parent.
+    """
+    if self._oracle_conn:
+      self._oracle_conn.close()
+      self._oracle_conn = None
+    self._oracle_pool = None
+    self._oracle_pool_size = (min_size, max_size)
+
+  @contextmanager
+  def _oracle_connection(self):
+    """Yield a connection from the pool, or the single connection."""
+    if self._oracle_pool is not None:
+      with self._oracle_pool.acquire() as conn:
+        yield conn
+    else:
+      yield self._oracle_conn
 
   def _init_mongo_connection(self):
     """Initialize MongoDB connection."""
@@ -79,11 +198,11 @@ class Mapit:
       self.logger.error("Failed to connect to MongoDB: %s", e)
       self._mongo_client = None
 
-  def _ensure_oracle_table(self):
+  def _ensure_oracle_table(self, conn):
     """Create vehicle_data table if it doesn't exist."""
-    if not self._oracle_conn:
+    if not conn:
       return
-    cursor = self._oracle_conn.cursor()
+    cursor = conn.cursor()
     try:
       # Create MAPIT schema/table for vehicle tracking
       # Using a more organized table name for multi-use database
@@ -97,10 +216,16 @@ class Mapit:
           hdop NUMBER(6, 2),
           odometer NUMBER(10, 2),
           last_coord_ts NUMBER(13),
+          geohash VARCHAR2(12),
+          smooth_lng NUMBER(10, 7),
+          smooth_lat NUMBER(10, 7),
+          smooth_speed NUMBER(6, 2),
           creation_ts timestamp with time zone default current_timestamp,
           primary key (id)
       )''')
-      self._oracle_conn.commit()
+      for statement in TRACKING_INDEXES:
+        cursor.execute(statement)
+      conn.commit()
       self.logger.info("Created MAPIT_VEHICLE_TRACKING table")
     except oracledb.DatabaseError as e:
       if "ORA-00955" in str(e):  # Table already exists
@@ -110,40 +235,83 @@ class Mapit:
 
   def close_connections(self):
     """Close all database connections."""
+    self.summary_cache.flush()
+    if self.recorder is not None:
+      self.recorder.close()
     if self._oracle_conn:
       self._oracle_conn.close()
       self.logger.debug("Oracle connection closed")
+    if self._oracle_pool is not None and self._oracle_pool_pid == os.getpid():
+      self._oracle_pool.close()
+      self.logger.debug("Oracle connection pool closed")
     if self._mongo_client:
       self._mongo_client.close()
       self.logger.debug("MongoDB connection closed")
 
   def _ensure_oracle_connected(self):
     """Ensure Oracle connection is established (lazy initialization)."""
+    if self._oracle_pool_size:
+      if self._oracle_pool is None or self._oracle_pool_pid != os.getpid():
+        self._init_oracle_connection()
+      return self._oracle_pool is not None
     if self._oracle_conn is None:
       self._init_oracle_connection()
     return self._oracle_conn is not None
 
-  def storeOracle(self, response):
-    """Store vehicle data in Oracle database."""
+  def storeOracle(self, position):
+    """Store a Position in Oracle database."""
+    self.logger.info("Storing data in Oracle DB: %s", position)
+    if not self.store_oracle_batch([position]):
+      return False
+    self.logger.info("Data stored in Oracle DB successfully")
+    return True
+
+  def store_oracle_batch(self, positions):
+    """Store several Positions with a single executemany and commit."""
     if not self._ensure_oracle_connected():
       self.logger.error("Oracle connection not available")
       return False
     
-    self.logger.info("Storing data in Oracle DB: %s", response)
-    cursor = self._oracle_conn.cursor()
-    
-    # Insert data into the table
-    data = [response]
-    cursor.executemany(
-      "INSERT INTO MAPIT_VEHICLE_TRACKING (lng, lat, speed, status, battery, hdop, odometer, last_coord_ts) "
-      "VALUES (:lng, :lat, :speed, :status, :battery, :hdop, :odometer, :last_coord_ts)", 
-      data
-    )
-    self._oracle_conn.commit()
+    with self._oracle_connection() as conn:
+      cursor = conn.cursor()
+      
+      # Insert data into the table
+      data = [(p.lng, p.lat, p.speed, p.status, p.battery, p.hdop, p.odometer, p.last_coord_ts,
+               geohash_encode(p.lng, p.lat), p.smooth_lng, p.smooth_lat, p.smooth_speed) for p in positions]
+      cursor.executemany(
+        "INSERT INTO MAPIT_VEHICLE_TRACKING (lng, lat, speed, status, battery, hdop, odometer, last_coord_ts, geohash, "
+        "smooth_lng, smooth_lat, smooth_speed) VALUES (:1, :2, :3, :4, :5, :6, :7, :8, :9, :10, :11, :12)", 
+        data
+      )
+      conn.commit()
     
-    self.logger.info("Data stored in Oracle DB successfully")
+    self.logger.debug("Stored %d fixes in Oracle DB", len(positions))
     return True
 
+  def store_smoothed(self, batch):
+    """Update the smoothed columns of stored fixes from a PositionBatch; return the rows updated."""
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return 0
+    
+    data = [row for row in zip(batch.smooth_lng, batch.smooth_lat, batch.smooth_speed, batch.id)
+            if row[0] is not None]
+    with self._oracle_connection() as conn:
+      cursor = conn.cursor()
+      cursor.executemany(
+        "UPDATE MAPIT_VEHICLE_TRACKING SET smooth_lng = :1, smooth_lat = :2, smooth_speed = :3 WHERE id = :4",
+        data
+      )
+      conn.commit()
+    return len(data)
+
+  def _history_batch(self, rows, smoothed=None):
+    """Build a PositionBatch, with smoothed positions in place of the raw ones if requested."""
+    batch = PositionBatch.from_rows(rows)
+    if self.use_smoothed if smoothed is None else smoothed:
+      batch = batch.smoothed()
+    return batch
+
   def storeMongo(self, response):
     """Store vehicle data in MongoDB."""
     if not self._mongo_client:
@@ -190,10 +358,36 @@ class Mapit:
     Auth_value = f"AWS4-HMAC-SHA256 Credential={self.access_key}/{datestamp}/{self.region}/{self.service}/aws4_request, SignedHeaders=accept;host;x-amz-date Signature={signature}"
     return Auth_value, amz_date
 
-  def sendRequest(self, url, headers, contentype='application/x-amz-json-1.1', method='POST', payload=None, url_type='https://'):
+  def sendRequest(self, url, headers, contentype='application/x-amz-json-1.1', method='POST', payload=None, url_type='https://', raw=False):
     self.logger.debug("Sending request to URL: %s with headers: %s and payload: %s", url, headers, payload)
     headers['content-type'] = contentype
-    response = requests.request(method, url_type+url, headers=headers, json=payload)
+    host = url.split('/', 1)[0].split('?', 1)[0]
+    deadline = getattr(self._deadline, 'at', None)
+    self._request_timeout(deadline)
+    breaker = self.breaker(host)
+    if not breaker.allow():
+      raise CircuitOpenException(f"Circuit open for {host}, retrying in {breaker.retry_in():.0f}s")
+
+    def request():
+      return requests.request(method, url_type+url, headers=headers, json=payload,
+                              timeout=self._request_timeout(deadline))
+
+    try:
+      response = self.scheduler.send(host, request, deadline)
+    except requests.RequestException as e:
+      breaker.record_failure()
+      raise RequestFailedException(f"Error on request to {host}: {e}") from e
+    except DeadlineExceededException:
+      # Refused locally before reaching the host: not a failure of the host
+      breaker.cancel()
+      raise
+    except DeadlineExceeded as e:
+      breaker.cancel()
+      raise DeadlineExceededException(str(e)) from e
+    if response.status_code >= 500 or response.status_code == 429:
+      breaker.record_failure()
+    else:
+      breaker.record_success()
     ## Check if the response is 200
     if self.debug:
       if self.try_count > 10:
@@ -203,12 +397,44 @@ class Mapit:
     if response.status_code == 403:
       print("Token expired. Getting new tokens")
       raise TokenExpiredException("Token expired")
+    if raw and response.status_code == 304:
+      return response
+    if response.status_code == 429:
+      raise RateLimitedException(f"Rate limited on {host} after {self.scheduler.max_retries} retries")
     if response.status_code != 200:
       print(f"Error on {url}: ", response.status_code)
       print(response.text)
       raise RequestFailedException(f"Error on request: {response.status_code}")
-    return response.json()
+    if raw:
+      return response
+    return json_backend.loads(response.content)
   
+  def _request_timeout(self, deadline):
+    """Seconds a request may take: request_timeout, cut to what is left before deadline."""
+    if deadline is None:
+      return self.request_timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      raise DeadlineExceededException("Polling cycle deadline exceeded")
+    return min(self.request_timeout, remaining)
+
+  @contextmanager
+  def request_deadline(self, seconds):
+    """Bound every request of this thread within the block to finish seconds from now."""
+    self._deadline.at = time.monotonic() + seconds
+    try:
+      yield
+    finally:
+      self._deadline.at = None
+
+  def breaker(self, host):
+    """Circuit breaker of an upstream host."""
+    with self._breakers_lock:
+      breaker = self._breakers.get(host)
+      if breaker is None:
+        breaker = self._breakers[host] = CircuitBreaker(host, logger=self.logger)
+      return breaker
+
   def getTokens(self, username, password):
     self.logger.debug("Getting tokens for username: %s", username)
     payload = { "AuthFlow": self.authenticationFlowType,
@@ -253,7 +479,7 @@ class Mapit:
     user = self.sendRequest(self.url_idp, headers, payload=payload)
     return user
 
-  def authorizedRequest(self, spacename, canonical_querystring='', method='GET', payload=None):
+  def authorizedRequest(self, spacename, canonical_querystring='', method='GET', payload=None, extra_headers=None, raw=False):
     self.logger.debug("Making authorized request to spacename: %s", spacename)
     Auth_value, amz_date = self.createAuthValue(method, spacename, canonical_querystring)
     url = self.host + spacename + '?' + canonical_querystring
@@ -265,7 +491,9 @@ class Mapit:
         'x-amz-date': amz_date,
         'Authorization': Auth_value,
     }
-    return self.sendRequest(url, headers, method=method, payload=payload)
+    if extra_headers:
+      headers.update(extra_headers)
+    return self.sendRequest(url, headers, method=method, payload=payload, raw=raw)
   
   def getId(self, account):
     self.logger.debug("Getting ID for account: %s", account)
@@ -276,19 +504,75 @@ class Mapit:
     self.id = response[0]['id']
     return response
   
-  def getSummary(self):
+  def getSummary(self, allow_stale=False):
+    """Get the account summary.
+
+    With allow_stale, the first call after startup answers from the
+    persistent cache (if younger than summary_max_staleness) and refreshes
+    it in the background.
+    """
+    if (allow_stale and not self._summary_revalidated
+        and self.summary_cache.is_usable(self.summary_max_staleness)):
+      self.logger.debug("Serving cached summary while revalidating")
+      self._start_background_refresh()
+      return self.summary_cache.response
+    return self._fetchSummary()
+
+  def _fetchSummary(self):
+    """Fetch the summary; callers arriving while a fetch is in flight share its result."""
+    return self._summary_flight.do('summary', self._fetchSummaryOnce)
+
+  def _fetchSummaryOnce(self):
     self.logger.debug("Getting summary for ID: %s", self.id)
     spacename = '/v1/accounts/' + self.id + '/summary'
 
+    if not self.token_store.is_fresh(self.tokens):
+      self.logger.info("Tokens about to expire, refreshing tokens")
+      self.refresh_tokens(stale=self.sessionToken)
     try:
-      response = self.authorizedRequest(spacename)
+      response = self._requestSummary(spacename)
     except TokenExpiredException:
       self.logger.info("Token expired, refreshing tokens")
-      self.generateTokens(self.username, self.password)
-      self.store_tokens_to_file()
-      response = self.authorizedRequest(spacename)
+      self.refresh_tokens(stale=self.sessionToken)
+      response = self._requestSummary(spacename)
       self.logger.debug("Token refreshed")
     return response
+
+  def _requestSummary(self, spacename):
+    """Fetch the summary, revalidating the cached one by ETag when possible."""
+    extra_headers = {}
+    if self.summary_cache.etag and self.summary_cache.response is not None:
+      extra_headers['If-None-Match'] = self.summary_cache.etag
+    response = self.authorizedRequest(spacename, extra_headers=extra_headers, raw=True)
+    if response.status_code == 304:
+      self.logger.debug("Summary not modified")
+      body, etag = self.summary_cache.response, self.summary_cache.etag
+    else:
+      body, etag = json_backend.loads(response.content), response.headers.get('ETag')
+    self.summary_cache.update(body, etag)
+    self._summary_revalidated = True
+    return body
+
+  def _start_background_refresh(self):
+    """Refresh the summary in a background thread unless one is running."""
+    if not self._summary_refresh_lock.acquire(blocking=False):
+      return
+
+    def refresh():
+      try:
+        self._fetchSummary()
+      except Exception as e:
+        self.logger.warning("Background summary refresh failed: %s", e)
+      finally:
+        self._summary_refresh_lock.release()
+
+    threading.Thread(target=refresh, name="summary-refresh", daemon=True).start()
+  
+  def request_stats(self):
+    """Scheduler counters, shared summary fetches and circuit breaker states."""
+    return dict(self.scheduler.stats(), summary_fetches=self._summary_flight.calls,
+                summary_shared=self._summary_flight.shared,
+                breakers={host: breaker.stats() for host, breaker in self._breakers.items()})
   
   def generateTokens(self, username, password):
     self.TokensResponse = self.getTokens(username, password)
@@ -297,30 +581,51 @@ class Mapit:
     self.IdResponse = self.getId(username.replace('@', '%40')) 
   
   def getAllTokens(self, username, password):
+    """Adopt the shared store's credentials, logging in only if none are usable."""
     self.logger.debug("Getting all tokens for username: %s", username)
-    if os.path.exists('tokens.json'):
-      self.load_tokens_from_file()
+    tokens = self.token_store.load(username)
+    if tokens is not None:
+      self.load_tokens(tokens)
+      self.logger.debug("Tokens loaded from %s", self.token_store.path)
     else:
-      self.generateTokens(username, password)
-      self.store_tokens_to_file()
+      self.refresh_tokens()
+
+  def refresh_tokens(self, stale=None):
+    """Replace the credentials, reusing ones another process stored meanwhile.
+
+    Args:
+      stale: session token the API rejected; the store's credentials are
+        only adopted if they differ from it
+    """
+    def login():
+      self.logger.info("Logging in as %s", self.username)
+      self.generateTokens(self.username, self.password)
+      return self.token_dict()
 
-  def store_tokens_to_file(self):
-    tokens = {
+    self.load_tokens(self.token_store.refresh(login, self.username, stale))
+
+  def token_dict(self):
+    """Current credentials as stored in the token store.
+
+    They expire with the AWS credentials or the one-hour ID token,
+    whichever comes first.
+    """
+    expires_at = time.time() + ID_TOKEN_LIFETIME
+    expiration = self.CredentialsResponse['Credentials'].get('Expiration')
+    if expiration is not None:
+      expires_at = min(expires_at, float(expiration))
+    return {
       'access_key': self.access_key,
       'secret_key': self.secret_key,
       'session_token': self.sessionToken,
       'identity_id': self.identityId,
       'id_token': self.idToken,
       'access_token': self.accessToken,
-      'id': self.id
+      'id': self.id,
+      'expires_at': expires_at
     }
-    with open('tokens.json', 'w') as f:
-      json.dump(tokens, f)
-    self.logger.debug("Tokens stored to file successfully")
 
-  def load_tokens_from_file(self):
-    with open('tokens.json', 'r') as f:
-      tokens = json.load(f)
+  def load_tokens(self, tokens):
     self.access_key = tokens['access_key']
     self.secret_key = tokens['secret_key']
     self.sessionToken = tokens['session_token']
@@ -328,60 +633,360 @@ class Mapit:
     self.idToken = tokens['id_token']
     self.accessToken = tokens['access_token']
     self.id = tokens['id']
-    self.logger.debug("Tokens loaded from file successfully")
+    self.tokens = tokens
 
   
-  def checkStatus(self):
+  def checkStatus(self, allow_stale=False):
     """Get current vehicle status (lng, lat, speed, status)."""
     self.logger.debug("Checking if moving")
-    response = self.getSummary()
-    state = response['vehicles'][0]['device']['state']
-    lng = state['lng']
-    lat = state['lat']
-    speed = state['speed']
-    status = state['status']
-    
-    # Normalize speed: set to 0 when vehicle is at rest
-    # API sometimes reports residual speed values when stopped
-    if status == 'AT_REST':
-      speed = 0
-    
+    response = self.getSummary(allow_stale)
+    if self.recorder is not None:
+      self.recorder.write(response)
+    lng, lat, speed, status = self.parse_status(response)
     return lng, lat, speed, status, response
 
+  @staticmethod
+  def parse_status(response):
+    """Extract (lng, lat, speed, status) from a summary response.
+
+    Speed is normalized to 0 when the vehicle is at rest, see
+    Position.from_state.
+    """
+    position = Position.from_summary(response)
+    return position.lng, position.lat, position.speed, position.status
+
   def get_history_from_oracle(self, limit=100):
-    """Query historical location data from Oracle database."""
+    """Query the newest fixes from Oracle database as a PositionBatch, newest first."""
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return PositionBatch()
+    
+    rows = self._select_positions(HISTORY_COLUMNS, limit=limit)
+    history = self._history_batch(rows)
+    
+    self.logger.debug("Retrieved %d historical records", len(history))
+    return history
+
+  def query_positions(self, bbox=None, since=None, until=None, limit=1000, smoothed=None):
+    """Query fixes inside a bounding box and time range as a PositionBatch, newest first.
+
+    Args:
+      bbox: (min_lng, min_lat, max_lng, max_lat), or None for everywhere
+      since, until: Timezone-aware datetimes bounding creation_ts, or None
+      limit: Maximum number of records returned
+      smoothed: Return smoothed positions where stored (default: use_smoothed)
+    """
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return PositionBatch()
+    
+    rows = self._select_positions(HISTORY_COLUMNS, bbox, since, until, limit)
+    history = self._history_batch(rows, smoothed)
+    
+    self.logger.debug("Retrieved %d records in %s between %s and %s", len(history), bbox, since, until)
+    return history
+
+  def position_time_range(self):
+    """Return (oldest, newest) creation_ts of the stored fixes, downsampled history included, or (None, None)."""
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return None, None
+    
+    with self._oracle_connection() as conn:
+      cursor = conn.cursor()
+      cursor.execute("SELECT MIN(creation_ts), MAX(creation_ts) FROM MAPIT_VEHICLE_TRACKING")
+      oldest, newest = cursor.fetchone()
+      if self._history_table_ready(conn):
+        cursor.execute(f"SELECT MIN(creation_ts), MAX(creation_ts) FROM {HISTORY_TABLE}")
+        history_oldest, history_newest = cursor.fetchone()
+        oldest = min(filter(None, (oldest, history_oldest)), default=None)
+        newest = newest or history_newest
+      return oldest, newest
+
+  def iter_positions_after(self, after_id=0, batch_size=10000, smoothed=None):
+    """Yield PositionBatch chunks of the fixes with an id above after_id, oldest first.
+
+    Pages by primary key, so each chunk is one index range scan however
+    large the table is. smoothed is as in query_positions.
+    """
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return
+    
+    while True:
+      with self._oracle_connection() as conn:
+        cursor = conn.cursor()
+        cursor.arraysize = batch_size
+        cursor.execute(
+          f"SELECT {HISTORY_COLUMNS} FROM MAPIT_VEHICLE_TRACKING WHERE id > :after_id "
+          "ORDER BY id FETCH FIRST :limit ROWS ONLY",
+          {"after_id": after_id, "limit": batch_size}
+        )
+        rows = cursor.fetchall()
+      if not rows:
+        return
+      yield self._history_batch(rows, smoothed)
+      if len(rows) < batch_size:
+        return
+      after_id = rows[-1][-1]
+
+  def iter_positions(self, since=None, until=None, batch_size=10000):
+    """Stream the fixes in a time range as PositionBatch chunks, oldest first.
+
+    The downsampled history of purged partitions comes first, then the
+    full-resolution fixes. Reads one cursor at a time with fetchmany, so
+    only one chunk is in memory at a time.
+    """
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return
+    
+    with self._oracle_connection() as conn:
+      cursor = conn.cursor()
+      cursor.arraysize = batch_size
+      queries = []
+      history = self._history_filter(conn, None, since, until)
+      if history is not None:
+        clauses, params = history
+        queries.append((HISTORY_TABLE, clauses, params))
+      queries.append(("MAPIT_VEHICLE_TRACKING",) + self._position_filter(None, since, until))
+      for table, clauses, params in queries:
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        cursor.execute(f"SELECT {HISTORY_COLUMNS} FROM {table}{where} ORDER BY id", params)
+        while True:
+          rows = cursor.fetchmany(batch_size)
+          if not rows:
+            break
+          yield self._history_batch(rows)
+
+  def get_track_in_bbox(self, bbox, limit=50000, stride=1):
+    """Query the newest fixes inside a bounding box, oldest first.
+
+    Args:
+      bbox: (min_lng, min_lat, max_lng, max_lat)
+      limit: Maximum number of fixes returned
+      stride: Only return fixes whose id is a multiple of stride
+    """
     if not self._ensure_oracle_connected():
       self.logger.error("Oracle connection not available")
       return []
     
-    cursor = self._oracle_conn.cursor()
+    columns = ("id, NVL(smooth_lng, lng), NVL(smooth_lat, lat), NVL(smooth_speed, speed), creation_ts"
+               if self.use_smoothed else "id, lng, lat, speed, creation_ts")
+    rows = self._select_positions(columns, bbox, limit=limit, stride=stride)
+    
+    track = [{
+      "id": row[0],
+      "lng": float(row[1]),
+      "lat": float(row[2]),
+      "speed": float(row[3]) if row[3] is not None else None,
+      "time": row[4].timestamp() if row[4] else 0
+    } for row in reversed(rows)]
+    self.logger.debug("Retrieved %d fixes in %s", len(track), bbox)
+    return track
+
+  def load_track(self, since=None, until=None, limit=1000000):
+    """Load the newest fixes in a time range as analytics.Track columns, oldest first.
+
+    Args:
+      since, until: Timezone-aware datetimes bounding creation_ts, or None
+      limit: Maximum number of fixes loaded
+    """
+    from analytics import Track
+
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return Track.from_rows([])
+
+    rows = self._select_positions("creation_ts, lng, lat, speed, status", since=since, until=until, limit=limit)
+    rows.reverse()
+    track = Track.from_rows([row for row in rows if None not in row[:3]])
+    self.logger.debug("Loaded %d fixes between %s and %s", len(track), since, until)
+    return track
+
+  def _select_positions(self, columns, bbox=None, since=None, until=None, limit=1000, stride=1):
+    """Select columns of the newest fixes matching the filters, newest first.
+
+    When the full-resolution table has fewer than limit matches, the rest
+    comes from the downsampled history of purged partitions, which is
+    older than every full-resolution fix.
+    """
+    with self._oracle_connection() as conn:
+      rows = self._select_recent(conn, columns, bbox, since, until, limit, stride)
+      if len(rows) < limit:
+        history = self._history_filter(conn, bbox, since, until)
+        if history is not None:
+          clauses, params = history
+          if stride > 1:
+            clauses.append("MOD(id, :stride) = 0")
+            params["stride"] = stride
+          params["limit"] = limit - len(rows)
+          cursor = conn.cursor()
+          cursor.arraysize = 5000
+          cursor.execute(
+            f"SELECT {columns} FROM {HISTORY_TABLE} WHERE {' AND '.join(clauses)} "
+            "ORDER BY id DESC FETCH FIRST :limit ROWS ONLY",
+            params
+          )
+          rows.extend(cursor.fetchall())
+      return rows
+
+  def _select_recent(self, conn, columns, bbox, since, until, limit, stride):
+    """Select from the full-resolution table, as _select_positions."""
+    cursor = conn.cursor()
+    cursor.arraysize = 5000
+    
+    if bbox is not None and not self._geohash_index_ready(conn):
+      ids = self._grid_index_query(conn, bbox, since, until)
+      if stride > 1:
+        ids = [fix_id for fix_id in ids if fix_id % stride == 0]
+      ids = ids[:-limit - 1:-1]
+      rows = []
+      for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        binds = ", ".join(f":{n + 1}" for n in range(len(chunk)))
+        cursor.execute(
+          f"SELECT {columns} FROM MAPIT_VEHICLE_TRACKING WHERE id IN ({binds}) ORDER BY id DESC",
+          chunk
+        )
+        rows.extend(cursor.fetchall())
+      return rows
+    
+    clauses, params = self._position_filter(bbox, since, until)
+    if stride > 1:
+      clauses.append("MOD(id, :stride) = 0")
+      params["stride"] = stride
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    params["limit"] = limit
     cursor.execute(
-      "SELECT lng, lat, speed, status, battery, hdop, odometer, last_coord_ts, creation_ts "
-      "FROM MAPIT_VEHICLE_TRACKING ORDER BY creation_ts DESC FETCH FIRST :limit ROWS ONLY",
-      {"limit": limit}
+      f"SELECT {columns} FROM MAPIT_VEHICLE_TRACKING{where} "
+      "ORDER BY id DESC FETCH FIRST :limit ROWS ONLY",
+      params
     )
-    rows = cursor.fetchall()
-    
-    history = []
-    for row in rows:
-      history.append({
-        "lng": float(row[0]) if row[0] else 0,
-        "lat": float(row[1]) if row[1] else 0,
-        "speed": row[2],
-        "status": row[3],
-        "battery": row[4],
-        "hdop": row[5],
-        "odometer": row[6],
-        "last_coord_ts": row[7],
-        "timestamp": row[8].isoformat() if row[8] else None
-      })
+    return cursor.fetchall()
+
+  def _history_table_ready(self, conn):
+    """Return True if the downsampled history table exists with every column read."""
+    now = time.monotonic()
+    if not self._history_ready and (self._history_checked_at is None
+                                    or now - self._history_checked_at >= HISTORY_TABLE_RECHECK):
+      self._history_checked_at = now
+      cursor = conn.cursor()
+      # smooth_speed is the newest column; older tables get it on the next retention run
+      cursor.execute(
+        "SELECT COUNT(*) FROM USER_TAB_COLUMNS WHERE table_name = :1 AND column_name = 'SMOOTH_SPEED'",
+        [HISTORY_TABLE]
+      )
+      self._history_ready = cursor.fetchone()[0] > 0
+    return self._history_ready
+
+  def _history_filter(self, conn, bbox, since, until):
+    """WHERE clauses and binds selecting history rows, or None without a history table.
+
+    Only rows older than the oldest full-resolution fix are selected, so a
+    partition downsampled but not yet dropped is not read twice.
+    """
+    if not self._history_table_ready(conn):
+      return None
+    # The history table has no geohash index; its creation_ts index serves time ranges
+    clauses, params = self._position_filter(bbox, since, until, geohash=False)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(id) FROM MAPIT_VEHICLE_TRACKING")
+    oldest_id = cursor.fetchone()[0]
+    if oldest_id is not None:
+      clauses.append("id < :oldest_id")
+      params["oldest_id"] = oldest_id
+    return clauses or ["1 = 1"], params
+
+  @staticmethod
+  def _position_filter(bbox, since, until, geohash=True):
+    """Build WHERE clauses using the geohash index for a bbox and time range."""
+    clauses, params = [], {}
+    if bbox is not None:
+      min_lng, min_lat, max_lng, max_lat = bbox
+      clauses.append("lng BETWEEN :min_lng AND :max_lng AND lat BETWEEN :min_lat AND :max_lat")
+      params.update(min_lng=min_lng, min_lat=min_lat, max_lng=max_lng, max_lat=max_lat)
+    if bbox is not None and geohash:
+      ranges = []
+      for n, prefix in enumerate(geohash_cover(bbox)):
+        # '{' sorts right after 'z', the last geohash character
+        ranges.append(f"(geohash >= :gh{n} AND geohash < :gh{n}_end)")
+        params[f"gh{n}"] = prefix
+        params[f"gh{n}_end"] = prefix + "{"
+      if ranges:
+        clauses.append("(" + " OR ".join(ranges) + ")")
+    if since is not None:
+      clauses.append("creation_ts >= :since")
+      params["since"] = since
+    if until is not None:
+      clauses.append("creation_ts <= :until")
+      params["until"] = until
+    return clauses, params
+
+  def _geohash_index_ready(self, conn):
+    """Return True once every row has a geohash (checked once per process)."""
+    if self._geohash_ready is None:
+      cursor = conn.cursor()
+      try:
+        cursor.execute("SELECT COUNT(*) FROM MAPIT_VEHICLE_TRACKING WHERE geohash IS NULL AND ROWNUM = 1")
+        self._geohash_ready = cursor.fetchone()[0] == 0
+      except oracledb.DatabaseError as e:
+        self.logger.debug("geohash column unavailable: %s", e)
+        self._geohash_ready = False
+      if not self._geohash_ready:
+        self.logger.warning("geohash column missing or not backfilled, using in-process spatial index "
+                            "(run migrate_oracle_table.py)")
+    return self._geohash_ready
+
+  def _grid_index_query(self, conn, bbox, since, until):
+    """Answer a bbox query from the in-process grid index, oldest id first."""
+    from spatial import GridIndex
     
-    self.logger.debug("Retrieved %d historical records", len(history))
-    return history
+    with self._grid_index_lock:
+      if self._grid_index is None:
+        self._grid_index = GridIndex()
+      index = self._grid_index
+      
+      # Index rows stored since the last query
+      cursor = conn.cursor()
+      cursor.arraysize = 10000
+      cursor.execute(
+        "SELECT id, lng, lat, creation_ts FROM MAPIT_VEHICLE_TRACKING WHERE id > :last_id ORDER BY id",
+        {"last_id": index.last_id or 0}
+      )
+      for fix_id, lng, lat, creation_ts in cursor:
+        if lng is not None and lat is not None and creation_ts is not None:
+          index.add(fix_id, float(lng), float(lat), creation_ts.timestamp())
+      
+      return index.query(
+        bbox,
+        since.timestamp() if since is not None else None,
+        until.timestamp() if until is not None else None
+      )
+
+  def apply_retention(self, policy):
+    """Archive, downsample and drop partitions older than the policy window.
+
+    Returns the statistics of retention.apply_retention, or None when
+    Oracle is not available.
+    """
+    from retention import apply_retention
 
-  def export_geojson(self, filepath, limit=1000):
-    """Export location history as GeoJSON file."""
-    history = self.get_history_from_oracle(limit)
+    if not self._ensure_oracle_connected():
+      self.logger.error("Oracle connection not available")
+      return None
+
+    with self._oracle_connection() as conn:
+      return apply_retention(conn, policy, self.logger)
+
+  def export_geojson(self, filepath, limit=1000, history=None):
+    """Export location history as GeoJSON file.
+
+    history defaults to the newest limit records from Oracle; another
+    PositionBatch (newest first) can be passed instead.
+    """
+    if history is None:
+      history = self.get_history_from_oracle(limit)
     
     if not history:
       self.logger.warning("No historical data to export")
@@ -391,21 +996,21 @@ class Mapit:
     features = []
     coordinates = []
     
-    for point in reversed(history):  # Chronological order
+    for point in history.reversed():  # Chronological order
       # Point feature
       features.append({
         "type": "Feature",
         "geometry": {
           "type": "Point",
-          "coordinates": [point["lng"], point["lat"]]
+          "coordinates": [point.lng, point.lat]
         },
         "properties": {
-          "speed": point["speed"],
-          "status": point["status"],
-          "timestamp": point["timestamp"]
+          "speed": point.speed,
+          "status": point.status,
+          "timestamp": point.timestamp.isoformat() if point.timestamp else None
         }
       })
-      coordinates.append([point["lng"], point["lat"]])
+      coordinates.append([point.lng, point.lat])
     
     # Add LineString for the path
     if len(coordinates) > 1:
@@ -426,21 +1031,22 @@ class Mapit:
       "features": features
     }
     
-    with open(filepath, 'w') as f:
-      json.dump(geojson, f, indent=2)
+    with open(filepath, 'wb') as f:
+      f.write(json_backend.dumps(geojson, indent=True))
     
     self.logger.info("Exported %d points to %s", len(history), filepath)
     return True
 
-  def export_kml(self, filepath, limit=1000):
-    """Export location history as KML file."""
+  def export_kml(self, filepath, limit=1000, history=None):
+    """Export location history as KML file (history as in export_geojson)."""
     try:
       import simplekml
     except ImportError:
       self.logger.error("simplekml not installed. Run: pip install simplekml")
       return False
     
-    history = self.get_history_from_oracle(limit)
+    if history is None:
+      history = self.get_history_from_oracle(limit)
     
     if not history:
       self.logger.warning("No historical data to export")
@@ -452,19 +1058,20 @@ class Mapit:
     folder = kml.newfolder(name="Location Points")
     
     coordinates = []
-    for point in reversed(history):  # Chronological order
-      coords = (point["lng"], point["lat"])
+    for point in history.reversed():  # Chronological order
+      coords = (point.lng, point.lat)
       coordinates.append(coords)
+      timestamp = point.timestamp.isoformat() if point.timestamp else None
       
       # Add placemark
       pnt = folder.newpoint(
-        name=f"{point['status']} - {point['speed']} km/h",
+        name=f"{point.status} - {point.speed} km/h",
         coords=[coords]
       )
-      pnt.description = f"Time: {point['timestamp']}\nSpeed: {point['speed']} km/h\nStatus: {point['status']}"
+      pnt.description = f"Time: {timestamp}\nSpeed: {point.speed} km/h\nStatus: {point.status}"
       
       # Color based on status
-      if point["status"] == "MOVING":
+      if point.status == "MOVING":
         pnt.style.iconstyle.color = simplekml.Color.green
       else:
         pnt.style.iconstyle.color = simplekml.Color.red
@@ -481,6 +1088,39 @@ class Mapit:
     return True
 
 
+  def export_gpx(self, filepath, since=None, until=None, gap_minutes=5, geocoder=None):
+    """Stream the trips between since and until to a GPX file.
+
+    Each trip is a track, split into segments where fixes are more than
+    gap_minutes apart, and named after its start and end places when a
+    geocoder (geocode.ReverseGeocoder) is given.
+    """
+    from track_export import write_gpx
+    
+    stats = write_gpx(self.iter_positions(since, until), filepath, gap_minutes * 60, geocoder)
+    if not stats["points"]:
+      self.logger.warning("No trips to export")
+      return False
+    self.logger.info("Exported %d points in %d trips (%d segments) to %s",
+                     stats["points"], stats["trips"], stats["segments"], filepath)
+    return True
+
+  def export_fgb(self, filepath, since=None, until=None):
+    """Stream the fixes between since and until to an indexed FlatGeobuf file."""
+    from track_export import write_flatgeobuf
+    
+    try:
+      stats = write_flatgeobuf(self.iter_positions(since, until), filepath)
+    except ValueError as e:
+      self.logger.error(str(e))
+      return False
+    if not stats["points"]:
+      self.logger.warning("No historical data to export")
+      return False
+    self.logger.info("Exported %d points in %d trips to %s", stats["points"], stats["trips"], filepath)
+    return True
+
+
 def setup_logging(level=logging.INFO):
     """Configure logging with specified level."""
     logging.basicConfig(
@@ -492,51 +1132,160 @@ def setup_logging(level=logging.INFO):
     return logger
 
 
-def run_continuous(mapit, logger, interval=5):
+def poll_status(mapit, logger, cycles, timeout=15):
+    """Poll the status once within timeout seconds; return checkStatus()'s result, or None if it failed.
+
+    Upstream failures (timeouts, errors, throttling, an open circuit
+    breaker, expired credentials that could not be refreshed) are logged
+    and recorded in cycles (a circuit_breaker.CycleStats) so the polling
+    loop carries on instead of exiting; the next cycle retries.
+    """
+    started = time.monotonic()
+    try:
+        with mapit.request_deadline(timeout):
+            result = mapit.checkStatus()
+    except CircuitOpenException as e:
+        cycles.record(time.monotonic() - started, e)
+        logger.debug("Poll skipped: %s", e)
+        return None
+    except (RequestFailedException, TokenExpiredException) as e:
+        cycles.record(time.monotonic() - started, e)
+        logger.warning("Poll failed (%d in a row): %s", cycles.consecutive_errors, e)
+        return None
+    cycles.record(time.monotonic() - started)
+    return result
+
+
+def run_continuous(mapit, logger, interval=5, poll_timeout=15, report_every=100):
     """Run in continuous mode - poll and log every interval seconds."""
+    from circuit_breaker import CycleStats
+
+    cycles = CycleStats()
     seconds = 0
     try:
         while True:
-            lng, lat, speed, status, response = mapit.checkStatus()
-            logger.info(f"Summary retrieved at {seconds}s: {lng}, {lat}, {status} at {speed} km/h")
+            result = poll_status(mapit, logger, cycles, poll_timeout)
+            if result is not None:
+                lng, lat, speed, status, response = result
+                logger.info(f"Summary retrieved at {seconds}s: {lng}, {lat}, {status} at {speed} km/h")
+            if cycles.cycles % report_every == 0:
+                logger.info("Polls: %s", cycles.stats())
+                logger.info("Requests: %s", mapit.request_stats())
             seconds += interval
             time.sleep(interval)
     except KeyboardInterrupt:
         logger.info("Process interrupted by user")
     finally:
+        logger.info("Polls: %s", cycles.stats())
         mapit.close_connections()
 
 
-def run_checker(mapit, logger, sleep_time=1):
-    """Run in checker mode - only store when position changes."""
+def ingest_response(mapit, ingest_filter, response, now, store=True, alerts=None, smoother=None):
+    """Pass one summary response through smoothing, alert rules, ingest filter and storage.
+
+    Shared by the checker and replay modes. With smoother (a
+    smoothing.KalmanSmoother) the fix gets its smoothed position and speed,
+    and the filter decides on the smoothed position. Every fix is checked
+    by alerts (an AlertEngine), before filtering. Returns the Position that
+    was accepted (and stored, with store) or None when the filter dropped it.
+    """
+    position = Position.from_summary(response)
+    if smoother is not None:
+        smoother.smooth(position, now)
+    if alerts is not None:
+        alerts.evaluate(position, now)
+    lng, lat = (position.smooth_lng, position.smooth_lat) if smoother is not None else (position.lng, position.lat)
+    if not ingest_filter.accept(lng, lat, position.status, now,
+                                hdop=position.hdop,
+                                last_coord_ts=position.last_coord_ts):
+        return None
+    
+    if store:
+        mapit.storeOracle(position)
+    return position
+
+
+def run_checker(mapit, logger, sleep_time=1, ingest_filter=None, report_every=100, pipeline=None, alerts=None,
+                smoother=None, geocoder=None, poll_timeout=15):
+    """Run in checker mode - only store when position changes.
+
+    Fixes are passed through an IngestFilter before storage so GPS jitter
+    and re-reported fixes do not produce database writes. With pipeline
+    ('thread' or 'process'), filtering and storage run in separate stages
+    behind bounded queues so a slow commit does not delay the next poll.
+    alerts (an AlertEngine) is evaluated on every polled fix, and smoother
+    (a KalmanSmoother) smooths every fix before filtering. Trips are named
+    after their start and end places with geocoder (a ReverseGeocoder).
+    Each poll must finish within poll_timeout seconds; a failed poll is
+    logged and retried on the next cycle.
+    """
+    from circuit_breaker import CycleStats
+    from ingest_filter import IngestFilter, TripTracker
+
+    if ingest_filter is None:
+        ingest_filter = IngestFilter()
+    trips = TripTracker(geocoder)
+
+    def process(polled_at, response):
+        """Filter one response and follow trips; runs in the processor stage."""
+        record = ingest_response(mapit, ingest_filter, response, polled_at, store=False, alerts=alerts,
+                                 smoother=smoother)
+        if record is not None:
+            logger.info(f"Vehicle moved: {record.lng}, {record.lat} at {record.speed} km/h")
+            trip = trips.update(record.lng, record.lat, record.status, polled_at)
+            if trip is not None and trip['event'] == 'start':
+                logger.info("Trip started at %s, %s (%s)", trip['lng'], trip['lat'], trip.get('place'))
+            elif trip is not None:
+                logger.info("Trip ended: %.1f km in %.0f min (%s to %s)", trip['distance_m'] / 1000,
+                            trip['duration'] / 60, trip.get('start_place'), trip.get('end_place'))
+        if ingest_filter.seen % report_every == 0:
+            logger.info("Ingest filter: %s", ingest_filter.stats())
+            if alerts is not None:
+                logger.info("Alerts: %s", alerts.stats())
+        return record
+
+    ingest = None
+    if pipeline:
+        from pipeline import IngestPipeline
+        if pipeline == 'process':
+            # The writer process opens its own pool instead of sharing the parent's socket
+            mapit.enable_oracle_pool(max_size=1)
+        ingest = IngestPipeline(process, mapit.store_oracle_batch, mode=pipeline, logger=logger)
+        ingest.start()
+    cycles = CycleStats()
     try:
-        last_lng, last_lat = 0, 0
         while True:
-            lng, lat, speed, status, response = mapit.checkStatus()
-            if (lng, lat) != (last_lng, last_lat):
-                logger.info(f"Vehicle moved: {lng}, {lat} at {speed} km/h (was: {last_lng}, {last_lat})")
-                
-                # Extract additional fields from response
-                state = response['vehicles'][0]['device']['state']
-                vehicle = response['vehicles'][0]
-                
-                data = {
-                    "lng": str(lng), 
-                    "lat": str(lat), 
-                    "speed": str(speed), 
-                    "status": status,
-                    "battery": state.get('battery'),
-                    "hdop": state.get('hdop'),
-                    "odometer": state.get('odometer'),
-                    "last_coord_ts": state.get('lastCoordTs')
-                }
-                
-                mapit.storeOracle(data)
-                last_lng, last_lat = lng, lat
+            polled_at = time.time()
+            result = poll_status(mapit, logger, cycles, poll_timeout)
+            if cycles.cycles % report_every == 0:
+                logger.info("Polls: %s", cycles.stats())
+                logger.info("Requests: %s", mapit.request_stats())
+            if result is None:
+                time.sleep(sleep_time)
+                continue
+            response = result[4]
+            if ingest is not None:
+                ingest.submit(polled_at, response)
+                if ingest.submitted % report_every == 0:
+                    logger.info("Pipeline: %s", ingest.stats())
+            else:
+                record = process(polled_at, response)
+                if record is not None:
+                    mapit.storeOracle(record)
             time.sleep(sleep_time)
     except KeyboardInterrupt:
         logger.info("Process interrupted by user")
     finally:
+        if ingest is not None:
+            logger.info("Draining ingest pipeline...")
+            if not ingest.stop():
+                logger.warning("Ingest pipeline did not drain in time")
+            logger.info("Pipeline: %s", ingest.stats())
+        else:
+            logger.info("Ingest filter: %s", ingest_filter.stats())
+            if alerts is not None:
+                logger.info("Alerts: %s", alerts.stats())
+        logger.info("Polls: %s", cycles.stats())
         mapit.close_connections()
 
 
@@ -549,19 +1298,40 @@ def run_single_query(mapit, logger):
         mapit.close_connections()
 
 
-def run_map_server(mapit, logger, port=5000, refresh_rate=5):
-    """Start Flask web server with live map."""
-    from map_server import create_app
+def run_map_server(mapit, logger, port=5000, refresh_rate=5, server='dev', workers=2, threads=8, geocoder=None,
+                   poll_timeout=15):
+    """Start Flask web server with live map.
+
+    A single StatusPoller feeds /api/current for every request thread and,
+    under gunicorn, for every worker through shared memory. With geocoder,
+    the current position comes with its place name.
+    """
+    from map_server import SharedSnapshot, StatusPoller, create_app, serve
+    from tiles import TileCache
+    
+    if server != 'dev':
+        # One pool per process, sized for its request threads
+        mapit.enable_oracle_pool(max_size=threads)
+    snapshot = SharedSnapshot() if server == 'gunicorn' else None
+    poller = StatusPoller(mapit, refresh_rate, snapshot=snapshot, logger=logger, geocoder=geocoder,
+                          timeout=poll_timeout)
+    poller.start()
     
-    app = create_app(mapit, refresh_rate)
+    mypath = os.path.dirname(os.path.realpath(__file__))
+    tile_cache = TileCache(directory=f"{mypath}/tile_cache")
+    
+    app = create_app(mapit, refresh_rate, poller=poller, tile_cache=tile_cache, geocoder=geocoder)
     logger.info(f"Starting map server on http://localhost:{port}")
     logger.info(f"Map will refresh every {refresh_rate} seconds")
     
     try:
-        app.run(host='0.0.0.0', port=port, debug=False)
+        serve(app, server, port, workers, threads, logger)
     except KeyboardInterrupt:
         logger.info("Map server stopped by user")
+    except ValueError as e:
+        logger.error("Map server failed: %s", e)
     finally:
+        poller.stop()
         mapit.close_connections()
 
 
@@ -587,6 +1357,166 @@ def run_export_kml(mapit, logger, filepath):
         mapit.close_connections()
 
 
+def run_export_track(mapit, logger, filepath, fmt='gpx', since=None, until=None, gap_minutes=5, geocoder=None):
+    """Stream the history to a GPX or FlatGeobuf ('fgb') file."""
+    try:
+        started = time.monotonic()
+        if fmt == 'fgb':
+            exported = mapit.export_fgb(filepath, since, until)
+        else:
+            exported = mapit.export_gpx(filepath, since, until, gap_minutes, geocoder)
+        if exported:
+            logger.info(f"Successfully exported to {filepath} in {time.monotonic() - started:.2f}s")
+        else:
+            logger.error("Export failed")
+    finally:
+        mapit.close_connections()
+
+
+def run_export_incremental(mapit, logger, filepath):
+    """Export the fixes stored since the previous run to filepath."""
+    from incremental_export import export_incremental
+
+    try:
+        started = time.monotonic()
+        stats = export_incremental(mapit, filepath, logger)
+        logger.info("Incremental export finished in %.2fs: %s", time.monotonic() - started, stats)
+    except ValueError as e:
+        logger.error("Export failed: %s", e)
+    finally:
+        mapit.close_connections()
+
+
+def run_export_parallel(mapit, logger, filepath, since=None, until=None, jobs=None, shard_hours=24,
+                        layout='single'):
+    """Export the history between since and until with a pool of worker processes.
+
+    since and until default to the oldest and newest stored fix.
+    """
+    from parallel_export import export_parallel
+
+    try:
+        if since is None or until is None:
+            oldest, newest = mapit.position_time_range()
+            if oldest is None:
+                logger.warning("No historical data to export")
+                return
+            since = since or oldest
+            # Shards are half-open, so include the newest fix itself
+            until = until or newest + datetime.timedelta(microseconds=1)
+        export_parallel(mapit, filepath, since, until, logger, jobs, shard_hours, layout)
+    except ValueError as e:
+        logger.error("Export failed: %s", e)
+    finally:
+        mapit.close_connections()
+
+
+def run_replay(mapit, logger, source, ingest_filter, speedup=0, store=False, export_path=None,
+               since=None, until=None, report_every=10000, alerts=None, smoother=None):
+    """Feed recorded summaries through the ingest pipeline and report throughput.
+
+    Args:
+      source: Capture file written with --record, or 'db' to replay the
+        history stored in Oracle between since and until
+      speedup: Replay this many times faster than recorded, 0 for as fast
+        as possible
+      store: Write accepted fixes to Oracle
+      export_path: Export accepted fixes to this GeoJSON or KML file
+    """
+    from replay import ReplayClock, history_responses, read_capture
+    
+    if source == 'db':
+        responses = history_responses(mapit.query_positions(since=since, until=until, limit=10000000,
+                                                            smoothed=False))
+    else:
+        responses = read_capture(source)
+    clock = ReplayClock(speedup)
+    accepted = PositionBatch()
+    count = 0
+    ingest_seconds = 0.0
+    started = time.monotonic()
+    try:
+        for t, response in responses:
+            clock.wait(t)
+            ingest_started = time.monotonic()
+            position = ingest_response(mapit, ingest_filter, response, t, store, alerts, smoother)
+            ingest_seconds += time.monotonic() - ingest_started
+            count += 1
+            if position is not None and export_path:
+                position.timestamp = datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+                accepted.append(position)
+            if count % report_every == 0:
+                elapsed = time.monotonic() - started
+                logger.info("Replayed %d summaries, %.0f/s", count, count / elapsed)
+        
+        export_seconds = 0.0
+        if export_path:
+            export_started = time.monotonic()
+            accepted = accepted.reversed()  # Exports expect newest first, like Oracle history
+            if mapit.use_smoothed:
+                accepted = accepted.smoothed()
+            if export_path.endswith('.kml'):
+                mapit.export_kml(export_path, history=accepted)
+            else:
+                mapit.export_geojson(export_path, history=accepted)
+            export_seconds = time.monotonic() - export_started
+        
+        elapsed = time.monotonic() - started
+        logger.info("Replay finished: %d summaries in %.2fs (%.0f/s end to end), ingest %.2fs "
+                    "(%.0f/s), export %.2fs", count, elapsed, count / elapsed if elapsed else 0,
+                    ingest_seconds, count / ingest_seconds if ingest_seconds else 0, export_seconds)
+        logger.info("Ingest filter: %s", ingest_filter.stats())
+        if alerts is not None:
+            logger.info("Alerts: %s", alerts.stats())
+    except KeyboardInterrupt:
+        logger.info("Replay interrupted by user after %d summaries", count)
+    finally:
+        mapit.close_connections()
+
+
+def run_retention(mapit, logger, policy, interval_hours=24):
+    """Apply the retention policy now and then every interval_hours (0 runs once)."""
+    try:
+        while True:
+            stats = mapit.apply_retention(policy)
+            logger.info("Retention: %s", stats)
+            if not interval_hours:
+                break
+            time.sleep(interval_hours * 3600)
+    except KeyboardInterrupt:
+        logger.info("Process interrupted by user")
+    finally:
+        mapit.close_connections()
+
+
+def run_resmooth(mapit, logger, smoother):
+    """Recompute the smoothed positions of the whole stored history."""
+    from smoothing import reprocess_history
+
+    try:
+        started = time.monotonic()
+        updated = reprocess_history(mapit, logger, smoother)
+        elapsed = time.monotonic() - started
+        logger.info("Smoothed %d fixes in %.1fs (%.0f fixes/s)", updated, elapsed,
+                    updated / elapsed if elapsed else 0)
+    except KeyboardInterrupt:
+        logger.info("Process interrupted by user")
+    finally:
+        mapit.close_connections()
+
+
+def run_stats(mapit, logger, report='summary', since=None, until=None, limit=1000000):
+    """Print vectorized statistics of the stored history as JSON."""
+    import analytics
+
+    try:
+        track = mapit.load_track(since, until, limit)
+        result = analytics.report(track, report)
+        logger.info(json.dumps(result, indent=2))
+    finally:
+        mapit.close_connections()
+
+
 def create_mapit_instance(args, logger):
     """Create and return a Mapit instance with configuration from settings."""
     return Mapit(
@@ -600,7 +1530,11 @@ def create_mapit_instance(args, logger):
         oracle_dns=oracle_dns,
         logger=logger,
         mongo_url=getattr(__import__('settings'), 'mongo_url', 'mongodb://localhost:27017/'),
-        debug=args.debug
+        debug=args.debug,
+        summary_max_staleness=args.summary_max_staleness,
+        token_file=args.token_file,
+        max_rps=args.max_rps,
+        request_timeout=args.request_timeout
     )
 
 
@@ -613,14 +1547,38 @@ Examples:
   python mapit.py                           # Single query, display summary
   python mapit.py --continuous              # Poll every 5 seconds
   python mapit.py --checker --sleep-time 10 # Store when position changes
+  python mapit.py --checker --deadband 25 --max-hdop 5 --keyframe-minutes 30
+  python mapit.py --checker --pipeline process
+  python mapit.py --checker --smooth --smooth-accel 2
+  python mapit.py --resmooth --smooth-accel 2
   python mapit.py --serve-map --map-port 8080 --refresh-rate 10
+  python mapit.py --serve-map --server waitress --threads 16
+  python mapit.py --serve-map --places cities500.txt --places roads.geojson
   python mapit.py --export-geojson path.geojson
   python mapit.py --export-kml path.kml
+  python mapit.py --stats summary --since 2024-06-01
+  python mapit.py --retention --full-days 30 --downsample-seconds 60
+  python mapit.py --checker --record capture.jsonl.gz
+  python mapit.py --replay capture.jsonl.gz --speedup 1000 --replay-export replay.geojson
+  python mapit.py --replay db --since 2024-06-01 --deadband 25
+  python mapit.py --stats stops --since 2024-06-01 --until 2024-06-30
         """
     )
     
     # General options
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--summary-max-staleness', type=int, default=300, metavar='SECONDS',
+                        help='Serve a cached summary up to this old right after startup, 0 to disable (default: 300)')
+    parser.add_argument('--token-file', type=str, default=None, metavar='FILE',
+                        help='Credentials store shared by all mapit.py processes (default: tokens.json next to mapit.py)')
+    parser.add_argument('--max-rps', type=float, default=2.0, metavar='RATE',
+                        help='Requests per second sent to each Mapit/Cognito host; throttled requests are '
+                             'retried after Retry-After or a jittered backoff (default: 2)')
+    parser.add_argument('--request-timeout', type=float, default=10, metavar='SECONDS',
+                        help='Timeout of each Mapit/Cognito request (default: 10)')
+    parser.add_argument('--poll-timeout', type=float, default=15, metavar='SECONDS',
+                        help='Deadline of one poll, retries and token refresh included; a poll that '
+                             'fails or runs out of time is retried next cycle (default: 15)')
     
     # Operation modes (mutually exclusive)
     mode_group = parser.add_mutually_exclusive_group()
@@ -634,14 +1592,92 @@ Examples:
                             help='Export location history to GeoJSON file')
     mode_group.add_argument('--export-kml', type=str, metavar='FILE',
                             help='Export location history to KML file')
+    mode_group.add_argument('--export-gpx', type=str, metavar='FILE',
+                            help='Stream the trips between --since and --until to a GPX file')
+    mode_group.add_argument('--export-fgb', type=str, metavar='FILE',
+                            help='Stream the history between --since and --until to an indexed FlatGeobuf file')
+    mode_group.add_argument('--export-incremental', type=str, metavar='FILE',
+                            help='Append fixes stored since the last run to FILE (.geojsonl, .geojsons, .csv), '
+                                 'or rewrite its daily segments (.geojson, .kml)')
+    mode_group.add_argument('--export-parallel', type=str, metavar='FILE',
+                            help='Export the history between --since and --until to FILE (.geojson, .kml, '
+                                 '.gpx, .parquet) in parallel time shards')
+    mode_group.add_argument('--stats', choices=['summary', 'stops', 'speeds', 'outliers'],
+                            help='Print statistics of the stored history')
+    mode_group.add_argument('--replay', type=str, metavar='FILE',
+                            help="Replay a capture file (or 'db' for stored history) through the ingest pipeline")
+    mode_group.add_argument('--retention', action='store_true',
+                            help='Archive, downsample and drop history older than --full-days')
+    mode_group.add_argument('--resmooth', action='store_true',
+                            help='Recompute the Kalman-smoothed positions of the stored history')
     
     # Mode-specific options
     parser.add_argument('--sleep-time', type=int, default=1, 
                         help='Seconds between polls in checker mode (default: 1)')
+    parser.add_argument('--deadband', type=float, default=10.0, metavar='METRES',
+                        help='Minimum movement before storing a fix in checker mode (default: 10)')
+    parser.add_argument('--max-hdop', type=float, default=None,
+                        help='Drop fixes with a higher HDOP in checker mode (default: no limit)')
+    parser.add_argument('--keyframe-minutes', type=float, default=15,
+                        help='Store a fix at least this often in checker mode, 0 to disable (default: 15)')
+    parser.add_argument('--pipeline', choices=['thread', 'process'], default=None,
+                        help='Run checker filtering and storage as separate stages (default: inline)')
+    parser.add_argument('--smooth', action='store_true',
+                        help='Kalman-smooth fixes in checker and replay modes; the ingest filter uses and '
+                             'Oracle stores the smoothed position next to the raw one')
+    parser.add_argument('--smooth-accel', type=float, default=3.0, metavar='M/S2',
+                        help='Acceleration noise of the smoothing filter, lower smooths more (default: 3)')
+    parser.add_argument('--use-smoothed', action='store_true',
+                        help='Serve and export the smoothed positions where they are stored')
+    parser.add_argument('--alert', action='append', default=[], metavar='RULE',
+                        help='Alert rule for checker and replay modes, repeatable: speed>KMH[:SECONDS], '
+                             'battery<PERCENT, stale>SECONDS, armed (moving while --armed)')
+    parser.add_argument('--armed', action='store_true',
+                        help="Enable 'armed' alert rules")
+    parser.add_argument('--alert-webhook', type=str, default=None, metavar='URL',
+                        help='Also POST alerts as JSON to URL (e.g. a Home Assistant webhook)')
+    parser.add_argument('--places', action='append', default=[], metavar='FILE',
+                        help='Offline places/roads dataset (GeoNames .txt, .csv, .geojson) naming trips in '
+                             'checker mode and GPX exports and the current position on the map; repeatable')
     parser.add_argument('--map-port', type=int, default=5000, 
                         help='Port for Flask map server (default: 5000)')
     parser.add_argument('--refresh-rate', type=int, default=5, 
                         help='Map auto-refresh interval in seconds (default: 5)')
+    parser.add_argument('--server', choices=['dev', 'waitress', 'gunicorn'], default='dev',
+                        help='Map server: Flask dev server, waitress or gunicorn (default: dev)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Worker processes for --server gunicorn (default: 2)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Request threads per process for waitress/gunicorn (default: 8)')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Start of the --stats/--replay db time range, ISO-8601 or epoch seconds')
+    parser.add_argument('--until', type=str, default=None,
+                        help='End of the --stats/--replay db time range, ISO-8601 or epoch seconds')
+    parser.add_argument('--record', type=str, default=None, metavar='FILE',
+                        help='Append every polled summary to a capture file (.gz to compress)')
+    parser.add_argument('--speedup', type=float, default=0,
+                        help='Replay speed relative to recorded time, 0 for as fast as possible (default: 0)')
+    parser.add_argument('--replay-store', action='store_true',
+                        help='Store fixes accepted during replay in Oracle')
+    parser.add_argument('--replay-export', type=str, default=None, metavar='FILE',
+                        help='Export fixes accepted during replay to GeoJSON (or KML for .kml)')
+    parser.add_argument('--segment-gap-minutes', type=float, default=5,
+                        help='Split GPX track segments where fixes are further apart (default: 5)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Worker processes of the parallel export (default: CPU count)')
+    parser.add_argument('--shard-hours', type=int, default=24,
+                        help='Time range of each parallel export shard (default: 24)')
+    parser.add_argument('--export-layout', choices=['single', 'shards'], default='single',
+                        help='Stitch the parallel export into FILE, or keep one file per shard plus '
+                             'FILE.index.json (default: single)')
+    parser.add_argument('--full-days', type=int, default=30,
+                        help='Days of history kept at full resolution in retention mode (default: 30)')
+    parser.add_argument('--downsample-seconds', type=int, default=60,
+                        help='One fix per status and this many seconds is kept beyond --full-days (default: 60)')
+    parser.add_argument('--archive-dir', type=str, default=None,
+                        help='Directory for gzipped CSV archives of dropped partitions (default: ./archive)')
+    parser.add_argument('--retention-every', type=float, default=24, metavar='HOURS',
+                        help='Hours between retention runs, 0 to run once (default: 24)')
     
     args = parser.parse_args()
     
@@ -651,17 +1687,89 @@ Examples:
     
     # Create Mapit instance
     mapit = create_mapit_instance(args, logger)
+    if args.record:
+        from replay import SummaryRecorder
+        mapit.recorder = SummaryRecorder(args.record)
+    mapit.use_smoothed = args.use_smoothed
+    geocoder = None
+    if args.places:
+        from geocode import load_geocoder
+        try:
+            geocoder = load_geocoder(args.places)
+        except (OSError, ValueError) as e:
+            parser.error(f"Cannot load places: {e}")
+        logger.info("Loaded places: %s", geocoder.stats())
+    smoother = None
+    if args.smooth or args.resmooth:
+        from smoothing import KalmanSmoother
+        smoother = KalmanSmoother(accel_noise=args.smooth_accel)
     
     # Run appropriate mode
     if args.continuous:
-        run_continuous(mapit, logger)
-    elif args.checker:
-        run_checker(mapit, logger, args.sleep_time)
+        run_continuous(mapit, logger, poll_timeout=args.poll_timeout)
+    elif args.checker or args.replay:
+        from ingest_filter import IngestFilter
+        ingest_filter = IngestFilter(
+            deadband_m=args.deadband,
+            max_hdop=args.max_hdop,
+            keyframe_seconds=args.keyframe_minutes * 60
+        )
+        alerts = None
+        if args.alert:
+            from alerts import AlertEngine, LogSink, WebhookSink
+            sinks = [LogSink(logger)]
+            if args.alert_webhook:
+                sinks.append(WebhookSink(args.alert_webhook, logger=logger))
+            try:
+                alerts = AlertEngine(args.alert, sinks, armed=args.armed, logger=logger)
+            except ValueError as e:
+                parser.error(str(e))
+        if args.checker:
+            run_checker(mapit, logger, args.sleep_time, ingest_filter, pipeline=args.pipeline, alerts=alerts,
+                        smoother=smoother, geocoder=geocoder, poll_timeout=args.poll_timeout)
+        else:
+            from map_server import parse_time
+            run_replay(mapit, logger, args.replay, ingest_filter, args.speedup,
+                       args.replay_store, args.replay_export,
+                       parse_time(args.since) if args.since else None,
+                       parse_time(args.until) if args.until else None, alerts=alerts, smoother=smoother)
     elif args.serve_map:
-        run_map_server(mapit, logger, args.map_port, args.refresh_rate)
+        run_map_server(mapit, logger, args.map_port, args.refresh_rate,
+                       args.server, args.workers, args.threads, geocoder, args.poll_timeout)
     elif args.export_geojson:
         run_export_geojson(mapit, logger, args.export_geojson)
     elif args.export_kml:
         run_export_kml(mapit, logger, args.export_kml)
+    elif args.export_gpx or args.export_fgb:
+        from map_server import parse_time
+        run_export_track(mapit, logger, args.export_gpx or args.export_fgb,
+                         'fgb' if args.export_fgb else 'gpx',
+                         parse_time(args.since) if args.since else None,
+                         parse_time(args.until) if args.until else None,
+                         args.segment_gap_minutes, geocoder)
+    elif args.export_incremental:
+        run_export_incremental(mapit, logger, args.export_incremental)
+    elif args.export_parallel:
+        from map_server import parse_time
+        run_export_parallel(mapit, logger, args.export_parallel,
+                            parse_time(args.since) if args.since else None,
+                            parse_time(args.until) if args.until else None,
+                            args.jobs, args.shard_hours, args.export_layout)
+    elif args.retention:
+        from retention import RetentionPolicy
+        mypath = os.path.dirname(os.path.realpath(__file__))
+        policy = RetentionPolicy(
+            full_days=args.full_days,
+            downsample_seconds=args.downsample_seconds,
+            archive_dir=args.archive_dir or f"{mypath}/archive"
+        )
+        run_retention(mapit, logger, policy, args.retention_every)
+    elif args.resmooth:
+        run_resmooth(mapit, logger, smoother)
+    elif args.stats:
+        from map_server import parse_time
+        run_stats(mapit, logger, args.stats,
+                  parse_time(args.since) if args.since else None,
+                  parse_time(args.until) if args.until else None)
     else:
         run_single_query(mapit, logger)
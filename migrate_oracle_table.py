@@ -1,19 +1,35 @@
 #!/usr/bin/env python3
-"""Migration script to add new columns to MAPIT_VEHICLE_TRACKING table.
+"""Versioned, online migrations for the MAPIT_VEHICLE_TRACKING table.
 
-This script adds battery, hdop, odometer, and last_coord_ts columns
-to existing MAPIT_VEHICLE_TRACKING tables that were created before
-these fields were added.
+Each migration in MIGRATIONS runs once and is recorded in
+MAPIT_SCHEMA_MIGRATIONS. Schema changes are written so the live
+storeOracle writer keeps inserting while they run:
+
+- new columns are nullable without defaults (a dictionary-only change)
+- indexes are built ONLINE
+- the table is converted to interval partitions ONLINE
+- backfills update historical rows in small id windows, committing and
+  checkpointing after each window, optionally rate limited
+
+An interrupted backfill resumes from its last checkpoint.
 
 Usage:
     python migrate_oracle_table.py
+    python migrate_oracle_table.py --status
+    python migrate_oracle_table.py --batch-size 2000 --max-rows-per-sec 5000
+    python migrate_oracle_table.py --target 3
 """
 
-import oracledb
+import argparse
 import logging
 import os
+import time
+
+import oracledb
 from settings import oracle_user, oracle_password, oracle_dns
 
+from geo import geohash_encode
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,12 +38,262 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-def migrate_table():
-    """Add new columns to existing MAPIT_VEHICLE_TRACKING table."""
+TABLE = "MAPIT_VEHICLE_TRACKING"
+
+# Seconds between progress lines of a backfill
+PROGRESS_INTERVAL = 10
+
+# Seconds DDL waits for the writer's row locks instead of failing with ORA-00054
+DDL_LOCK_TIMEOUT = 30
+
+
+def oracle_error_code(error):
+    """Return the ORA- error number of a DatabaseError, or None."""
+    return getattr(error.args[0], 'code', None) if error.args else None
+
+
+class MigrationRunner:
+    """Applies MIGRATIONS and tracks versions and backfill checkpoints."""
+
+    def __init__(self, conn, batch_size=5000, max_rows_per_sec=None):
+        """
+        Args:
+            conn: Oracle connection
+            batch_size: Width of the id window updated per backfill batch
+            max_rows_per_sec: Throttle backfills to this rate (None for no limit)
+        """
+        self.conn = conn
+        self.batch_size = batch_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.cursor = conn.cursor()
+        self.cursor.execute(f"ALTER SESSION SET DDL_LOCK_TIMEOUT = {DDL_LOCK_TIMEOUT}")
+
+    def ensure_version_table(self):
+        """Create MAPIT_SCHEMA_MIGRATIONS if it does not exist."""
+        try:
+            self.cursor.execute('''create table MAPIT_SCHEMA_MIGRATIONS (
+                version NUMBER PRIMARY KEY,
+                name VARCHAR2(100),
+                last_id NUMBER,
+                rows_done NUMBER DEFAULT 0,
+                started_at timestamp with time zone default current_timestamp,
+                applied_at timestamp with time zone
+            )''')
+            logger.info("Created MAPIT_SCHEMA_MIGRATIONS table")
+        except oracledb.DatabaseError as e:
+            if oracle_error_code(e) != 955:  # Name already used
+                raise
+
+    def versions(self):
+        """Return {version: (name, last_id, rows_done, applied_at)}."""
+        self.cursor.execute(
+            "SELECT version, name, last_id, rows_done, applied_at FROM MAPIT_SCHEMA_MIGRATIONS"
+        )
+        return {row[0]: row[1:] for row in self.cursor}
+
+    def run(self, target=None):
+        """Apply pending migrations up to and including target."""
+        self.ensure_version_table()
+        applied = self.versions()
+        for version, name, migrate in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            if version in applied and applied[version][3] is not None:
+                continue
+            if version not in applied:
+                self.cursor.execute(
+                    "INSERT INTO MAPIT_SCHEMA_MIGRATIONS (version, name) VALUES (:1, :2)",
+                    [version, name]
+                )
+                self.conn.commit()
+            logger.info(f"Applying migration {version}: {name}...")
+            started = time.monotonic()
+            migrate(self, version)
+            self.cursor.execute(
+                "UPDATE MAPIT_SCHEMA_MIGRATIONS SET applied_at = current_timestamp WHERE version = :1",
+                [version]
+            )
+            self.conn.commit()
+            logger.info(f"✓ Migration {version} applied in {time.monotonic() - started:.1f}s")
+
+    def columns(self):
+        """Return the column names of the tracking table, lower case."""
+        self.cursor.execute(
+            "SELECT LOWER(column_name) FROM USER_TAB_COLUMNS WHERE table_name = :1", [TABLE]
+        )
+        return {row[0] for row in self.cursor}
+
+    def add_columns(self, columns):
+        """Add the missing columns of [(name, type), ...] in one statement."""
+        existing = self.columns()
+        missing = [(name, column_type) for name, column_type in columns if name not in existing]
+        if not missing:
+            logger.info("✓ Columns already exist, skipping")
+            return
+        definitions = ", ".join(f"{name} {column_type}" for name, column_type in missing)
+        self.cursor.execute(f"ALTER TABLE {TABLE} ADD ({definitions})")
+        logger.info(f"✓ Added columns {', '.join(name for name, _ in missing)}")
+
+    def create_index(self, index_name, index_columns):
+        """Create an index ONLINE, skipping it if it already exists."""
+        try:
+            self.cursor.execute(f"CREATE INDEX {index_name} ON {TABLE} ({index_columns}) ONLINE")
+            logger.info(f"✓ Index {index_name} created")
+        except oracledb.DatabaseError as e:
+            if oracle_error_code(e) in (955, 1408):  # Name already used / columns already indexed
+                logger.info(f"✓ Index {index_name} already exists, skipping")
+            else:
+                raise
+
+    def is_partitioned(self):
+        """Return True if the tracking table is partitioned."""
+        self.cursor.execute("SELECT COUNT(*) FROM USER_PART_TABLES WHERE table_name = :1", [TABLE])
+        return self.cursor.fetchone()[0] > 0
+
+    def backfill(self, version, update_window):
+        """Run update_window over the table in id windows with checkpoints.
+
+        Only rows present when the backfill starts are visited; rows the
+        writer inserts meanwhile already carry the new values.
+
+        Args:
+            version: Migration version whose row holds the checkpoint
+            update_window: Callable (cursor, first_id, last_id) -> rows updated
+        """
+        self.cursor.execute(f"SELECT MIN(id), MAX(id) FROM {TABLE}")
+        min_id, max_id = self.cursor.fetchone()
+        if max_id is None:
+            logger.info("✓ Table is empty, nothing to backfill")
+            return
+        self.cursor.execute(
+            "SELECT last_id, rows_done FROM MAPIT_SCHEMA_MIGRATIONS WHERE version = :1", [version]
+        )
+        last_id, rows_done = self.cursor.fetchone()
+        rows_done = rows_done or 0
+        if last_id is None:
+            last_id = min_id - 1
+        else:
+            logger.info(f"Resuming from id {last_id} ({rows_done} rows already updated)")
+
+        started = time.monotonic()
+        reported = started
+        run_rows = 0
+        while last_id < max_id:
+            window_end = min(last_id + self.batch_size, max_id)
+            updated = update_window(self.cursor, last_id + 1, window_end)
+            rows_done += updated
+            run_rows += updated
+            last_id = window_end
+            # Checkpoint in the same transaction as the batch
+            self.cursor.execute(
+                "UPDATE MAPIT_SCHEMA_MIGRATIONS SET last_id = :1, rows_done = :2 WHERE version = :3",
+                [last_id, rows_done, version]
+            )
+            self.conn.commit()
+
+            now = time.monotonic()
+            if self.max_rows_per_sec:
+                ahead = run_rows / self.max_rows_per_sec - (now - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+                    now = time.monotonic()
+            if now - reported >= PROGRESS_INTERVAL or last_id >= max_id:
+                reported = now
+                elapsed = now - started
+                rate = run_rows / elapsed if elapsed else 0.0
+                done = (last_id - min_id + 1) / (max_id - min_id + 1)
+                logger.info(f"  id {last_id}/{max_id} ({done:.1%}), {rows_done} rows updated, "
+                            f"{rate:.0f} rows/s")
+
+
+def add_tracking_columns(runner, version):
+    """Add the battery, hdop, odometer, last_coord_ts and geohash columns."""
+    runner.add_columns([
+        ("battery", "NUMBER(3)"),
+        ("hdop", "NUMBER(6, 2)"),
+        ("odometer", "NUMBER(10, 2)"),
+        ("last_coord_ts", "NUMBER(13)"),
+        ("geohash", "VARCHAR2(12)")
+    ])
+
+
+def create_tracking_indexes(runner, version):
+    """Create the indexes used by time-range and bounding-box queries."""
+    runner.create_index("MAPIT_VT_CREATION_IX", "creation_ts")
+    runner.create_index("MAPIT_VT_GEOHASH_IX", "geohash, creation_ts")
+
+
+def backfill_geohash(runner, version):
+    """Compute the geohash of historical fixes."""
+    def update_window(cursor, first_id, last_id):
+        cursor.execute(
+            f"SELECT id, lng, lat FROM {TABLE} WHERE id BETWEEN :1 AND :2 "
+            "AND geohash IS NULL AND lng IS NOT NULL AND lat IS NOT NULL",
+            [first_id, last_id]
+        )
+        rows = [{"id": fix_id, "geohash": geohash_encode(float(lng), float(lat))}
+                for fix_id, lng, lat in cursor.fetchall()]
+        if rows:
+            cursor.executemany(f"UPDATE {TABLE} SET geohash = :geohash WHERE id = :id", rows)
+        return len(rows)
+
+    runner.backfill(version, update_window)
+
+
+def partition_by_month(runner, version):
+    """Convert the table to monthly interval partitions, ONLINE.
+
+    TIMESTAMP WITH TIME ZONE cannot be a partitioning key, so partitions
+    are keyed on the virtual UTC column creation_utc. Time indexes become
+    LOCAL so dropping a partition does not touch the rest of them.
+    """
+    if runner.is_partitioned():
+        logger.info("✓ Table is already partitioned, skipping")
+        return
+    if "creation_utc" not in runner.columns():
+        runner.cursor.execute(
+            f"ALTER TABLE {TABLE} ADD (creation_utc TIMESTAMP "
+            "GENERATED ALWAYS AS (SYS_EXTRACT_UTC(creation_ts)) VIRTUAL)"
+        )
+    runner.cursor.execute(
+        f"ALTER TABLE {TABLE} MODIFY PARTITION BY RANGE (creation_utc) "
+        "INTERVAL (NUMTOYMINTERVAL(1, 'MONTH')) "
+        "(PARTITION p_initial VALUES LESS THAN (TIMESTAMP '2020-01-01 00:00:00')) "
+        "ONLINE UPDATE INDEXES (MAPIT_VT_CREATION_IX LOCAL, MAPIT_VT_GEOHASH_IX LOCAL)"
+    )
+    logger.info("✓ Table partitioned by month on creation_utc")
+
+
+def add_smoothed_columns(runner, version):
+    """Add the Kalman-smoothed position and speed columns.
+
+    They are filled by the checker with --smooth; history is smoothed
+    with `python mapit.py --resmooth`, which can be rerun with other
+    filter settings, so there is no backfill here.
+    """
+    runner.add_columns([
+        ("smooth_lng", "NUMBER(10, 7)"),
+        ("smooth_lat", "NUMBER(10, 7)"),
+        ("smooth_speed", "NUMBER(6, 2)")
+    ])
+
+
+# (version, name, function) in the order they are applied; never renumber
+MIGRATIONS = [
+    (1, "add_tracking_columns", add_tracking_columns),
+    (2, "create_tracking_indexes", create_tracking_indexes),
+    (3, "backfill_geohash", backfill_geohash),
+    (4, "partition_by_month", partition_by_month),
+    (5, "add_smoothed_columns", add_smoothed_columns),
+]
+
+
+def connect():
+    """Connect to Oracle with the settings and wallet used by mapit.py."""
     mypath = os.path.dirname(os.path.realpath(__file__))
-    
+
     logger.info("Connecting to Oracle Database...")
-    conn = oracledb.connect(
+    return oracledb.connect(
         config_dir=f"{mypath}/wallet",
         user=oracle_user,
         password=oracle_password,
@@ -36,39 +302,49 @@ def migrate_table():
         wallet_password=oracle_password,
         tcp_connect_timeout=10
     )
-    
-    cursor = conn.cursor()
-    
-    # List of columns to add
-    columns = [
-        ("battery", "NUMBER(3)"),
-        ("hdop", "NUMBER(6, 2)"),
-        ("odometer", "NUMBER(10, 2)"),
-        ("last_coord_ts", "NUMBER(13)")
-    ]
-    
-    for column_name, column_type in columns:
-        try:
-            logger.info(f"Adding column {column_name}...")
-            cursor.execute(
-                f"ALTER TABLE MAPIT_VEHICLE_TRACKING ADD {column_name} {column_type}"
-            )
-            conn.commit()
-            logger.info(f"✓ Column {column_name} added successfully")
-        except oracledb.DatabaseError as e:
-            error_code = e.args[0].code if hasattr(e.args[0], 'code') else None
-            if error_code == 1430:  # Column already exists
-                logger.info(f"✓ Column {column_name} already exists, skipping")
-            else:
-                logger.error(f"✗ Error adding column {column_name}: {e}")
-                raise
-    
-    conn.close()
-    logger.info("Migration completed successfully!")
+
+
+def show_status(runner):
+    """Log applied, in-progress and pending migrations."""
+    runner.ensure_version_table()
+    applied = runner.versions()
+    for version, name, _ in MIGRATIONS:
+        if version not in applied:
+            logger.info(f"  {version} {name}: pending")
+        elif applied[version][3] is None:
+            logger.info(f"  {version} {name}: in progress (checkpoint id {applied[version][1]}, "
+                        f"{applied[version][2]} rows updated)")
+        else:
+            logger.info(f"  {version} {name}: applied {applied[version][3]:%Y-%m-%d %H:%M:%S}")
+
+
+def migrate_table(batch_size=5000, max_rows_per_sec=None, target=None, status=False):
+    """Apply pending migrations to the MAPIT_VEHICLE_TRACKING table."""
+    conn = connect()
+    try:
+        runner = MigrationRunner(conn, batch_size, max_rows_per_sec)
+        if status:
+            show_status(runner)
+        else:
+            runner.run(target)
+            logger.info("Migration completed successfully!")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply schema migrations to MAPIT_VEHICLE_TRACKING')
+    parser.add_argument('--status', action='store_true',
+                        help='Show applied and pending migrations and exit')
+    parser.add_argument('--target', type=int, default=None, metavar='VERSION',
+                        help='Stop after this migration version (default: apply all)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='Ids per backfill batch; each batch is one short transaction (default: 5000)')
+    parser.add_argument('--max-rows-per-sec', type=float, default=None,
+                        help='Throttle backfills to this many rows per second (default: no limit)')
+    args = parser.parse_args()
+
     try:
-        migrate_table()
+        migrate_table(args.batch_size, args.max_rows_per_sec, args.target, args.status)
     except Exception as e:
         logger.error(f"Migration failed: {e}")
         exit(1)
@@ -0,0 +1,354 @@
+"""
+Parallel export of long histories.
+
+The requested time range is cut into shards (one day by default) that a
+pool of forked worker processes fetch from Oracle and encode, each on its
+own connection. Every shard is written to its own fragment file; the
+fragments are then either stitched into one document in time order or
+kept as per-shard files listed in an index (<file>.index.json).
+
+GeoJSON, KML and GPX are encoded directly as text so that fragments can
+be concatenated without parsing them again. Parquet needs pyarrow.
+"""
+
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import shutil
+import time
+from xml.sax.saxutils import escape
+
+import json_backend
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = {'.geojson': 'geojson', '.kml': 'kml', '.gpx': 'gpx', '.parquet': 'parquet'}
+LAYOUTS = ('single', 'shards')
+
+# Set in the parent before the pool forks, so workers inherit it
+_mapit = None
+
+
+def plan_shards(since, until, shard_hours=24):
+    """Split [since, until) into consecutive shards of shard_hours.
+
+    The first shard starts at since rounded down to a shard boundary
+    (midnight UTC for daily shards), so shard files line up with days.
+    """
+    step = datetime.timedelta(hours=shard_hours)
+    since = since.astimezone(datetime.timezone.utc)
+    day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = day + step * ((since - day) // step)
+    shards = []
+    while start < until:
+        shards.append((start, start + step))
+        start += step
+    return shards
+
+
+def shard_label(start, shard_hours):
+    return f"{start:%Y-%m-%d}" if shard_hours % 24 == 0 else f"{start:%Y-%m-%dT%H}"
+
+
+def _iso(timestamp):
+    return timestamp.isoformat() if timestamp else None
+
+
+def encode_geojson(batch, label):
+    """Features of one shard (points, then its path), without the enclosing array."""
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+        "properties": {"speed": speed, "status": status, "timestamp": _iso(timestamp)}
+    } for lng, lat, speed, status, timestamp in zip(batch.lng, batch.lat, batch.speed, batch.status,
+                                                    batch.timestamp)]
+    if len(batch) > 1:
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [list(c) for c in zip(batch.lng, batch.lat)]},
+            "properties": {"name": "Vehicle Path", "shard": label, "points": len(batch)}
+        })
+    return json_backend.dumps(features)[1:-1]
+
+
+def encode_kml(batch, label):
+    """A KML Folder with the points and path of one shard."""
+    parts = [f"<Folder><name>{escape(label)}</name>\n"]
+    for lng, lat, speed, status, timestamp in zip(batch.lng, batch.lat, batch.speed, batch.status,
+                                                  batch.timestamp):
+        style = "moving" if status == "MOVING" else "at_rest"
+        parts.append(
+            f"<Placemark><name>{escape(str(status))} - {speed} km/h</name>"
+            f"<description>Time: {_iso(timestamp)}\nSpeed: {speed} km/h\nStatus: {escape(str(status))}</description>"
+            f"<styleUrl>#{style}</styleUrl><Point><coordinates>{lng},{lat}</coordinates></Point></Placemark>\n"
+        )
+    if len(batch) > 1:
+        coordinates = " ".join(f"{lng},{lat}" for lng, lat in zip(batch.lng, batch.lat))
+        parts.append(f"<Placemark><name>Vehicle Path</name><styleUrl>#path</styleUrl>"
+                     f"<LineString><coordinates>{coordinates}</coordinates></LineString></Placemark>\n")
+    parts.append("</Folder>\n")
+    return "".join(parts).encode('utf-8')
+
+
+def _gpx_time(timestamp):
+    return timestamp.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def encode_gpx(batch, label):
+    """A GPX track with the points of one shard."""
+    parts = [f"<trk><name>{escape(label)}</name><trkseg>\n"]
+    for lng, lat, timestamp in zip(batch.lng, batch.lat, batch.timestamp):
+        time_tag = f"<time>{_gpx_time(timestamp)}</time>" if timestamp else ""
+        parts.append(f'<trkpt lat="{lat}" lon="{lng}">{time_tag}</trkpt>\n')
+    parts.append("</trkseg></trk>\n")
+    return "".join(parts).encode('utf-8')
+
+
+# (header, separator between shards, footer) of the stitched documents
+_DOCUMENTS = {
+    'geojson': (b'{"type":"FeatureCollection","features":[', b',', b']}\n'),
+    'kml': (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>Vehicle Tracking History</name>\n'
+        b'<Style id="moving"><IconStyle><color>ff00ff00</color></IconStyle></Style>\n'
+        b'<Style id="at_rest"><IconStyle><color>ff0000ff</color></IconStyle></Style>\n'
+        b'<Style id="path"><LineStyle><color>ffff0000</color><width>3</width></LineStyle></Style>\n',
+        b'',
+        b'</Document></kml>\n'
+    ),
+    'gpx': (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<gpx version="1.1" creator="mapit" xmlns="http://www.topografix.com/GPX/1/1">\n',
+        b'',
+        b'</gpx>\n'
+    ),
+}
+_ENCODERS = {'geojson': encode_geojson, 'kml': encode_kml, 'gpx': encode_gpx}
+
+
+def _parquet_table(batch):
+    return pyarrow.table({
+        "id": pyarrow.array(batch.id, pyarrow.int64()),
+        "timestamp": pyarrow.array(batch.timestamp, pyarrow.timestamp('us', tz='UTC')),
+        "lng": pyarrow.array(batch.lng, pyarrow.float64()),
+        "lat": pyarrow.array(batch.lat, pyarrow.float64()),
+        "speed": pyarrow.array(batch.speed, pyarrow.float64()),
+        "status": pyarrow.array(batch.status, pyarrow.string()),
+        "battery": pyarrow.array(batch.battery, pyarrow.float64()),
+        "hdop": pyarrow.array(batch.hdop, pyarrow.float64()),
+        "odometer": pyarrow.array(batch.odometer, pyarrow.float64()),
+        "last_coord_ts": pyarrow.array(batch.last_coord_ts, pyarrow.int64()),
+        "smooth_lng": pyarrow.array(batch.smooth_lng, pyarrow.float64()),
+        "smooth_lat": pyarrow.array(batch.smooth_lat, pyarrow.float64()),
+        "smooth_speed": pyarrow.array(batch.smooth_speed, pyarrow.float64()),
+    })
+
+
+def _export_shard(index, since, until, fmt, path, label, standalone):
+    """Fetch and encode one shard into path; runs in a worker process.
+
+    With standalone, the fragment is wrapped into a complete document.
+    """
+    started = time.monotonic()
+    history = _mapit.query_positions(since=since, until=until - datetime.timedelta(microseconds=1),
+                                     limit=100000000)
+    batch = history.reversed()  # Chronological order
+    fetched = time.monotonic()
+    if len(batch):
+        tmp_path = f"{path}.tmp"
+        try:
+            if fmt == 'parquet':
+                pyarrow.parquet.write_table(_parquet_table(batch), tmp_path, compression='zstd')
+            else:
+                body = _ENCODERS[fmt](batch, label)
+                with open(tmp_path, 'wb') as f:
+                    if standalone:
+                        header, _, footer = _DOCUMENTS[fmt]
+                        f.write(header + body + footer)
+                    else:
+                        f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+    return {
+        "index": index,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "points": len(batch),
+        "path": path if len(batch) else None,
+        "bytes": os.path.getsize(path) if len(batch) else 0,
+        "fetch_s": round(fetched - started, 3),
+        "encode_s": round(time.monotonic() - fetched, 3),
+    }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _stitch(fmt, parts, filepath):
+    """Concatenate the shard fragments, in order, into one document."""
+    tmp_path = f"{filepath}.tmp"
+    try:
+        if fmt == 'parquet':
+            writer = None
+            try:
+                for part in parts:
+                    table = pyarrow.parquet.read_table(part)
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(tmp_path, table.schema, compression='zstd')
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            header, separator, footer = _DOCUMENTS[fmt]
+            with open(tmp_path, 'wb') as out:
+                out.write(header)
+                for n, part in enumerate(parts):
+                    if n:
+                        out.write(separator)
+                    with open(part, 'rb') as f:
+                        shutil.copyfileobj(f, out, 1024 * 1024)
+                out.write(footer)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def _write_index(index, filepath):
+    tmp_path = f"{filepath}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(json_backend.dumps(index, indent=True))
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def export_parallel(mapit, filepath, since, until, logger, jobs=None, shard_hours=24, layout='single'):
+    """Export the fixes between since and until using a pool of processes.
+
+    Args:
+        mapit: Mapit instance; workers inherit it and open their own
+            Oracle pool
+        filepath: Output file, its extension selects the format
+        since, until: Timezone-aware datetimes bounding creation_ts
+        jobs: Worker processes (default: CPU count); 1 runs in-process
+        shard_hours: Length of each shard
+        layout: 'single' stitches one file; 'shards' keeps one file per
+            shard (<file root>-<shard>.<ext>) and writes <file>.index.json
+
+    Every file is written under a temporary name and moved into place;
+    a failed export removes its fragments and the shards it wrote, so it
+    leaves no partial output behind.
+
+    Returns a dict with the shard results and totals.
+    """
+    global _mapit
+
+    root, ext = os.path.splitext(filepath)
+    fmt = FORMATS.get(ext.lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported export format: {ext or filepath} (use {', '.join(FORMATS)})")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export needs pyarrow. Run: pip install pyarrow")
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown export layout: {layout}")
+    jobs = jobs or os.cpu_count() or 1
+
+    started = time.monotonic()
+    shards = plan_shards(since, until, shard_hours)
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    if layout == 'single':
+        part_dir = f"{filepath}.parts"
+        os.makedirs(part_dir, exist_ok=True)
+        paths = [os.path.join(part_dir, f"{n:05d}{ext}") for n in range(len(shards))]
+    else:
+        paths = [f"{root}-{shard_label(start, shard_hours)}{ext}" for start, _ in shards]
+    tasks = [(n, start, end, fmt, path, shard_label(start, shard_hours), layout == 'shards')
+             for n, ((start, end), path) in enumerate(zip(shards, paths))]
+
+    logger.info("Exporting %s to %s in %d shards of %dh with %d workers", since, until, len(shards),
+                shard_hours, jobs)
+    _mapit = mapit
+    results = []
+    futures = []
+    try:
+        if jobs == 1:
+            for task in tasks:
+                results.append(_export_shard(*task))
+        else:
+            # Each worker opens its own pool instead of sharing the parent's socket
+            mapit.enable_oracle_pool(max_size=1)
+            ctx = multiprocessing.get_context('fork')
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+                futures = [pool.submit(_export_shard, *task) for task in tasks]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        result = future.result()
+                        results.append(result)
+                        logger.debug("Shard %s: %d points, fetch %.2fs, encode %.2fs", result["since"],
+                                     result["points"], result["fetch_s"], result["encode_s"])
+                finally:
+                    for future in futures:
+                        future.cancel()
+        results.sort(key=lambda r: r["index"])
+        encoded = time.monotonic()
+
+        written = [r for r in results if r["path"]]
+        if not written:
+            logger.warning("No historical data to export")
+        elif layout == 'single':
+            _stitch(fmt, [r["path"] for r in written], filepath)
+        else:
+            index = {
+                "format": fmt,
+                "since": since.isoformat(),
+                "until": until.isoformat(),
+                "shard_hours": shard_hours,
+                "shards": [{"file": os.path.basename(r["path"]), "since": r["since"], "until": r["until"],
+                            "points": r["points"], "bytes": r["bytes"]} for r in written],
+            }
+            _write_index(index, f"{filepath}.index.json")
+    except BaseException:
+        if layout == 'shards':
+            # No index is written: drop the shards this run finished, in any worker
+            finished = results + [f.result() for f in futures
+                                  if f.done() and not f.cancelled() and f.exception() is None]
+            for result in finished:
+                if result["path"]:
+                    _remove(result["path"])
+        raise
+    finally:
+        if layout == 'single':
+            shutil.rmtree(part_dir, ignore_errors=True)
+        else:
+            # Temporary files of workers that died mid-write
+            for path in paths:
+                _remove(f"{path}.tmp")
+
+    elapsed = time.monotonic() - started
+    points = sum(r["points"] for r in results)
+    stats = {
+        "shards": len(shards),
+        "points": points,
+        "jobs": jobs,
+        "seconds": round(elapsed, 3),
+        "stitch_s": round(time.monotonic() - encoded, 3),
+        "points_per_s": round(points / elapsed) if elapsed else 0,
+    }
+    logger.info("Exported %d points in %d shards to %s in %.2fs (%d points/s)", points, len(shards),
+                filepath, elapsed, stats["points_per_s"])
+    return stats
@@ -0,0 +1,222 @@
+"""
+Staged ingest pipeline: poller -> processor -> writer.
+
+The poller (the caller's thread) submits summary responses, a processor
+stage filters them and a writer stage stores what is left in batches. The
+stages are connected by bounded queues, so a slow database first fills
+the queues and then blocks submit() (backpressure) instead of growing
+memory without limit.
+
+Stages run as threads, or as forked processes so that processing does
+not compete with polling for the GIL. Each stage records items handled,
+busy time and latency in shared memory, and stop() drains both queues
+before returning.
+
+A batch the store fails on (an exception, or False as returned by
+Mapit.store_oracle_batch when Oracle is unavailable) is retried with
+exponential backoff, holding back the queue meanwhile, and counted as
+writer errors if every attempt fails.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+MODES = ('thread', 'process')
+
+# Marks the end of the stream; each stage forwards it after draining
+_STOP = None
+
+# Layout of the shared per-stage counters
+_ITEMS, _BUSY, _BUSY_MAX, _LATENCY, _LATENCY_MAX, _ERRORS = range(6)
+
+
+class StageStats:
+    """Counters of one stage, shared between threads or processes."""
+
+    def __init__(self, ctx):
+        self._values = ctx.Array('d', 6)
+
+    def record(self, busy, latency):
+        """Record one item that took busy seconds, latency seconds after its poll."""
+        with self._values.get_lock():
+            self._values[_ITEMS] += 1
+            self._values[_BUSY] += busy
+            self._values[_BUSY_MAX] = max(self._values[_BUSY_MAX], busy)
+            self._values[_LATENCY] += latency
+            self._values[_LATENCY_MAX] = max(self._values[_LATENCY_MAX], latency)
+
+    def error(self, items=1):
+        """Record items that failed in this stage."""
+        with self._values.get_lock():
+            self._values[_ERRORS] += items
+
+    def snapshot(self):
+        with self._values.get_lock():
+            values = list(self._values)
+        items = values[_ITEMS] or 1
+        return {
+            "items": int(values[_ITEMS]),
+            "busy_ms_avg": round(values[_BUSY] / items * 1000, 2),
+            "busy_ms_max": round(values[_BUSY_MAX] * 1000, 2),
+            "latency_ms_avg": round(values[_LATENCY] / items * 1000, 2),
+            "latency_ms_max": round(values[_LATENCY_MAX] * 1000, 2),
+            "errors": int(values[_ERRORS]),
+        }
+
+
+def _queue_depth(q):
+    try:
+        return q.qsize()
+    except NotImplementedError:  # multiprocessing queues on macOS
+        return None
+
+
+_PARENT_PID = os.getpid()
+
+
+def _ignore_sigint():
+    """In stage processes, leave Ctrl+C to the parent, which drains the pipeline."""
+    if os.getpid() != _PARENT_PID:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _processor(process, inbox, outbox, stats, logger):
+    _ignore_sigint()
+    while True:
+        item = inbox.get()
+        if item is _STOP:
+            outbox.put(_STOP)
+            return
+        polled_at, response = item
+        started = time.time()
+        try:
+            record = process(polled_at, response)
+        except Exception as e:
+            logger.error("Ingest processor failed: %s", e)
+            stats.error()
+            continue
+        stats.record(time.time() - started, time.time() - polled_at)
+        if record is not None:
+            outbox.put((polled_at, record))
+
+
+def _store_batch(store, records, retries, retry_delay, logger):
+    """Store records, retrying failures with exponential backoff; return whether they were stored."""
+    for attempt in range(retries + 1):
+        try:
+            if store(records) is not False:
+                return True
+            error = "store reported failure"
+        except Exception as e:
+            error = e
+        if attempt < retries:
+            delay = retry_delay * 2 ** attempt
+            logger.warning("Ingest writer failed to store %d records (%s), retrying in %.1fs",
+                           len(records), error, delay)
+            time.sleep(delay)
+    logger.error("Ingest writer dropped %d records after %d attempts: %s", len(records), retries + 1, error)
+    return False
+
+
+def _writer(store, inbox, stats, batch_size, retries, retry_delay, logger):
+    _ignore_sigint()
+    done = False
+    while not done:
+        batch = [inbox.get()]
+        # Take whatever else is already waiting, up to batch_size
+        while len(batch) < batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        if batch[-1] is _STOP:
+            batch.pop()
+            done = True
+        if not batch:
+            continue
+        started = time.time()
+        if not _store_batch(store, [record for _, record in batch], retries, retry_delay, logger):
+            stats.error(len(batch))
+            continue
+        finished = time.time()
+        busy = (finished - started) / len(batch)
+        for polled_at, _ in batch:
+            stats.record(busy, finished - polled_at)
+
+
+class IngestPipeline:
+    """Bounded, staged processing of polled summary responses."""
+
+    def __init__(self, process, store, mode='thread', queue_size=100, batch_size=50, store_retries=3,
+                 retry_delay=1.0, logger=None):
+        """
+        Args:
+            process: Callable (polled_at, response) -> record or None, run
+                by the processor stage (filtering, trip detection)
+            store: Callable (records) storing a batch, run by the writer
+                stage; raising or returning False marks the batch failed
+            mode: 'thread' or 'process' (forked, Linux/macOS only)
+            queue_size: Capacity of each queue between stages
+            batch_size: Most records stored per writer call
+            store_retries: Retries of a failed batch before it is dropped
+            retry_delay: Seconds before the first retry, doubled after each
+            logger: Logger for stage errors (default: root logger)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown pipeline mode: {mode}")
+        if mode == 'process':
+            ctx = multiprocessing.get_context('fork')
+            self._inbox = ctx.Queue(queue_size)
+            self._outbox = ctx.Queue(queue_size)
+            worker = ctx.Process
+        else:
+            ctx = multiprocessing
+            self._inbox = queue.Queue(queue_size)
+            self._outbox = queue.Queue(queue_size)
+            worker = threading.Thread
+        logger = logger or logging.getLogger()
+        self.mode = mode
+        self.submitted = 0
+        self._submit_wait = 0.0
+        self._stats = {"processor": StageStats(ctx), "writer": StageStats(ctx)}
+        self._workers = [
+            worker(target=_processor, name="ingest-processor", daemon=True,
+                   args=(process, self._inbox, self._outbox, self._stats["processor"], logger)),
+            worker(target=_writer, name="ingest-writer", daemon=True,
+                   args=(store, self._outbox, self._stats["writer"], batch_size, store_retries, retry_delay,
+                         logger)),
+        ]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, polled_at, response):
+        """Queue a response; blocks while the pipeline is full."""
+        started = time.monotonic()
+        self._inbox.put((polled_at, response))
+        self._submit_wait += time.monotonic() - started
+        self.submitted += 1
+
+    def stats(self):
+        """Queue depths, per-stage counters and time the poller spent blocked."""
+        return {
+            "submitted": self.submitted,
+            "blocked_s": round(self._submit_wait, 3),
+            "queues": {"processor": _queue_depth(self._inbox), "writer": _queue_depth(self._outbox)},
+            "processor": self._stats["processor"].snapshot(),
+            "writer": self._stats["writer"].snapshot(),
+        }
+
+    def stop(self, timeout=60):
+        """Drain both queues, stop the stages and return True if they finished."""
+        self._inbox.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        return not any(worker.is_alive() for worker in self._workers)
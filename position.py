@@ -0,0 +1,182 @@
+"""
+Typed position records shared by ingest, storage, history and exports.
+
+Position is one fix with native numeric fields (no string round trips);
+PositionBatch keeps many fixes as parallel column lists, so bulk reads
+from Oracle do not allocate an object or dict per row until one is asked
+for.
+"""
+
+import datetime
+
+# Order of the columns read by Mapit for history queries (HISTORY_COLUMNS)
+FIELDS = ('lng', 'lat', 'speed', 'status', 'battery', 'hdop', 'odometer', 'last_coord_ts',
+          'smooth_lng', 'smooth_lat', 'smooth_speed', 'timestamp', 'id')
+
+
+def _number(value):
+    return None if value is None else float(value)
+
+
+class Position:
+    """One GPS fix of the vehicle."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, lng, lat, speed=None, status=None, battery=None, hdop=None, odometer=None,
+                 last_coord_ts=None, smooth_lng=None, smooth_lat=None, smooth_speed=None, timestamp=None,
+                 id=None):
+        """
+        Args:
+            lng, lat: Position in degrees
+            speed: km/h, 0 when AT_REST
+            status: MOVING or AT_REST
+            battery: Percent
+            hdop: Horizontal dilution of precision
+            odometer: km
+            last_coord_ts: Fix time reported by the device, epoch milliseconds
+            smooth_lng, smooth_lat, smooth_speed: Kalman-smoothed position
+                and speed (see smoothing.py), None when not smoothed
+            timestamp: Storage time (creation_ts), aware datetime
+            id: Row id once stored
+        """
+        self.lng = lng
+        self.lat = lat
+        self.speed = speed
+        self.status = status
+        self.battery = battery
+        self.hdop = hdop
+        self.odometer = odometer
+        self.last_coord_ts = last_coord_ts
+        self.smooth_lng = smooth_lng
+        self.smooth_lat = smooth_lat
+        self.smooth_speed = smooth_speed
+        self.timestamp = timestamp
+        self.id = id
+
+    @classmethod
+    def from_state(cls, state, timestamp=None):
+        """Build a fix from the device state of a summary response."""
+        status = state.get('status')
+        # API sometimes reports residual speed values when stopped
+        speed = 0.0 if status == 'AT_REST' else _number(state.get('speed'))
+        return cls(
+            float(state['lng']), float(state['lat']), speed, status,
+            _number(state.get('battery')), _number(state.get('hdop')), _number(state.get('odometer')),
+            state.get('lastCoordTs'), timestamp=timestamp
+        )
+
+    @classmethod
+    def from_summary(cls, response, timestamp=None):
+        """Build a fix from the first vehicle of a summary response."""
+        return cls.from_state(response['vehicles'][0]['device']['state'], timestamp)
+
+    def as_dict(self):
+        """JSON-ready dict, as served by /api/history."""
+        return {
+            "lng": self.lng,
+            "lat": self.lat,
+            "speed": self.speed,
+            "status": self.status,
+            "battery": self.battery,
+            "hdop": self.hdop,
+            "odometer": self.odometer,
+            "last_coord_ts": self.last_coord_ts,
+            "smooth_lng": self.smooth_lng,
+            "smooth_lat": self.smooth_lat,
+            "smooth_speed": self.smooth_speed,
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "id": self.id
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in FIELDS)
+
+    def __repr__(self):
+        return f"Position({', '.join(f'{f}={getattr(self, f)!r}' for f in FIELDS)})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in FIELDS)
+
+    def __setstate__(self, state):
+        for f, value in zip(FIELDS, state):
+            setattr(self, f, value)
+
+
+class PositionBatch:
+    """Many fixes stored column by column."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, columns=None):
+        """
+        Args:
+            columns: Sequence of one sequence per FIELDS entry, or None for
+                an empty batch
+        """
+        columns = columns or [() for _ in FIELDS]
+        for f, column in zip(FIELDS, columns):
+            setattr(self, f, list(column))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a batch from rows of HISTORY_COLUMNS.
+
+        lng and lat become floats (0 when missing), as history has always
+        been served; the smoothed columns floats or None.
+        """
+        if not rows:
+            return cls()
+        columns = list(zip(*rows))
+        columns[0] = [float(v) if v else 0.0 for v in columns[0]]
+        columns[1] = [float(v) if v else 0.0 for v in columns[1]]
+        columns[8] = [_number(v) for v in columns[8]]
+        columns[9] = [_number(v) for v in columns[9]]
+        columns[10] = [_number(v) for v in columns[10]]
+        return cls(columns)
+
+    @classmethod
+    def from_positions(cls, positions):
+        batch = cls()
+        for position in positions:
+            batch.append(position)
+        return batch
+
+    def append(self, position):
+        for f in FIELDS:
+            getattr(self, f).append(getattr(position, f))
+
+    def __len__(self):
+        return len(self.lng)
+
+    def __getitem__(self, index):
+        return Position(*(getattr(self, f)[index] for f in FIELDS))
+
+    def __iter__(self):
+        for values in zip(*(getattr(self, f) for f in FIELDS)):
+            yield Position(*values)
+
+    def reversed(self):
+        """Return a batch with the rows in reverse order."""
+        return PositionBatch([getattr(self, f)[::-1] for f in FIELDS])
+
+    def smoothed(self):
+        """Return a batch whose lng, lat and speed are the smoothed values where known."""
+        batch = PositionBatch([getattr(self, f) for f in FIELDS])
+        for f, smooth in (('lng', 'smooth_lng'), ('lat', 'smooth_lat'), ('speed', 'smooth_speed')):
+            setattr(batch, f, [raw if value is None else value
+                               for raw, value in zip(getattr(self, f), getattr(self, smooth))])
+        return batch
+
+    def as_dicts(self):
+        """JSON-ready dicts, as served by /api/history."""
+        isoformat = datetime.datetime.isoformat
+        return [{
+            "lng": lng, "lat": lat, "speed": speed, "status": status, "battery": battery,
+            "hdop": hdop, "odometer": odometer, "last_coord_ts": last_coord_ts,
+            "smooth_lng": smooth_lng, "smooth_lat": smooth_lat, "smooth_speed": smooth_speed,
+            "timestamp": isoformat(timestamp) if timestamp else None, "id": row_id
+        } for (lng, lat, speed, status, battery, hdop, odometer, last_coord_ts, smooth_lng, smooth_lat,
+               smooth_speed, timestamp, row_id) in zip(*(getattr(self, f) for f in FIELDS))]
@@ -0,0 +1,233 @@
+"""
+Client-side rate limiting of Mapit and Cognito requests.
+
+Every request of an account goes through a RequestScheduler, which keeps
+a token bucket per host: requests leave at the configured rate (with a
+small burst), so the checker, the map server poller and background
+refreshes of one process queue up instead of bursting together. When the
+upstream still throttles (429, or 502/503/504), the bucket of that host is
+paused for the Retry-After the server asked for, or for a jittered
+exponential backoff, and the request is retried; every other request to
+that host waits out the same pause instead of piling retries onto it.
+A caller with a deadline is refused at once (DeadlineExceeded) when its
+turn, or the end of the pause, would come after the deadline.
+
+SingleFlight coalesces identical concurrent calls: while one summary
+request is in flight, other callers wait for and share its result instead
+of sending their own.
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+
+# Upstream statuses meaning "slow down / try again"
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def retry_after(response, now=None):
+    """Seconds the Retry-After header of a response asks to wait, or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (now or time.time()))
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, rng=random):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]."""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class DeadlineExceeded(Exception):
+    """A request could not leave before the caller's deadline."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent."""
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            rate: Sustained requests per second
+            burst: Requests that may leave back to back after an idle period
+            clock, sleep: Monotonic time source and sleep function
+        """
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it.
+
+        Tokens may go negative: each reservation queues behind the ones
+        already taken, so waiting callers leave in order at the rate.
+        """
+        with self._lock:
+            now = self._clock()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            return max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+
+    def acquire(self, deadline=None):
+        """Wait for a token, and for any pause; return the seconds waited.
+
+        Raises DeadlineExceeded without waiting when the token or the pause
+        would only be available after deadline (a clock() value); a token
+        not yet waited for is given back.
+        """
+        waited = self.reserve()
+        if deadline is not None and self._clock() + waited > deadline:
+            self._release()
+            raise DeadlineExceeded(f"Request slot in {waited:.1f}s is past the deadline")
+        if waited > 0:
+            self._sleep(waited)
+        while True:
+            remaining = self._paused_until - self._clock()
+            if remaining <= 0:
+                return waited
+            if deadline is not None and self._paused_until > deadline:
+                raise DeadlineExceeded(f"Host paused for {remaining:.1f}s past the deadline")
+            self._sleep(remaining)
+            waited += remaining
+
+    def _release(self):
+        with self._lock:
+            self._tokens += 1
+
+    def pause(self, seconds):
+        """Hold every caller for seconds; the bucket refills only after the pause."""
+        with self._lock:
+            until = self._clock() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._updated = max(self._updated, until)
+                self._tokens = min(self._tokens, 0.0)
+
+
+class RequestScheduler:
+    """Per-host token buckets with Retry-After and jittered backoff retries."""
+
+    def __init__(self, rate=2.0, burst=4, max_retries=4, backoff_base=1.0, backoff_max=60.0, logger=None):
+        """
+        Args:
+            rate: Requests per second allowed to each host
+            burst: Requests per host that may leave back to back
+            max_retries: Retries of a throttled request before its response
+                is returned to the caller
+            backoff_base, backoff_max: Backoff bounds, seconds, when the
+                server gives no Retry-After
+            logger: Logger for throttling (default: root logger)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger or logging.getLogger()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def send(self, host, request, deadline=None):
+        """Send request() (returning a requests.Response) to host within its rate.
+
+        Throttled responses are retried up to max_retries times, and not
+        when the wait would end past deadline (time.monotonic() seconds);
+        the last response is returned either way. Raises DeadlineExceeded
+        when the first request cannot leave before deadline.
+        """
+        bucket = self.bucket(host)
+        for attempt in range(self.max_retries + 1):
+            self.waited += bucket.acquire(deadline)
+            self.requests += 1
+            response = request()
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            self.throttled += 1
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return response
+            self.logger.warning("%s answered %s, retrying in %.1fs", host, response.status_code, delay)
+            bucket.pause(delay)
+        return response
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waited_s": round(self.waited, 1),
+            "hosts": len(self._buckets),
+        }
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Run fn() unless a call for key is in flight; then wait for and share its outcome."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
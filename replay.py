@@ -0,0 +1,115 @@
+"""
+Recording and replay of summary responses.
+
+A capture file holds one JSON object per line, {"t": epoch_seconds,
+"response": summary}, written by SummaryRecorder while polling (--record).
+Captures, or history already stored in Oracle, can then be fed back
+through the ingest pipeline at any speed (--replay).
+"""
+
+import gzip
+import threading
+import time
+
+import json_backend
+
+
+def _open(path, mode):
+    """Open a capture file, gzipped when the name ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class SummaryRecorder:
+    """Append summary responses to a capture file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = _open(path, 'a')
+
+    def write(self, response, t=None):
+        """Record one response fetched at epoch time t (default now)."""
+        line = json_backend.dumps({"t": t or time.time(), "response": response}).decode('utf-8')
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path, full=False):
+    """Yield (t, response) pairs from a capture file in recorded order.
+
+    Responses hold only the fields fixes are built from
+    (json_backend.decode_summary), unless full. A gzipped capture cut short
+    by a crash is read up to its last complete line.
+    """
+    with _open(path, 'r') as f:
+        try:
+            for line in f:
+                if line.endswith('\n'):
+                    if full:
+                        entry = json_backend.loads(line)
+                        yield entry['t'], entry['response']
+                    else:
+                        yield json_backend.decode_capture_entry(line)
+        except EOFError:
+            pass
+
+
+def summary_from_position(position):
+    """Rebuild a minimal summary response from a stored Position."""
+    return {"vehicles": [{"device": {"state": {
+        "lng": position.lng,
+        "lat": position.lat,
+        "speed": position.speed,
+        "status": position.status,
+        "battery": position.battery,
+        "hdop": position.hdop,
+        "odometer": position.odometer,
+        "lastCoordTs": position.last_coord_ts
+    }}}]}
+
+
+def history_responses(history):
+    """Yield (t, response) pairs from stored history, oldest first.
+
+    Args:
+        history: PositionBatch as returned by Mapit.query_positions
+            (newest first)
+    """
+    for position in history.reversed():
+        if position.timestamp is None:
+            continue
+        yield position.timestamp.timestamp(), summary_from_position(position)
+
+
+class ReplayClock:
+    """Pace replayed responses at a multiple of their recorded rate."""
+
+    def __init__(self, speedup=0):
+        """
+        Args:
+            speedup: Replay this many times faster than recorded; 0 or None
+                replays as fast as possible
+        """
+        self.speedup = speedup
+        self._origin = None
+
+    def wait(self, t):
+        """Sleep until recorded time t is due."""
+        if not self.speedup:
+            return
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (t, now)
+            return
+        due = self._origin[1] + (t - self._origin[0]) / self.speedup
+        if due > now:
+            time.sleep(due - now)
@@ -0,0 +1,249 @@
+"""
+Retention policy for MAPIT_VEHICLE_TRACKING.
+
+Fixes are kept at full resolution for a number of days. Once a monthly
+partition (see migration 4 in migrate_oracle_table.py) lies entirely
+before that window it is:
+
+1. archived in full to a gzipped CSV file,
+2. downsampled into MAPIT_VEHICLE_TRACKING_HISTORY (one fix per status
+   and time bucket),
+3. dropped, which frees the space without row deletes or undo.
+
+The hot table therefore only ever holds the full-resolution window, and
+each step is idempotent so an interrupted run can simply be repeated.
+Mapit's history reads and exports continue into the history table for
+fixes older than the hot table's oldest one.
+"""
+
+import csv
+import datetime
+import gzip
+import os
+import re
+import time
+
+import oracledb
+
+HOT_TABLE = "MAPIT_VEHICLE_TRACKING"
+HISTORY_TABLE = "MAPIT_VEHICLE_TRACKING_HISTORY"
+
+ARCHIVE_COLUMNS = ("id", "creation_ts", "lng", "lat", "speed", "status", "battery",
+                   "hdop", "odometer", "last_coord_ts", "geohash", "smooth_lng", "smooth_lat",
+                   "smooth_speed")
+
+# Columns added to the history table after it was first created (see migration 5)
+HISTORY_ADDED_COLUMNS = (
+    ("smooth_lng", "NUMBER(10, 7)"),
+    ("smooth_lat", "NUMBER(10, 7)"),
+    ("smooth_speed", "NUMBER(6, 2)"),
+)
+
+_HIGH_VALUE = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+_PARTITION_NAME = re.compile(r"^[A-Z0-9_$#]+$")
+
+
+class RetentionPolicy:
+    """How long fixes stay at full resolution and where archives go."""
+
+    def __init__(self, full_days=30, downsample_seconds=60, archive_dir="archive"):
+        """
+        Args:
+            full_days: Days of fixes kept at full resolution
+            downsample_seconds: Bucket size of the downsampled history
+            archive_dir: Directory receiving the gzipped CSV archives
+        """
+        self.full_days = full_days
+        self.downsample_seconds = downsample_seconds
+        self.archive_dir = archive_dir
+
+    def cutoff(self, now=None):
+        """Naive UTC datetime before which partitions are expired."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return (now - datetime.timedelta(days=self.full_days)).replace(tzinfo=None)
+
+
+def list_partitions(cursor):
+    """Return [(name, lower, upper, is_interval), ...] ordered by position.
+
+    Bounds are naive UTC datetimes; lower is None for the first partition.
+    Interval partitions only exist for months with data, so their lower
+    bound is the start of their month rather than the previous upper bound.
+    Returns an empty list when the table is not partitioned.
+    """
+    cursor.execute(
+        "SELECT partition_name, high_value, interval FROM USER_TAB_PARTITIONS "
+        "WHERE table_name = :1 ORDER BY partition_position",
+        [HOT_TABLE]
+    )
+    partitions = []
+    lower = None
+    for name, high_value, interval in cursor.fetchall():
+        match = _HIGH_VALUE.search(high_value or "")
+        if not match or not _PARTITION_NAME.match(name):
+            continue
+        upper = datetime.datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+        if interval == "YES":
+            month_start = (upper - datetime.timedelta(days=1)).replace(day=1)
+            lower = max(lower, month_start) if lower else month_start
+        partitions.append((name, lower, upper, interval == "YES"))
+        lower = upper
+    return partitions
+
+
+def ensure_history_table(cursor, logger):
+    """Create the downsampled history table if it does not exist, or add its missing columns."""
+    try:
+        cursor.execute(f'''create table {HISTORY_TABLE} (
+            id NUMBER PRIMARY KEY,
+            lng NUMBER(10, 7),
+            lat NUMBER(10, 7),
+            speed NUMBER(6, 2),
+            status VARCHAR2(50),
+            battery NUMBER(3),
+            hdop NUMBER(6, 2),
+            odometer NUMBER(10, 2),
+            last_coord_ts NUMBER(13),
+            geohash VARCHAR2(12),
+            creation_ts timestamp with time zone,
+            smooth_lng NUMBER(10, 7),
+            smooth_lat NUMBER(10, 7),
+            smooth_speed NUMBER(6, 2)
+        )''')
+        cursor.execute(f"CREATE INDEX MAPIT_VTH_CREATION_IX ON {HISTORY_TABLE} (creation_ts)")
+        logger.info("Created %s table", HISTORY_TABLE)
+        return
+    except oracledb.DatabaseError as e:
+        if "ORA-00955" not in str(e):  # Name already used
+            raise
+    cursor.execute("SELECT LOWER(column_name) FROM USER_TAB_COLUMNS WHERE table_name = :1", [HISTORY_TABLE])
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [(name, column_type) for name, column_type in HISTORY_ADDED_COLUMNS if name not in existing]
+    if missing:
+        definitions = ", ".join(f"{name} {column_type}" for name, column_type in missing)
+        cursor.execute(f"ALTER TABLE {HISTORY_TABLE} ADD ({definitions})")
+        logger.info("Added columns %s to %s", ", ".join(name for name, _ in missing), HISTORY_TABLE)
+
+
+def archive_path(policy, lower, upper):
+    """Archive file of the partition covering [lower, upper)."""
+    start = lower.strftime("%Y-%m-%d") if lower else "start"
+    return os.path.join(policy.archive_dir, f"tracking_{start}_{upper:%Y-%m-%d}.csv.gz")
+
+
+def archive_partition(cursor, name, path):
+    """Stream every row of a partition to a gzipped CSV; return the row count.
+
+    The file is written under a temporary name and renamed once complete,
+    so an existing archive is always whole.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    cursor.arraysize = 10000
+    cursor.execute(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {HOT_TABLE} PARTITION ({name}) ORDER BY id")
+    rows = 0
+    with gzip.open(tmp_path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ARCHIVE_COLUMNS)
+        for row in cursor:
+            row = list(row)
+            if row[1] is not None:
+                row[1] = row[1].isoformat()
+            writer.writerow(row)
+            rows += 1
+    os.replace(tmp_path, path)
+    return rows
+
+
+def count_archive_rows(path):
+    """Number of data rows in an archive file, or None if it is missing or corrupt."""
+    try:
+        with gzip.open(path, "rt", newline="") as f:
+            return sum(1 for _ in csv.reader(f)) - 1
+    except (OSError, EOFError):
+        return None
+
+
+def downsample_partition(cursor, name, bucket_seconds):
+    """Copy one fix per status and time bucket of a partition to the history table.
+
+    Returns the number of rows inserted; rows copied by an earlier run are
+    skipped.
+    """
+    cursor.execute(
+        f"INSERT INTO {HISTORY_TABLE} "
+        "(id, lng, lat, speed, status, battery, hdop, odometer, last_coord_ts, geohash, creation_ts, "
+        "smooth_lng, smooth_lat, smooth_speed) "
+        "SELECT t.id, t.lng, t.lat, t.speed, t.status, t.battery, t.hdop, t.odometer, "
+        "t.last_coord_ts, t.geohash, t.creation_ts, t.smooth_lng, t.smooth_lat, t.smooth_speed "
+        f"FROM {HOT_TABLE} PARTITION ({name}) t "
+        "WHERE t.id IN ("
+        f"  SELECT MIN(id) FROM {HOT_TABLE} PARTITION ({name}) "
+        "  GROUP BY FLOOR((CAST(creation_utc AS DATE) - DATE '1970-01-01') * 86400 / :bucket), status"
+        f") AND NOT EXISTS (SELECT 1 FROM {HISTORY_TABLE} h WHERE h.id = t.id)",
+        {"bucket": bucket_seconds}
+    )
+    return cursor.rowcount
+
+
+def purge_partition(cursor, name, is_interval):
+    """Drop an interval partition, or truncate the fixed transition partition.
+
+    The first range partition of an interval-partitioned table cannot be
+    dropped (ORA-14758), so it is truncated instead. Local indexes go with
+    the partition; global ones are maintained in place.
+    """
+    if is_interval:
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} DROP PARTITION {name} UPDATE GLOBAL INDEXES")
+    else:
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} TRUNCATE PARTITION {name} UPDATE GLOBAL INDEXES")
+
+
+def apply_retention(conn, policy, logger, now=None):
+    """Archive, downsample and purge every expired partition.
+
+    Returns a dict with the number of partitions purged, rows archived and
+    rows kept in the downsampled history.
+    """
+    cursor = conn.cursor()
+    stats = {"partitions": 0, "archived_rows": 0, "downsampled_rows": 0}
+    partitions = list_partitions(cursor)
+    if not partitions:
+        logger.error("%s is not partitioned, run migrate_oracle_table.py first", HOT_TABLE)
+        return stats
+    ensure_history_table(cursor, logger)
+
+    cutoff = policy.cutoff(now)
+    for name, lower, upper, is_interval in partitions:
+        if upper > cutoff:
+            break
+        started = time.monotonic()
+        cursor.execute(f"SELECT COUNT(*) FROM {HOT_TABLE} PARTITION ({name})")
+        rows = cursor.fetchone()[0]
+        if rows == 0 and not is_interval:
+            continue
+
+        path, downsampled = None, 0
+        if rows:
+            path = archive_path(policy, lower, upper)
+            if count_archive_rows(path) != rows:
+                archived = archive_partition(cursor, name, path)
+                if archived != rows:
+                    logger.error("Archive of partition %s has %d rows, expected %d; not purging",
+                                 name, archived, rows)
+                    continue
+            downsampled = downsample_partition(cursor, name, policy.downsample_seconds)
+            conn.commit()
+        purge_partition(cursor, name, is_interval)
+
+        elapsed = time.monotonic() - started
+        if rows:
+            logger.info("Retention: partition %s (%s to %s): archived %d rows to %s, kept %d downsampled, "
+                        "purged in %.1fs (%.0f rows/s)", name, lower, upper, rows, path, downsampled,
+                        elapsed, rows / elapsed if elapsed else 0)
+        else:
+            logger.info("Retention: dropped empty partition %s (%s to %s)", name, lower, upper)
+        stats["partitions"] += 1
+        stats["archived_rows"] += rows
+        stats["downsampled_rows"] += downsampled
+    return stats
@@ -0,0 +1,272 @@
+"""
+Kalman smoothing of GPS fixes.
+
+A constant-velocity Kalman filter per vehicle estimates position and
+velocity in a local east/north plane (metres). Each fix is weighted by its
+HDOP: the measurement variance is (hdop * uere_m)^2, so a fix reported
+with HDOP 4 pulls the estimate a sixteenth as hard as one with HDOP 1.
+Smoothed speed is the magnitude of the estimated velocity, and an AT_REST
+fix pins the velocity to zero instead of only zeroing the reported speed.
+
+East and north are independent under this model and share their
+covariance, so one update costs a handful of float operations in pure
+Python. smooth_batch() runs the same filter over a PositionBatch for
+historical reprocessing, with projection, noise and speed computed by
+numpy over whole columns and only the recursion left per fix.
+"""
+
+import itertools
+import math
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+
+_M_PER_DEG = EARTH_RADIUS_M * math.pi / 180
+
+
+@dataclass
+class FilterState:
+    """Snapshot of a KalmanSmoother, in the local plane around (lng0, lat0)."""
+
+    time: Optional[float] = None       # epoch seconds of the last fused fix
+    lng0: Optional[float] = None       # origin of the local plane, degrees
+    lat0: Optional[float] = None
+    x: float = 0.0                     # east, north, metres
+    y: float = 0.0
+    vx: float = 0.0                    # velocity, m/s
+    vy: float = 0.0
+    a: float = 0.0                     # covariance [[a, b], [b, c]] of each axis
+    b: float = 0.0
+    c: float = 0.0
+    estimate: Optional[Tuple[float, float, float]] = None  # last (lng, lat, speed_kmh)
+
+
+class KalmanSmoother:
+    """Constant-velocity Kalman filter of one vehicle's fixes."""
+
+    def __init__(self, accel_noise=3.0, uere_m=5.0, default_hdop=2.0, reset_seconds=300):
+        """
+        Args:
+            accel_noise: Standard deviation of the acceleration the model
+                allows, m/s^2; higher follows turns faster, lower smooths more
+            uere_m: Metres of position error per unit of HDOP
+            default_hdop: HDOP assumed for fixes that do not report one
+            reset_seconds: Restart the filter from the next fix after a gap
+                longer than this (parking, lost signal)
+        """
+        self.q = accel_noise * accel_noise
+        self.uere_m = uere_m
+        self.default_hdop = default_hdop
+        self.reset_seconds = reset_seconds
+        self.reset()
+
+    def reset(self):
+        """Forget the track; the next fix initializes the filter."""
+        self._time = None
+        self._lng0 = None
+        self._lat0 = None
+        self._m_per_deg_lng = None
+        # State (east, north, v_east, v_north) and the covariance
+        # [[a, b], [b, c]] shared by both axes
+        self._x = self._y = self._vx = self._vy = 0.0
+        self._a = self._b = self._c = 0.0
+        self._estimate = None
+
+    def get_state(self):
+        """Return the filter state as a FilterState."""
+        return FilterState(self._time, self._lng0, self._lat0, self._x, self._y, self._vx, self._vy,
+                           self._a, self._b, self._c, self._estimate)
+
+    def set_state(self, state):
+        """Continue from a FilterState (from get_state() or smooth_batch())."""
+        if state.lng0 is None:
+            self._lng0 = self._lat0 = self._m_per_deg_lng = None
+        else:
+            self._origin(state.lng0, state.lat0)
+        self._time = state.time
+        self._x, self._y, self._vx, self._vy = state.x, state.y, state.vx, state.vy
+        self._a, self._b, self._c = state.a, state.b, state.c
+        self._estimate = state.estimate
+
+    def _origin(self, lng, lat):
+        self._lng0 = lng
+        self._lat0 = lat
+        self._m_per_deg_lng = _M_PER_DEG * math.cos(math.radians(lat))
+
+    def _variance(self, hdop):
+        hdop = self.default_hdop if hdop is None else max(float(hdop), 0.5)
+        return (hdop * self.uere_m) ** 2
+
+    def _step(self, x, y, r, dt, at_rest):
+        """Fuse one measurement (local metres, variance r) dt seconds after the last."""
+        if self._time is None or dt > self.reset_seconds or dt < 0:
+            # Position known to the fix accuracy, velocity within ~10 m/s
+            self._x, self._y, self._vx, self._vy = x, y, 0.0, 0.0
+            self._a, self._b, self._c = r, 0.0, 100.0
+        else:
+            # Predict with white-noise acceleration
+            a, b, c, q = self._a, self._b, self._c, self.q
+            self._x += self._vx * dt
+            self._y += self._vy * dt
+            a += dt * (2 * b + dt * (c + q * dt / 3))
+            b += dt * (c + q * dt / 2)
+            c += q * dt
+            # Update
+            s = a + r
+            k1 = a / s
+            k2 = b / s
+            ex = x - self._x
+            ey = y - self._y
+            self._x += k1 * ex
+            self._y += k1 * ey
+            self._vx += k2 * ex
+            self._vy += k2 * ey
+            self._a, self._b, self._c = (1 - k1) * a, (1 - k1) * b, c - k2 * b
+        if at_rest:
+            self._vx = self._vy = 0.0
+            self._b = self._c = 0.0
+        return self._x, self._y, self._vx, self._vy
+
+    def _fuse(self, x, y, r, t, at_rest):
+        """Fuse one measurement (local metres, variance r) taken at t, epoch seconds."""
+        state = self._step(x, y, r, 0.0 if self._time is None else t - self._time, at_rest)
+        self._time = t
+        return state
+
+    def update(self, lng, lat, hdop, t, status=None):
+        """Fuse one fix and return the smoothed (lng, lat, speed_kmh).
+
+        Args:
+            lng, lat: Reported position in degrees
+            hdop: Reported HDOP, None for default_hdop
+            t: Fix time in epoch seconds (lastCoordTs / 1000 when known)
+            status: Vehicle status; AT_REST pins the velocity to zero
+
+        A fix with the same time as the previous one (a re-reported fix)
+        is not fused again; the current estimate is returned.
+        """
+        if self._time is not None and t == self._time and self._estimate is not None:
+            return self._estimate
+        if self._lng0 is None or self._time is None or t - self._time > self.reset_seconds:
+            self._origin(lng, lat)
+            self._time = None
+        x, y, vx, vy = self._fuse((lng - self._lng0) * self._m_per_deg_lng, (lat - self._lat0) * _M_PER_DEG,
+                                  self._variance(hdop), t, status == 'AT_REST')
+        self._estimate = (
+            self._lng0 + x / self._m_per_deg_lng,
+            self._lat0 + y / _M_PER_DEG,
+            math.hypot(vx, vy) * 3.6,
+        )
+        return self._estimate
+
+    def smooth(self, position, now):
+        """Set the smooth_* fields of a Position from this filter and return it.
+
+        The fix time is its lastCoordTs when reported, now otherwise.
+        """
+        t = position.last_coord_ts / 1000 if position.last_coord_ts is not None else now
+        position.smooth_lng, position.smooth_lat, position.smooth_speed = self.update(
+            position.lng, position.lat, position.hdop, t, position.status)
+        return position
+
+
+def _fix_times(batch):
+    """Fix times of a batch in epoch seconds: lastCoordTs, else creation_ts."""
+    return np.array([
+        last_coord_ts / 1000 if last_coord_ts is not None else (timestamp.timestamp() if timestamp else np.nan)
+        for last_coord_ts, timestamp in zip(batch.last_coord_ts, batch.timestamp)
+    ])
+
+
+def smooth_batch(batch, smoother=None):
+    """Smooth a chronological PositionBatch in place and return it.
+
+    smoother carries the filter state across consecutive batches (a new
+    KalmanSmoother by default). Fixes without a position or time are
+    skipped and keep None smooth_* values. Like KalmanSmoother.update(),
+    the local plane is re-originated at the first fix after a gap longer
+    than reset_seconds, so each stretch between gaps is projected around
+    its own origin (by numpy, over the columns of that stretch) and the
+    results match smoothing the fixes one by one; only the recursion runs
+    per fix, through the same KalmanSmoother step as live fixes.
+    """
+    smoother = smoother or KalmanSmoother()
+    n = len(batch)
+    if not n:
+        return batch
+    lng = np.array(batch.lng, dtype=float)
+    lat = np.array(batch.lat, dtype=float)
+    t = _fix_times(batch)
+    valid = ~(np.isnan(t) | ((lng == 0) & (lat == 0)))
+    rows = np.flatnonzero(valid)
+    if not len(rows):
+        return batch
+    state = smoother.get_state()
+    lng, lat, t = lng[rows], lat[rows], t[rows]
+
+    # Fixes that start a new origin: the first one unless the track
+    # continues, then every one after a reset gap
+    reorigin = np.empty(len(rows), dtype=bool)
+    reorigin[0] = state.lng0 is None or state.time is None or t[0] - state.time > smoother.reset_seconds
+    reorigin[1:] = t[1:] - t[:-1] > smoother.reset_seconds
+    starts = np.flatnonzero(reorigin)
+    lng0 = np.full(len(rows), np.nan if state.lng0 is None else state.lng0)
+    lat0 = np.full(len(rows), np.nan if state.lat0 is None else state.lat0)
+    if len(starts):
+        segment = np.cumsum(reorigin) - 1
+        later = segment >= 0
+        lng0[later] = lng[starts][segment[later]]
+        lat0[later] = lat[starts][segment[later]]
+    m_per_deg_lng = _M_PER_DEG * np.cos(np.radians(lat0))
+
+    hdop = np.array([np.nan if h is None else h for h in batch.hdop], dtype=float)[rows]
+    r = (np.maximum(np.where(np.isnan(hdop), smoother.default_hdop, hdop), 0.5) * smoother.uere_m) ** 2
+    xs = ((lng - lng0) * m_per_deg_lng).tolist()
+    ys = ((lat - lat0) * _M_PER_DEG).tolist()
+    status = batch.status
+    at_rest = [status[i] == 'AT_REST' for i in rows.tolist()]
+
+    # The recursion is sequential; everything around it works on columns.
+    # A re-originated fix always follows a reset gap (or starts the track),
+    # so the filter restarts there and its state needs no re-projection.
+    out = []
+    append = out.append
+    fuse = smoother._fuse
+    current = (state.x, state.y, state.vx, state.vy)
+    for x, y, r_i, t_i, rest in zip(xs, ys, r.tolist(), t.tolist(), at_rest):
+        if t_i != smoother._time:  # A re-reported fix repeats the current estimate
+            current = fuse(x, y, r_i, t_i, rest)
+        append(current)
+
+    est = np.fromiter(itertools.chain.from_iterable(out), float, 4 * len(out)).reshape(-1, 4)
+    columns = (lng0 + est[:, 0] / m_per_deg_lng, lat0 + est[:, 1] / _M_PER_DEG,
+               np.hypot(est[:, 2], est[:, 3]) * 3.6)
+    rows = rows.tolist()
+    for name, values in zip(('smooth_lng', 'smooth_lat', 'smooth_speed'), columns):
+        column = [None] * n
+        for i, value in zip(rows, values.tolist()):
+            column[i] = value
+        setattr(batch, name, column)
+    last = rows[-1]
+    smoother.set_state(replace(
+        smoother.get_state(), lng0=float(lng0[-1]), lat0=float(lat0[-1]),
+        estimate=(batch.smooth_lng[last], batch.smooth_lat[last], batch.smooth_speed[last])))
+    return batch
+
+
+def reprocess_history(mapit, logger, smoother=None, after_id=0, batch_size=10000):
+    """Recompute the smoothed columns of the stored fixes above after_id, oldest first.
+
+    Returns the number of fixes updated.
+    """
+    smoother = smoother or KalmanSmoother()
+    updated = 0
+    # Always the raw fixes: smoothing the smoothed columns again would compound
+    for batch in mapit.iter_positions_after(after_id, batch_size, smoothed=False):
+        smooth_batch(batch, smoother)
+        updated += mapit.store_smoothed(batch)
+        logger.info("Smoothed %d fixes, up to id %s", updated, batch.id[-1])
+    return updated
@@ -0,0 +1,93 @@
+"""
+In-process spatial index over stored fixes.
+
+Used when the database cannot answer bounding-box queries through its
+geohash index (for example before the geohash column is backfilled), and
+by tools that work on history already loaded into memory.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+import math
+
+
+class GridIndex:
+    """Uniform lng/lat grid answering bounding-box plus time-range queries.
+
+    Fixes must be added in chronological order; each cell then keeps its
+    timestamps sorted so time ranges are answered by bisection.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self.ids = array('q')
+        self.lng = array('d')
+        self.lat = array('d')
+        self.time = array('d')
+        self._cells = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def last_id(self):
+        """Id of the newest indexed fix, or None if empty."""
+        return self.ids[-1] if self.ids else None
+
+    def _cell(self, lng, lat):
+        return int(math.floor(lng / self.cell_deg)), int(math.floor(lat / self.cell_deg))
+
+    def add(self, fix_id, lng, lat, t):
+        """Index a fix; t is its time in epoch seconds."""
+        position = len(self.ids)
+        self.ids.append(fix_id)
+        self.lng.append(lng)
+        self.lat.append(lat)
+        self.time.append(t)
+        cell = self._cells.get(self._cell(lng, lat))
+        if cell is None:
+            cell = self._cells[self._cell(lng, lat)] = (array('d'), array('q'))
+        cell[0].append(t)
+        cell[1].append(position)
+
+    def _candidate_cells(self, bbox):
+        min_cx, min_cy = self._cell(bbox[0], bbox[1])
+        max_cx, max_cy = self._cell(bbox[2], bbox[3])
+        span = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+        if span > len(self._cells):
+            # Large box: cheaper to test every occupied cell
+            return [cell for (cx, cy), cell in self._cells.items()
+                    if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        cells = []
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    cells.append(cell)
+        return cells
+
+    def query(self, bbox=None, since=None, until=None):
+        """Return ids of fixes inside bbox and [since, until], oldest first.
+
+        Args:
+            bbox: (min_lng, min_lat, max_lng, max_lat), or None for everywhere
+            since, until: Epoch seconds bounds (inclusive), or None
+        """
+        lo = -math.inf if since is None else since
+        hi = math.inf if until is None else until
+        if bbox is None:
+            start = bisect_left(self.time, lo)
+            end = bisect_right(self.time, hi)
+            return list(self.ids[start:end])
+
+        min_lng, min_lat, max_lng, max_lat = bbox
+        lng, lat = self.lng, self.lat
+        positions = []
+        for times, cell_positions in self._candidate_cells(bbox):
+            start = bisect_left(times, lo)
+            end = bisect_right(times, hi)
+            for position in cell_positions[start:end]:
+                if min_lng <= lng[position] <= max_lng and min_lat <= lat[position] <= max_lat:
+                    positions.append(position)
+        positions.sort()
+        return [self.ids[position] for position in positions]
@@ -0,0 +1,105 @@
+"""
+Persistent cache of the last /v1/accounts/{id}/summary response.
+
+The cache lets a freshly started process answer immediately with the last
+known summary (stale-while-revalidate) and lets the next fetch revalidate
+with If-None-Match when the API handed out an ETag.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class SummaryCache:
+    """On-disk summary cache for one account."""
+
+    def __init__(self, path, min_write_interval=60, refresh_interval=None):
+        """
+        Args:
+            path: Cache file path
+            min_write_interval: Minimum seconds between writes, so a fast
+                poller does not rewrite the file every poll
+            refresh_interval: Rewrite an unchanged entry once the fetched_at
+                on disk is this old, so a revalidated summary does not look
+                as old as its last change after a restart (None: never)
+        """
+        self.path = path
+        self.min_write_interval = min_write_interval
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._written_at = 0
+        self._dirty = False
+        self._stored_fetched_at = None
+        self.fetched_at = None
+        self.etag = None
+        self.response = None
+
+    def load(self):
+        """Load the cache file; return True if an entry was found."""
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+            self.fetched_at = entry['fetched_at']
+            self.etag = entry.get('etag')
+            self.response = entry['response']
+            self._stored_fetched_at = self.fetched_at
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def age(self, now=None):
+        """Seconds since the cached response was fetched, or None."""
+        if self.fetched_at is None:
+            return None
+        return (now or time.time()) - self.fetched_at
+
+    def is_usable(self, max_staleness):
+        """Return True if the cached response is no older than max_staleness."""
+        age = self.age()
+        return self.response is not None and age is not None and age <= max_staleness
+
+    def update(self, response, etag=None, now=None):
+        """Record a freshly fetched (or revalidated) response.
+
+        Once min_write_interval has passed since the last write, writes the
+        file if a change is not on disk yet (also one that arrived within
+        the interval), or if the fetched_at on disk is older than
+        refresh_interval.
+        """
+        now = now or time.time()
+        with self._lock:
+            if response != self.response or etag != self.etag:
+                self._dirty = True
+            self.response = response
+            self.etag = etag
+            self.fetched_at = now
+            if now - self._written_at < self.min_write_interval:
+                return
+            if self._dirty or (self.refresh_interval is not None and (
+                    self._stored_fetched_at is None or now - self._stored_fetched_at >= self.refresh_interval)):
+                self._write()
+                self._written_at = now
+
+    def flush(self):
+        """Write the current entry regardless of the write interval."""
+        with self._lock:
+            if self.response is not None and (self._dirty or self.fetched_at != self._stored_fetched_at):
+                self._write()
+                self._written_at = time.time()
+
+    def _write(self):
+        entry = {'fetched_at': self.fetched_at, 'etag': self.etag, 'response': self.response}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._dirty = False
+        self._stored_fetched_at = self.fetched_at
@@ -0,0 +1,14 @@
+"""Tests import the top-level modules from the repository root."""
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# mapit.py star-imports the user's settings.py (credentials, see README),
+# which is not part of the repository
+try:
+    import settings  # noqa: F401
+except ImportError:
+    sys.modules['settings'] = types.ModuleType('settings')
@@ -0,0 +1,17 @@
+import datetime
+
+import pytest
+
+from map_server import parse_time
+
+
+def test_parse_time():
+    utc = datetime.timezone.utc
+    assert parse_time("1700000000") == datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=utc)
+    assert parse_time("2024-01-02T03:04:05") == datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=utc)
+
+
+@pytest.mark.parametrize('value', ["1e20", "-1e20", "inf", "nan", "yesterday"])
+def test_parse_time_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_time(value)
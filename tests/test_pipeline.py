@@ -0,0 +1,45 @@
+import collections
+import time
+
+from pipeline import IngestPipeline
+
+
+def _run(store, items=5, store_retries=2):
+    pipeline = IngestPipeline(lambda polled_at, response: response, store, batch_size=10,
+                              store_retries=store_retries, retry_delay=0)
+    pipeline.start()
+    for n in range(items):
+        pipeline.submit(time.time(), n)
+    assert pipeline.stop(timeout=10)
+    return pipeline.stats()["writer"]
+
+
+def test_failed_store_counts_errors():
+    calls = []
+
+    def store(records):
+        calls.append(list(records))
+        return False  # As Mapit.store_oracle_batch without Oracle
+
+    stats = _run(store)
+    assert stats["items"] == 0
+    assert stats["errors"] == 5
+    # Every batch is tried once and retried twice
+    assert set(collections.Counter(tuple(c) for c in calls).values()) == {3}
+
+
+def test_failed_store_is_retried():
+    stored = []
+    failures = [True, True]
+
+    def store(records):
+        if failures:
+            failures.pop()
+            return False
+        stored.extend(records)
+        return True
+
+    stats = _run(store)
+    assert sorted(stored) == [0, 1, 2, 3, 4]
+    assert stats["items"] == 5
+    assert stats["errors"] == 0
@@ -0,0 +1,61 @@
+import logging
+import threading
+
+import pytest
+import requests
+
+import mapit
+from circuit_breaker import CLOSED, OPEN
+from rate_limit import RequestScheduler
+
+HOST = 'core.prod.mapit.me'
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ''
+
+
+def _client(max_retries=4):
+    """Mapit with only the request path set up (no login, no databases)."""
+    client = mapit.Mapit.__new__(mapit.Mapit)
+    client.logger = logging.getLogger('test')
+    client.debug = False
+    client.try_count = 0
+    client.scheduler = RequestScheduler(rate=100, burst=100, max_retries=max_retries, logger=client.logger)
+    client.request_timeout = 10
+    client._deadline = threading.local()
+    client._breakers = {}
+    client._breakers_lock = threading.Lock()
+    return client
+
+
+def test_deadline_refusals_leave_breaker_closed(monkeypatch):
+    client = _client()
+    sent = []
+    monkeypatch.setattr(requests, 'request', lambda *args, **kwargs: sent.append(args) or _Response(200))
+    client.scheduler.bucket(HOST).pause(60)  # The host asked to slow down
+
+    for _ in range(20):
+        with client.request_deadline(1):
+            with pytest.raises(mapit.DeadlineExceededException):
+                client.sendRequest(HOST + '/v1/summary', {}, method='GET')
+
+    assert sent == []
+    assert client.breaker(HOST).state == CLOSED
+    assert client.breaker(HOST).failures == 0
+
+
+def test_upstream_errors_open_breaker(monkeypatch):
+    client = _client(max_retries=0)
+    monkeypatch.setattr(requests, 'request', lambda *args, **kwargs: _Response(503))
+
+    for _ in range(client.breaker(HOST).failure_threshold):
+        with pytest.raises(mapit.RequestFailedException):
+            client.sendRequest(HOST + '/v1/summary', {}, method='GET')
+
+    assert client.breaker(HOST).state == OPEN
+    with pytest.raises(mapit.CircuitOpenException):
+        client.sendRequest(HOST + '/v1/summary', {}, method='GET')
@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from position import Position, PositionBatch
+from smoothing import KalmanSmoother, reprocess_history, smooth_batch
+
+
+def _track():
+    """Three legs 8 degrees apart, an hour between them, with one re-reported fix."""
+    fixes = []
+    t = 1.7e9
+    lng, lat = 2.0, 41.0
+    for leg in range(3):
+        for i in range(60):
+            t += 10 if i else 0
+            lng += 0.0002 + (i % 3) * 1e-5
+            lat += 0.0001
+            status = 'AT_REST' if i % 20 == 0 else 'MOVING'
+            fixes.append(Position(lng, lat, 40.0, status, 80.0, (None, 1.0, 3.0)[i % 3], 1.0, int(t * 1000)))
+            if i == 5:
+                fixes.append(Position(lng, lat, 40.0, status, 80.0, 1.0, 1.0, int(t * 1000)))
+        t += 3600
+        lng += 8.0
+        lat -= 3.0
+    return fixes
+
+
+@pytest.mark.parametrize('size', [1, 37, 1000])
+def test_batch_matches_live(size):
+    fixes = _track()
+    live = KalmanSmoother()
+    expected = [live.update(p.lng, p.lat, p.hdop, p.last_coord_ts / 1000, p.status) for p in fixes]
+
+    smoother = KalmanSmoother()
+    smoothed = []
+    for start in range(0, len(fixes), size):
+        batch = smooth_batch(PositionBatch.from_positions(fixes[start:start + size]), smoother)
+        smoothed += zip(batch.smooth_lng, batch.smooth_lat, batch.smooth_speed)
+
+    for got, want in zip(smoothed, expected):
+        assert got == pytest.approx(want, abs=1e-9)
+    assert smoother.get_state().time == live.get_state().time
+
+
+def test_reprocess_reads_raw_fixes():
+    class Store:
+        use_smoothed = True
+
+        def iter_positions_after(self, after_id, batch_size, smoothed=None):
+            self.smoothed = smoothed
+            yield PositionBatch.from_positions(_track()[:10])
+
+        def store_smoothed(self, batch):
+            return len(batch)
+
+    store = Store()
+    assert reprocess_history(store, logging.getLogger()) == 10
+    assert store.smoothed is False
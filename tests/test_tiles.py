@@ -0,0 +1,36 @@
+import os
+import time
+
+from tiles import TileCache
+
+TILE = {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"n": "x" * 2000}}]}
+
+
+def _files(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def test_disk_cache_stays_under_size_limit(tmp_path):
+    size = len(TileCache().put((0, 0, 0), TILE))
+    cache = TileCache(directory=str(tmp_path), max_disk_bytes=5 * size)
+
+    for y in range(20):
+        cache.put((10, 1, y), TILE)
+
+    files = _files(tmp_path)
+    assert 0 < len(files) <= 5
+    assert cache.pruned == 20 - len(files)
+    # The most recent tile survives
+    assert os.path.join(tmp_path, "10", "1", "19.geojson.gz") in files
+
+
+def test_expired_tiles_are_pruned(tmp_path):
+    cache = TileCache(directory=str(tmp_path), max_age=60)
+    for y in range(3):
+        cache.put((5, 0, y), TILE)
+    old = time.time() - 120
+    for path in _files(tmp_path)[:2]:
+        os.utime(path, (old, old))
+
+    assert cache.prune() == 2
+    assert len(_files(tmp_path)) == 1
@@ -0,0 +1,270 @@
+"""
+Zoom-aware GeoJSON tiles of the stored location history.
+
+Each tile holds the track segments that fall inside it, simplified with
+Douglas-Peucker to about one pixel at the tile's zoom, so the payload per
+viewport stays bounded however long the history is. Encoded tiles are
+kept gzipped in a memory LRU backed by an on-disk cache, which is pruned
+of expired tiles and kept under a size limit.
+"""
+
+import gzip
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import json_backend
+
+TILE_SIZE = 256
+
+# Below this zoom only every 2**(SAMPLE_ZOOM - z)th row is read from the DB
+SAMPLE_ZOOM = 12
+
+# Consecutive fixes further apart in time start a new segment
+SEGMENT_GAP_SECONDS = 1800
+
+
+def tile_bounds(z, x, y):
+    """Return (min_lng, min_lat, max_lng, max_lat) of a Web Mercator tile."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y))
+
+
+def is_valid_tile(z, x, y):
+    """Return True if z/x/y addresses an existing tile."""
+    return 0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def to_pixels(lng, lat, z):
+    """Project a WGS84 point to global pixel coordinates at zoom z."""
+    scale = TILE_SIZE * 2 ** z
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    siny = math.sin(math.radians(lat))
+    px = (lng + 180.0) / 360.0 * scale
+    py = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return px, py
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of [(x, y, payload), ...].
+
+    Returns the kept points in order. Iterative, so long tracks do not hit
+    the recursion limit.
+    """
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first][0], points[first][1]
+        x2, y2 = points[last][0], points[last][1]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        max_d2, index = -1.0, None
+        for i in range(first + 1, last):
+            px, py = points[i][0] - x1, points[i][1] - y1
+            if seg2 == 0:
+                d2 = px * px + py * py
+            else:
+                cross = px * dy - py * dx
+                d2 = cross * cross / seg2
+            if d2 > max_d2:
+                max_d2, index = d2, i
+        if index is not None and max_d2 > tol2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def sample_stride(z):
+    """Row sampling stride used when reading the DB for zoom z."""
+    return 2 ** max(0, SAMPLE_ZOOM - z)
+
+
+def coordinate_precision(z):
+    """Decimal places needed for sub-pixel precision at zoom z."""
+    return max(0, math.ceil(math.log10(TILE_SIZE * 2 ** z / 360.0))) + 1
+
+
+def build_tile(rows, z, stride=1, tolerance_px=1.0):
+    """Build a GeoJSON FeatureCollection from chronological history rows.
+
+    Args:
+        rows: Chronological dicts with id, lng, lat, speed and time (epoch
+            seconds) keys, as returned by Mapit.get_track_in_bbox
+        z: Zoom level of the tile
+        stride: Sampling stride the rows were read with; ids further apart
+            mean the track left the tile in between
+        tolerance_px: Simplification tolerance in pixels
+    """
+    segments = []
+    current = []
+    previous = None
+    for row in rows:
+        if previous is not None and (
+            row['id'] - previous['id'] > stride
+            or row['time'] - previous['time'] > SEGMENT_GAP_SECONDS
+        ):
+            segments.append(current)
+            current = []
+        px, py = to_pixels(row['lng'], row['lat'], z)
+        current.append((px, py, row))
+        previous = row
+    if current:
+        segments.append(current)
+
+    digits = coordinate_precision(z)
+    features = []
+    for segment in segments:
+        kept = simplify(segment, tolerance_px)
+        coordinates = [[round(p[2]['lng'], digits), round(p[2]['lat'], digits)] for p in kept]
+        if len(coordinates) == 1:
+            geometry = {"type": "Point", "coordinates": coordinates[0]}
+        else:
+            geometry = {"type": "LineString", "coordinates": coordinates}
+        features.append({
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                "start": segment[0][2]['time'],
+                "end": segment[-1][2]['time'],
+                "max_speed": max((p[2]['speed'] or 0) for p in segment),
+                "points": len(segment)
+            }
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class TileCache:
+    """Gzipped tiles in a memory LRU backed by a directory on disk."""
+
+    def __init__(self, directory=None, max_entries=512, max_age=600, max_disk_bytes=256 * 1024 * 1024,
+                 prune_interval=300):
+        """
+        Args:
+            directory: On-disk cache directory (None keeps tiles in memory only)
+            max_entries: Tiles kept in memory
+            max_age: Seconds a cached tile stays valid, since new fixes may
+                land in it
+            max_disk_bytes: Size the on-disk cache is pruned down to,
+                oldest tiles first
+            prune_interval: Seconds between prunes of expired tiles; a put
+                that takes the cache over max_disk_bytes prunes at once
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_interval = prune_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Estimated size of the directory, None until the first prune scans it
+        self._disk_bytes = None
+        self._pruned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+    def _path(self, key):
+        z, x, y = key
+        return os.path.join(self.directory, str(z), str(x), f"{y}.geojson.gz")
+
+    def get(self, key):
+        """Return the gzipped tile for (z, x, y), or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        if self.directory:
+            path = self._path(key)
+            try:
+                created = os.path.getmtime(path)
+                if now - created < self.max_age:
+                    with open(path, 'rb') as f:
+                        body = f.read()
+                    self._remember(key, created, body)
+                    self.hits += 1
+                    return body
+            except OSError:
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key, tile):
+        """Encode, compress and store a tile; return the gzipped bytes."""
+        body = gzip.compress(json_backend.dumps(tile))
+        now = time.time()
+        self._remember(key, now, body)
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_bytes is not None:
+                    self._disk_bytes += len(body)
+                due = (self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+                       or now - self._pruned_at >= self.prune_interval)
+                if due:
+                    self._pruned_at = now
+            if due:
+                self.prune(now)
+        return body
+
+    def prune(self, now=None):
+        """Delete expired tiles, then the oldest ones while the directory exceeds max_disk_bytes.
+
+        Safe against other processes sharing the directory. Returns the
+        number of files deleted.
+        """
+        now = now or time.time()
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.geojson.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for modified, size, path in files:
+            if now - modified < self.max_age and total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:  # Pruned by another process
+                pass
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self.pruned += removed
+        return removed
+
+    def _remember(self, key, created, body):
+        with self._lock:
+            self._entries[key] = (created, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
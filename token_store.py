@@ -0,0 +1,129 @@
+"""
+Shared on-disk store of the Cognito/AWS credentials of one account.
+
+Every mapit.py process of a machine (checker, map server, exports) points
+at the same file, so one login serves all of them:
+
+- Writes go to a temporary file that replaces the store with os.replace,
+  so a reader sees either the old or the new credentials, never a
+  truncated file.
+- Logins are serialized by an exclusive lock on "<path>.lock" (fcntl
+  where available). A process that needs fresh credentials takes the lock
+  and re-reads the store first; if another process refreshed it in the
+  meantime, those credentials are adopted instead of logging in again.
+- Entries carry the time the credentials expire, so a reader skips
+  expired credentials instead of discovering them through a 403.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Lifetime of the Cognito ID token, which bounds the session even when the
+# AWS credentials last longer
+ID_TOKEN_LIFETIME = 3600
+
+
+class TokenStore:
+    """Atomic, locked token file shared by the processes of one account."""
+
+    def __init__(self, path, refresh_margin=60):
+        """
+        Args:
+            path: Store file; made absolute so every process resolves the
+                same file regardless of its working directory
+            refresh_margin: Seconds before expiry at which credentials
+                count as expired
+        """
+        self.path = os.path.abspath(path)
+        self.refresh_margin = refresh_margin
+        self._thread_lock = threading.Lock()
+        self.logins = 0
+        self.reused = 0
+
+    def load(self, username=None, now=None):
+        """Return the stored tokens if present, valid JSON, of username and unexpired; else None."""
+        try:
+            with open(self.path, 'r') as f:
+                tokens = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(tokens, dict):
+            return None
+        if username is not None and tokens.get('username') not in (None, username):
+            return None
+        if not self.is_fresh(tokens, now):
+            return None
+        return tokens
+
+    def is_fresh(self, tokens, now=None):
+        """Whether tokens expire more than refresh_margin from now.
+
+        Entries written before expiry was recorded have none and count as
+        fresh; the API answers 403 once they are not.
+        """
+        expires_at = tokens.get('expires_at')
+        return expires_at is None or (now or time.time()) < expires_at - self.refresh_margin
+
+    def save(self, tokens):
+        """Atomically replace the store, readable by the owner only."""
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's exclusive lock (across processes where fcntl exists)."""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self, login, username=None, stale=None):
+        """Return fresh tokens, logging in only if no other process already did.
+
+        Args:
+            login: Callable returning a new tokens dict (with expires_at)
+            username: Account the tokens must belong to
+            stale: session_token known to be rejected; stored tokens with
+                it are not adopted even if they look unexpired
+
+        Under the lock, the store is re-read: credentials that another
+        process wrote while this one waited are reused.
+        """
+        with self.locked():
+            tokens = self.load(username)
+            if tokens is not None and (stale is None or tokens.get('session_token') != stale):
+                self.reused += 1
+                return tokens
+            tokens = login()
+            if username is not None:
+                tokens['username'] = username
+            self.save(tokens)
+            self.logins += 1
+            return tokens
+
+    def stats(self):
+        return {"path": self.path, "logins": self.logins, "reused": self.reused}
@@ -0,0 +1,238 @@
+"""
+Streaming GPX and FlatGeobuf exports.
+
+Both writers consume the history as chronological PositionBatch chunks
+(Mapit.iter_positions), so memory stays bounded by one chunk no
+matter how long the exported range is.
+
+GPX gets one <trk> per trip, as detected by ingest_filter.TripTracker,
+and a new <trkseg> whenever the fixes of a trip are further apart than
+the gap (lost signal, tunnel), which is how route planners expect
+recorded tracks. FlatGeobuf is written through GDAL (pyogrio, or fiona),
+which appends the packed Hilbert R-tree when the file is closed so GIS
+tools can read any area of it without scanning the whole file.
+"""
+
+import datetime
+import struct
+from xml.sax.saxutils import escape
+
+from ingest_filter import TripTracker
+
+try:
+    import pyarrow
+    import pyogrio.raw
+except ImportError:
+    pyogrio = None
+
+try:
+    import fiona
+except ImportError:
+    fiona = None
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="mapit" xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2">\n'
+)
+
+# The datetime field goes last, in the schema and in every record:
+# fiona 1.10 passes a text field that follows it to the datetime parser
+FGB_SCHEMA = {
+    'geometry': 'Point',
+    'properties': {
+        'id': 'int',
+        'speed': 'float',
+        'status': 'str',
+        'battery': 'float',
+        'hdop': 'float',
+        'odometer': 'float',
+        'trip': 'int',
+        'timestamp': 'datetime',
+    },
+}
+
+if pyogrio is not None:
+    _ARROW_SCHEMA = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('speed', pyarrow.float64()),
+        ('status', pyarrow.string()),
+        ('battery', pyarrow.float64()),
+        ('hdop', pyarrow.float64()),
+        ('odometer', pyarrow.float64()),
+        ('trip', pyarrow.int32()),
+        ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+        ('geometry', pyarrow.binary()),
+    ])
+
+
+def _utc(timestamp):
+    return timestamp.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class GpxTrackWriter:
+    """Write chronological fixes to a GPX file, one track per trip."""
+
+    def __init__(self, f, gap_seconds=300, name="Vehicle Tracking History", geocoder=None):
+        """
+        Args:
+            f: Text file open for writing
+            gap_seconds: Start a new track segment when two fixes of a
+                trip are further apart than this
+            name: Name of the GPX metadata
+            geocoder: Optional ReverseGeocoder adding the start and end
+                places to track names and descriptions
+        """
+        self._f = f
+        self.gap_seconds = gap_seconds
+        self._trips = TripTracker(geocoder)
+        self._in_trip = False
+        self._last_time = None
+        self.trips = 0
+        self.segments = 0
+        self.points = 0
+        f.write(GPX_HEADER)
+        f.write(f"<metadata><name>{escape(name)}</name></metadata>\n")
+
+    def write(self, batch):
+        """Write a chronological PositionBatch; fixes outside trips are skipped."""
+        parts = []
+        for lng, lat, speed, status, hdop, timestamp in zip(batch.lng, batch.lat, batch.speed, batch.status,
+                                                            batch.hdop, batch.timestamp):
+            if timestamp is None:
+                continue
+            now = timestamp.timestamp()
+            event = self._trips.update(lng, lat, status, now)
+            if event is not None and event["event"] == "start":
+                self.trips += 1
+                self.segments += 1
+                self._in_trip = True
+                place = f" from {escape(event['place'])}" if event.get("place") else ""
+                parts.append(f"<trk><name>Trip {self.trips}{place} ({_utc(timestamp)})</name><trkseg>\n")
+            elif not self._in_trip:
+                continue
+            elif now - self._last_time > self.gap_seconds:
+                self.segments += 1
+                parts.append("</trkseg><trkseg>\n")
+            self._last_time = now
+
+            point = f'<trkpt lat="{lat}" lon="{lng}"><time>{_utc(timestamp)}</time>'
+            if hdop is not None:
+                point += f"<hdop>{hdop}</hdop>"
+            if speed is not None:
+                # TrackPointExtension speeds are in m/s
+                point += (f"<extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>{speed / 3.6:.2f}"
+                          "</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions>")
+            parts.append(point + "</trkpt>\n")
+            self.points += 1
+
+            if event is not None and event["event"] == "end":
+                place = f" to {escape(event['end_place'])}" if event.get("end_place") else ""
+                parts.append(f"</trkseg><desc>{event['distance_m'] / 1000:.1f} km in "
+                             f"{event['duration'] / 60:.0f} min{place}</desc></trk>\n")
+                self._in_trip = False
+        self._f.write("".join(parts))
+
+    def close(self):
+        """Close a trip still in progress and end the document."""
+        if self._in_trip:
+            self._f.write("</trkseg></trk>\n")
+            self._in_trip = False
+        self._f.write("</gpx>\n")
+
+
+def write_gpx(batches, filepath, gap_seconds=300, geocoder=None):
+    """Stream chronological PositionBatch chunks to a GPX file.
+
+    Returns a dict with the number of trips, segments and points written.
+    """
+    with open(filepath, 'w', encoding='utf-8') as f:
+        writer = GpxTrackWriter(f, gap_seconds, geocoder=geocoder)
+        for batch in batches:
+            writer.write(batch)
+        writer.close()
+    return {"trips": writer.trips, "segments": writer.segments, "points": writer.points}
+
+
+class _TripNumbers:
+    """Number the trips of chronological fixes across batches."""
+
+    def __init__(self):
+        self._trips = TripTracker()
+        self.trips = 0
+        self._in_trip = False
+
+    def label(self, batch):
+        """Return the trip number of each fix of batch, None while parked."""
+        labels = []
+        for lng, lat, status, timestamp in zip(batch.lng, batch.lat, batch.status, batch.timestamp):
+            event = self._trips.update(lng, lat, status, timestamp.timestamp()) if timestamp else None
+            if event is not None and event["event"] == "start":
+                self.trips += 1
+                self._in_trip = True
+            labels.append(self.trips if self._in_trip else None)
+            if event is not None and event["event"] == "end":
+                self._in_trip = False
+        return labels
+
+
+def _arrow_batches(batches, numbers):
+    """Convert PositionBatch chunks to Arrow record batches with WKB points."""
+    point = struct.Struct('<BIdd').pack  # Little-endian WKB Point
+    for batch in batches:
+        yield pyarrow.record_batch([
+            pyarrow.array(batch.id, pyarrow.int64()),
+            pyarrow.array(batch.speed, pyarrow.float64()),
+            pyarrow.array(batch.status, pyarrow.string()),
+            pyarrow.array(batch.battery, pyarrow.float64()),
+            pyarrow.array(batch.hdop, pyarrow.float64()),
+            pyarrow.array(batch.odometer, pyarrow.float64()),
+            pyarrow.array(numbers.label(batch), pyarrow.int32()),
+            pyarrow.array(batch.timestamp, pyarrow.timestamp('us', tz='UTC')),
+            pyarrow.array([point(1, 1, lng, lat) for lng, lat in zip(batch.lng, batch.lat)], pyarrow.binary()),
+        ], schema=_ARROW_SCHEMA)
+
+
+def write_flatgeobuf(batches, filepath):
+    """Stream chronological PositionBatch chunks to an indexed FlatGeobuf file.
+
+    Every fix becomes a point with its trip number (None while parked).
+    Uses pyogrio's Arrow writer when installed, fiona otherwise. Returns a
+    dict with the number of trips and points written.
+    """
+    numbers = _TripNumbers()
+    points = 0
+
+    def counted(batches):
+        nonlocal points
+        for batch in batches:
+            points += len(batch)
+            yield batch
+
+    if pyogrio is not None:
+        reader = pyarrow.RecordBatchReader.from_batches(_ARROW_SCHEMA, _arrow_batches(counted(batches), numbers))
+        pyogrio.raw.write_arrow(reader, filepath, driver='FlatGeobuf', geometry_name='geometry',
+                                geometry_type='Point', crs='EPSG:4326', layer_options={'SPATIAL_INDEX': 'YES'})
+        return {"trips": numbers.trips, "points": points}
+    if fiona is None:
+        raise ValueError("FlatGeobuf export needs pyogrio or fiona. Run: pip install pyogrio")
+
+    with fiona.open(filepath, 'w', driver='FlatGeobuf', schema=FGB_SCHEMA, crs='EPSG:4326',
+                    SPATIAL_INDEX='YES') as dst:
+        for batch in counted(batches):
+            dst.writerecords([{
+                'geometry': {'type': 'Point', 'coordinates': (lng, lat)},
+                'properties': {
+                    'id': row_id,
+                    'speed': speed,
+                    'status': status,
+                    'battery': battery,
+                    'hdop': hdop,
+                    'odometer': odometer,
+                    'trip': trip,
+                    'timestamp': timestamp.isoformat() if timestamp else None,
+                },
+            } for row_id, lng, lat, speed, status, battery, hdop, odometer, trip, timestamp in zip(
+                batch.id, batch.lng, batch.lat, batch.speed, batch.status, batch.battery, batch.hdop,
+                batch.odometer, numbers.label(batch), batch.timestamp)])
+    return {"trips": numbers.trips, "points": points}